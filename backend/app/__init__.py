@@ -136,6 +136,10 @@ def create_app(config_name=None):
     from app.utils.error_handlers import register_error_handlers
     register_error_handlers(app)
     
+    # CLI commands (flask feedback ...)
+    from app.commands import register_commands
+    register_commands(app)
+    
     # Health check endpoint
     @app.route('/api/health')
     def health_check():
@@ -0,0 +1,43 @@
+"""
+Flask CLI commands.
+
+    flask feedback ingest <mbox or maildir>...
+"""
+
+import time
+import click
+from flask.cli import AppGroup
+from app.services.feedback_ingest import FEEDBACK_BATCH_SIZE, FeedbackIngestor
+
+feedback_cli = AppGroup('feedback', help='Asynchronous delivery feedback (bounces and complaints).')
+
+
+@feedback_cli.command('ingest')
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True))
+@click.option('--batch-size', default=FEEDBACK_BATCH_SIZE, show_default=True, help='Reports applied per commit.')
+@click.option('--dry-run', is_flag=True, help='Parse and match reports without changing anything.')
+def ingest_feedback(paths, batch_size, dry_run):
+    """Apply DSN bounce reports and ARF complaints from mbox files or maildirs."""
+    ingestor = FeedbackIngestor(batch_size=batch_size, dry_run=dry_run)
+    started = time.monotonic()
+    for path in paths:
+        ingestor.ingest(path)
+        click.echo(f"{path}: {ingestor.stats.messages} messages read so far")
+    ingestor.finish()
+
+    elapsed = time.monotonic() - started
+    stats = ingestor.stats
+    click.echo(
+        f"{stats.messages} messages in {elapsed:.1f}s ({stats.messages / elapsed if elapsed else 0:.0f}/s): "
+        f"{stats.reports} reports, {stats.ignored} ignored, {stats.errors} errors"
+    )
+    click.echo(
+        f"{stats.events} events: {stats.bounces} bounces, {stats.complaints} complaints, "
+        f"{stats.matched} matched, {stats.unmatched} unmatched, {stats.suppressed} newly suppressed"
+        + (" (dry run, nothing changed)" if dry_run else "")
+    )
+
+
+def register_commands(app):
+    """Register CLI commands with the Flask application."""
+    app.cli.add_command(feedback_cli)
@@ -6,11 +6,12 @@ from .smtp_account import SMTPAccount, UserSMTPAssignment
 from .upload import Upload
 from .email_log import EmailLog, LinkClick
 from .refresh_token import RefreshToken
+from .suppression import Suppression
 
 # Keep old models for migration purposes - will be removed later
 from .smtp_config import SMTPConfig
 
 __all__ = [
     'User', 'Campaign', 'Contact', 'SMTPAccount', 'UserSMTPAssignment',
-    'Upload', 'EmailLog', 'LinkClick', 'RefreshToken', 'SMTPConfig'
+    'Upload', 'EmailLog', 'LinkClick', 'RefreshToken', 'Suppression', 'SMTPConfig'
 ]
\ No newline at end of file
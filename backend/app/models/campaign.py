@@ -20,6 +20,7 @@ class Campaign(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     smtp_account_id = db.Column(db.Integer, db.ForeignKey('smtp_accounts.id'), nullable=True)  # Which SMTP to use
+    use_smtp_pool = db.Column(db.Boolean, default=False)  # Also send through the owner's other assigned SMTP accounts
     
     # Campaign details
     name = db.Column(db.String(200), nullable=False)
@@ -32,10 +33,18 @@ class Campaign(db.Model):
     html_content = db.Column(db.Text)
     text_content = db.Column(db.Text)
     
+    # Compiled content used for sending (see ContentCompiler)
+    compiled_html = db.Column(db.Text)
+    compiled_text = db.Column(db.Text)
+    content_hash = db.Column(db.String(64))  # Hash of the content it was compiled from
+    compiled_at = db.Column(db.DateTime)
+    
     # Campaign settings
     status = db.Column(db.Enum(CampaignStatus), default=CampaignStatus.DRAFT)
     scheduled_at = db.Column(db.DateTime)
     send_immediately = db.Column(db.Boolean, default=False)
+    max_send_attempts = db.Column(db.Integer)  # Per recipient, for temporary failures (None = SEND_MAX_ATTEMPTS)
+    send_time_limit = db.Column(db.Integer)  # Seconds a send may run before it is paused (None = SEND_TIME_LIMIT)
     
     # Analytics
     total_recipients = db.Column(db.Integer, default=0)
@@ -45,6 +54,7 @@ class Campaign(db.Model):
     emails_clicked = db.Column(db.Integer, default=0)
     emails_bounced = db.Column(db.Integer, default=0)
     emails_failed = db.Column(db.Integer, default=0)
+    bytes_sent = db.Column(db.BigInteger, default=0)  # SMTP bytes on the wire
     
     # Timestamps
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -54,6 +64,7 @@ class Campaign(db.Model):
     
     # Relationships
     recipients = db.relationship('CampaignRecipient', backref='campaign', lazy=True, cascade='all, delete-orphan')
+    attachments = db.relationship('CampaignAttachment', backref='campaign', lazy=True, cascade='all, delete-orphan')
     smtp_account = db.relationship('SMTPAccount', back_populates='campaigns')
     
     def __init__(self, user_id, name, subject, **kwargs):
@@ -95,7 +106,7 @@ class Campaign(db.Model):
     def can_be_sent(self):
         """Check if campaign can be sent."""
         return (
-            self.status in [CampaignStatus.DRAFT, CampaignStatus.SCHEDULED] and
+            self.status in [CampaignStatus.DRAFT, CampaignStatus.SCHEDULED, CampaignStatus.PAUSED] and
             self.subject and
             (self.html_content or self.text_content) and
             self.sender_email
@@ -116,6 +127,9 @@ class Campaign(db.Model):
             'status': self.status.value if self.status else None,
             'scheduled_at': self.scheduled_at.isoformat() if self.scheduled_at else None,
             'send_immediately': self.send_immediately,
+            'max_send_attempts': self.max_send_attempts,
+            'send_time_limit': self.send_time_limit,
+            'use_smtp_pool': bool(self.use_smtp_pool),
             'total_recipients': self.total_recipients,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
@@ -131,6 +145,7 @@ class Campaign(db.Model):
                 'emails_clicked': self.emails_clicked,
                 'emails_bounced': self.emails_bounced,
                 'emails_failed': self.emails_failed,
+                'bytes_sent': self.bytes_sent,
                 'open_rate': self.open_rate,
                 'click_rate': self.click_rate,
                 'bounce_rate': self.bounce_rate,
@@ -147,6 +162,9 @@ class CampaignRecipient(db.Model):
     """Model for tracking individual email recipients per campaign."""
     
     __tablename__ = 'campaign_recipients'
+    __table_args__ = (
+        db.UniqueConstraint('campaign_id', 'contact_id', name='uq_campaign_recipients_campaign_contact'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     campaign_id = db.Column(db.Integer, db.ForeignKey('campaigns.id'), nullable=False)
@@ -160,6 +178,10 @@ class CampaignRecipient(db.Model):
     email_bounced = db.Column(db.Boolean, default=False)
     email_failed = db.Column(db.Boolean, default=False)
     
+    # Send ledger claim: token of the send reserving this recipient (see SendLedger)
+    claim_token = db.Column(db.String(32), index=True)
+    claimed_at = db.Column(db.DateTime)
+    
     # Error tracking
     error_message = db.Column(db.Text)
     bounce_reason = db.Column(db.String(500))
@@ -190,4 +212,40 @@ class CampaignRecipient(db.Model):
             'opened_at': self.opened_at.isoformat() if self.opened_at else None,
             'clicked_at': self.clicked_at.isoformat() if self.clicked_at else None,
             'bounced_at': self.bounced_at.isoformat() if self.bounced_at else None,
-        }
\ No newline at end of file
+        }
+
+
+class CampaignAttachment(db.Model):
+    """File attached to every message of a campaign."""
+    
+    __tablename__ = 'campaign_attachments'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    campaign_id = db.Column(db.Integer, db.ForeignKey('campaigns.id'), nullable=False, index=True)
+    
+    # Uploaded file
+    original_filename = db.Column(db.String(255), nullable=False)
+    file_path = db.Column(db.String(500), nullable=False)
+    file_size = db.Column(db.Integer)  # in bytes
+    mime_type = db.Column(db.String(100))
+    
+    # MIME part (headers + base64 body) encoded once at upload time
+    encoded_path = db.Column(db.String(500))
+    encoded_size = db.Column(db.Integer)
+    
+    uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        """Convert attachment object to dictionary."""
+        return {
+            'id': self.id,
+            'campaign_id': self.campaign_id,
+            'filename': self.original_filename,
+            'file_size': self.file_size,
+            'mime_type': self.mime_type,
+            'encoded_size': self.encoded_size,
+            'uploaded_at': self.uploaded_at.isoformat() if self.uploaded_at else None,
+        }
+    
+    def __repr__(self):
+        return f'<CampaignAttachment {self.original_filename}>'
@@ -45,13 +45,17 @@ class EmailLog(db.Model):
     bounce_reason = db.Column(db.Text)
     bounce_diagnostic = db.Column(db.Text)
     
+    # Retry queue: delivery attempts so far and when a soft bounce is retried next
+    attempts = db.Column(db.Integer, default=1)
+    next_retry_at = db.Column(db.DateTime, index=True)
+    
     # Tracking information
     tracking_id = db.Column(db.String(64), unique=True, nullable=False)  # Unique ID for tracking links
     user_agent = db.Column(db.String(500))
     ip_address = db.Column(db.String(45))
     
     # Email metadata
-    message_id = db.Column(db.String(255))  # SMTP message ID
+    message_id = db.Column(db.String(255), index=True)  # SMTP message ID
     subject = db.Column(db.String(500))
     
     # Timestamps
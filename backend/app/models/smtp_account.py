@@ -23,6 +23,8 @@ class SMTPAccount(db.Model):
     username = db.Column(db.String(255), nullable=False)
     password = db.Column(db.String(500), nullable=False)  # Should be encrypted in production
     encryption = db.Column(db.String(20), default='tls')  # tls, ssl, none
+    transport = db.Column(db.String(20), default='smtp', server_default='smtp')  # smtp, maildir, mbox, http
+    transport_url = db.Column(db.String(500))  # Sink path (maildir/mbox) or batch API endpoint (http)
     
     # Sender Information
     from_name = db.Column(db.String(100), nullable=False)  # Display name in emails
@@ -39,6 +41,22 @@ class SMTPAccount(db.Model):
     daily_limit = db.Column(db.Integer)  # Max emails per day (null = unlimited)
     emails_sent_today = db.Column(db.Integer, default=0)
     total_emails_sent = db.Column(db.Integer, default=0)
+    max_recipients_per_message = db.Column(db.Integer)  # RCPT TO cap per transaction for identical bodies (null = default)
+    
+    # Seconds to wait on the server (null = SMTP_CONNECT_TIMEOUT / SMTP_COMMAND_TIMEOUT / SMTP_DATA_TIMEOUT)
+    connect_timeout = db.Column(db.Integer)  # TCP connect, TLS and login
+    command_timeout = db.Column(db.Integer)  # Reply to each command
+    data_timeout = db.Column(db.Integer)  # Message upload and the reply to it
+    
+    # Delivery limits learned by the adaptive (AIMD) controller, used as the next campaign's starting point
+    adaptive_concurrency = db.Column(db.Float)  # Deliveries in flight at once (null = SEND_ACCOUNT_INITIAL_CONCURRENCY)
+    adaptive_rate = db.Column(db.Float)  # Messages per second (null = unlimited)
+    adaptive_updated_at = db.Column(db.DateTime)
+    
+    # DKIM signing (disabled unless domain, selector and key are all set)
+    dkim_domain = db.Column(db.String(255))  # d= tag, e.g. "example.com"
+    dkim_selector = db.Column(db.String(63))  # s= tag; public key lives at <selector>._domainkey.<domain>
+    dkim_private_key = db.Column(db.Text)  # PEM RSA key - should be encrypted in production
     
     # Audit
     created_by_admin_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -61,6 +79,8 @@ class SMTPAccount(db.Model):
             'port': self.port,
             'username': self.username,
             'encryption': self.encryption,
+            'transport': self.transport or 'smtp',
+            'transport_url': self.transport_url,
             'from_name': self.from_name,
             'from_email': self.from_email,
             'reply_to_email': self.reply_to_email,
@@ -71,6 +91,16 @@ class SMTPAccount(db.Model):
             'daily_limit': self.daily_limit,
             'emails_sent_today': self.emails_sent_today,
             'total_emails_sent': self.total_emails_sent,
+            'max_recipients_per_message': self.max_recipients_per_message,
+            'connect_timeout': self.connect_timeout,
+            'command_timeout': self.command_timeout,
+            'data_timeout': self.data_timeout,
+            'adaptive_concurrency': self.adaptive_concurrency,
+            'adaptive_rate': self.adaptive_rate,
+            'adaptive_updated_at': self.adaptive_updated_at.isoformat() if self.adaptive_updated_at else None,
+            'dkim_domain': self.dkim_domain,
+            'dkim_selector': self.dkim_selector,
+            'dkim_enabled': bool(self.dkim_domain and self.dkim_selector and self.dkim_private_key),
             'created_by_admin_id': self.created_by_admin_id,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
@@ -78,8 +108,10 @@ class SMTPAccount(db.Model):
         
         if include_password:
             data['password'] = self.password
+            data['dkim_private_key'] = self.dkim_private_key
         else:
             data['password'] = '••••••••' if self.password else None
+            data['dkim_private_key'] = '••••••••' if self.dkim_private_key else None
             
         return data
     
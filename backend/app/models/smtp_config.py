@@ -113,12 +113,14 @@ class SMTPConfig(db.Model):
         try:
             import smtplib
             from email.mime.text import MIMEText
+            from app.services.transports import transport_timeouts
             
-            # Create SMTP connection
+            # Create SMTP connection (the connect timeout covers the whole test)
+            timeout = transport_timeouts(self).connect
             if self.encryption == 'ssl':
-                server = smtplib.SMTP_SSL(self.host, self.port)
+                server = smtplib.SMTP_SSL(self.host, self.port, timeout=timeout)
             else:
-                server = smtplib.SMTP(self.host, self.port)
+                server = smtplib.SMTP(self.host, self.port, timeout=timeout)
                 if self.encryption == 'tls':
                     server.starttls()
             
@@ -0,0 +1,49 @@
+from datetime import datetime
+from enum import Enum as PyEnum
+from app import db
+
+class SuppressionReason(PyEnum):
+    """Why an address must not be mailed."""
+    HARD_BOUNCE = "hard_bounce"
+    COMPLAINT = "complaint"
+    UNSUBSCRIBE = "unsubscribe"
+
+class Suppression(db.Model):
+    """
+    Suppressed email address.
+    
+    Entries without a user apply to every user (hard bounces: the address does
+    not exist); the others only to the user whose recipient complained or
+    unsubscribed.
+    """
+    
+    __tablename__ = 'suppressions'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'email', name='uq_suppressions_user_email'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=True, index=True)
+    email = db.Column(db.String(120), nullable=False, index=True)
+    reason = db.Column(db.Enum(SuppressionReason), nullable=False)
+    
+    # Where it came from: the campaign that bounced / was unsubscribed from, and the bounce diagnostic
+    campaign_id = db.Column(db.Integer, db.ForeignKey('campaigns.id', ondelete='SET NULL'), nullable=True)
+    detail = db.Column(db.Text)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        """Convert suppression to dictionary."""
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'email': self.email,
+            'reason': self.reason.value if self.reason else None,
+            'campaign_id': self.campaign_id,
+            'detail': self.detail,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+    
+    def __repr__(self):
+        return f'<Suppression {self.email} ({self.reason.value if self.reason else None})>'
@@ -1,22 +1,28 @@
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 from flask import Blueprint, request, jsonify, g
 from app import db
-from app.models.campaign import Campaign, CampaignStatus, CampaignRecipient
+from app.models.campaign import Campaign, CampaignStatus, CampaignRecipient, CampaignAttachment
 from app.models.contact import Contact, ContactStatus
 from app.models.smtp_settings import SMTPSettings
 from app.models.email_log import EmailLog, EmailStatus
 from app.models.notification import NotificationType
 from app.middleware.auth import authenticated_required, can_create_campaigns
+from app.services.email_service import EmailService
 from app.services.email_tracking_service import EmailTrackingService
+from app.services.audience_service import AudienceService
+from app.services.attachment_service import AttachmentService
+from app.services.content_compiler import ContentCompiler
+from app.services.message_spool import MessageSpool
+from app.services.message_template import MessageTemplate
+from app.services.send_control import SendControl
+from app.services.smtp_client import Envelope
+from app.services.transports import SMTPTransport, transport_timeouts
 from app.routes.notifications import create_notification
 from datetime import datetime
 from sqlalchemy import func
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-import ssl
 
 bp = Blueprint('campaigns', __name__)
 
@@ -142,6 +148,23 @@ def create_campaign():
             except (ValueError, TypeError) as e:
                 return jsonify({'success': False, 'error': f'Invalid scheduled_at format: {str(e)}'}), 400
         
+        # Delivery attempts per recipient for temporary failures (default: SEND_MAX_ATTEMPTS)
+        max_send_attempts = data.get('max_send_attempts')
+        if max_send_attempts is not None:
+            if not isinstance(max_send_attempts, int) or max_send_attempts < 1:
+                return jsonify({'success': False, 'error': 'max_send_attempts must be a positive integer'}), 400
+        
+        # Seconds the send may run before it is paused (default: SEND_TIME_LIMIT)
+        send_time_limit = data.get('send_time_limit')
+        if send_time_limit is not None:
+            if not isinstance(send_time_limit, int) or send_time_limit < 1:
+                return jsonify({'success': False, 'error': 'send_time_limit must be a positive integer'}), 400
+        
+        # Spread the send over every SMTP account assigned to the user
+        use_smtp_pool = data.get('use_smtp_pool', False)
+        if not isinstance(use_smtp_pool, bool):
+            return jsonify({'success': False, 'error': 'use_smtp_pool must be a boolean'}), 400
+        
         # Determine campaign status
         status = CampaignStatus.SCHEDULED if scheduled_at else CampaignStatus.DRAFT
         
@@ -158,6 +181,9 @@ def create_campaign():
             text_content=data.get('text_content', ''),
             send_immediately=send_immediately,
             scheduled_at=scheduled_at,
+            max_send_attempts=max_send_attempts,
+            send_time_limit=send_time_limit,
+            use_smtp_pool=use_smtp_pool,
             status=status
         )
         
@@ -165,41 +191,14 @@ def create_campaign():
         db.session.add(campaign)
         db.session.flush()  # Get campaign ID
         
-        # If recipients are specified, create CampaignRecipient records
+        # Minify, inline CSS and build the text alternative once, at save time
+        ContentCompiler.compile_campaign(campaign)
+        
+        # If recipients are specified, resolve them in bulk into CampaignRecipient records
         if 'recipients' in data and data['recipients']:
-            recipients = data['recipients'].split(',')
-            valid_recipients = [r.strip() for r in recipients if r.strip()]
-            campaign.total_recipients = len(valid_recipients)
-            
-            # Create or find contacts and add them as campaign recipients
-            from app.models.contact import Contact, ContactStatus
-            from app.models.campaign import CampaignRecipient
-            
-            for email in valid_recipients:
-                # Try to find existing contact first
-                contact = Contact.query.filter_by(email=email, user_id=current_user.id).first()
-                
-                # If contact doesn't exist, create a new one
-                if not contact:
-                    # Extract name from email if possible
-                    name_part = email.split('@')[0].replace('.', ' ').replace('_', ' ').title()
-                    
-                    contact = Contact(
-                        user_id=current_user.id,
-                        email=email,
-                        first_name=name_part,
-                        status=ContactStatus.ACTIVE,
-                        subscribed=True
-                    )
-                    db.session.add(contact)
-                    db.session.flush()  # Get contact ID
-                
-                # Create campaign recipient record
-                campaign_recipient = CampaignRecipient(
-                    campaign_id=campaign.id,
-                    contact_id=contact.id
-                )
-                db.session.add(campaign_recipient)
+            campaign.total_recipients = AudienceService.sync_campaign_audience(
+                campaign.id, current_user.id, data['recipients']
+            )
         
         db.session.commit()
         
@@ -260,6 +259,9 @@ def send_campaign(campaign_id):
         if campaign.status == CampaignStatus.SENT:
             return jsonify({'success': False, 'error': 'Campaign already sent'}), 400
         
+        if campaign.status == CampaignStatus.CANCELLED:
+            return jsonify({'success': False, 'error': 'Campaign was cancelled and cannot be sent'}), 400
+        
         # Check if campaign is scheduled for future sending
         if campaign.status == CampaignStatus.SCHEDULED and campaign.scheduled_at:
             now = datetime.utcnow()
@@ -292,6 +294,16 @@ def send_campaign(campaign_id):
             user_id=campaign.user_id
         )
         
+        # Paused or cancelled while sending: the service kept the requested status
+        if success and results.get('stopped'):
+            return jsonify({
+                'success': True,
+                'message': message,
+                'status': results['stopped'],
+                'sent_count': results.get('successful_sends', 0),
+                'total_recipients': results.get('total_recipients', 0)
+            })
+        
         # Update final status based on results
         if success:
             successful_sends = results.get('successful_sends', 0)
@@ -350,6 +362,114 @@ def send_campaign(campaign_id):
         logger.error(f"Error sending campaign: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@bp.route('/<int:campaign_id>/pause', methods=['POST'])
+@authenticated_required
+def pause_campaign(campaign_id):
+    """Pause a campaign that is being sent; it stops after the batches in flight."""
+    try:
+        campaign = Campaign.query.get_or_404(campaign_id)
+        
+        current_user = g.current_user
+        if not current_user.is_admin() and campaign.user_id != current_user.id:
+            return jsonify({'success': False, 'error': 'You do not have permission to pause this campaign'}), 403
+        
+        if campaign.status != CampaignStatus.SENDING:
+            return jsonify({'success': False, 'error': f'Only sending campaigns can be paused (status is {campaign.status.value})'}), 400
+        
+        # The status reaches senders in other processes, the request this one
+        campaign.status = CampaignStatus.PAUSED
+        db.session.commit()
+        SendControl.request(campaign_id, CampaignStatus.PAUSED)
+        
+        return jsonify({
+            'success': True,
+            'message': f'Campaign "{campaign.name}" is pausing',
+            'campaign': campaign.to_dict()
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error pausing campaign: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@bp.route('/<int:campaign_id>/resume', methods=['POST'])
+@authenticated_required
+def resume_campaign(campaign_id):
+    """Resume a paused campaign from where it stopped."""
+    try:
+        campaign = Campaign.query.get_or_404(campaign_id)
+        
+        current_user = g.current_user
+        if not current_user.is_admin() and campaign.user_id != current_user.id:
+            return jsonify({'success': False, 'error': 'You do not have permission to resume this campaign'}), 403
+        
+        if campaign.status != CampaignStatus.PAUSED:
+            return jsonify({'success': False, 'error': f'Only paused campaigns can be resumed (status is {campaign.status.value})'}), 400
+        
+        # Tracked sends keep a spool until they finish and resume from its checkpoint;
+        # other sends resume with the recipients not yet recorded
+        if os.path.isdir(MessageSpool.campaign_path(campaign_id)):
+            success, message, results = EmailTrackingService.send_campaign_with_tracking(
+                campaign_id=campaign_id,
+                user_id=campaign.user_id
+            )
+        else:
+            success, message, results = EmailService.send_campaign(campaign_id, campaign.user_id)
+        
+        if not success:
+            return jsonify({'success': False, 'error': message}), 500
+        
+        return jsonify({
+            'success': True,
+            'message': message,
+            'status': campaign.status.value,
+            'sent_count': results.get('successful_sends', 0),
+            'failed_count': results.get('failed_sends', 0),
+            'total_recipients': results.get('total_recipients', 0)
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error resuming campaign: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@bp.route('/<int:campaign_id>/cancel', methods=['POST'])
+@authenticated_required
+def cancel_campaign(campaign_id):
+    """Cancel a sending, paused or scheduled campaign; unsent recipients are never sent."""
+    try:
+        campaign = Campaign.query.get_or_404(campaign_id)
+        
+        current_user = g.current_user
+        if not current_user.is_admin() and campaign.user_id != current_user.id:
+            return jsonify({'success': False, 'error': 'You do not have permission to cancel this campaign'}), 403
+        
+        if campaign.status not in [CampaignStatus.SENDING, CampaignStatus.PAUSED, CampaignStatus.SCHEDULED]:
+            return jsonify({'success': False, 'error': f'Campaign cannot be cancelled (status is {campaign.status.value})'}), 400
+        
+        sending = campaign.status == CampaignStatus.SENDING
+        campaign.status = CampaignStatus.CANCELLED
+        campaign.completed_at = datetime.utcnow()
+        db.session.commit()
+        
+        if sending:
+            # The running send stops and discards its spool
+            SendControl.request(campaign_id, CampaignStatus.CANCELLED)
+        else:
+            MessageSpool.discard_campaign(campaign_id)
+            EmailTrackingService.cancel_undelivered_logs(campaign_id)
+        
+        return jsonify({
+            'success': True,
+            'message': f'Campaign "{campaign.name}" cancelled',
+            'campaign': campaign.to_dict()
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error cancelling campaign: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @bp.route('/<int:campaign_id>', methods=['GET'])
 @authenticated_required
 def get_campaign(campaign_id):
@@ -406,39 +526,42 @@ def send_test_email():
         if not smtp_settings:
             return jsonify({'success': False, 'error': 'No SMTP configuration found for your account'}), 400
         
-        # Create SMTP connection
+        # Deliver through the same pooled SMTP transport campaigns use
+        transport = SMTPTransport(
+            smtp_settings.host,
+            smtp_settings.port,
+            'tls' if smtp_settings.encryption == 'tls' else 'ssl',
+            smtp_settings.username,
+            smtp_settings.password,
+            timeouts=transport_timeouts(smtp_settings)
+        )
         try:
-            if smtp_settings.encryption == 'tls':
-                server = smtplib.SMTP(smtp_settings.host, smtp_settings.port)
-                server.starttls(context=ssl.create_default_context())
-            else:
-                server = smtplib.SMTP_SSL(smtp_settings.host, smtp_settings.port, context=ssl.create_default_context())
-            
-            # Attempt SMTP login with better error handling
-            try:
-                server.login(smtp_settings.username, smtp_settings.password)
-            except smtplib.SMTPAuthenticationError as e:
-                server.quit()
-                error_msg = "SMTP Authentication failed. "
-                if "BadCredentials" in str(e):
+            connected, message = transport.open()
+            if not connected:
+                error_msg = "SMTP connection failed. "
+                if "BadCredentials" in message:
                     error_msg += "For Gmail users: Please use an App Password instead of your regular Gmail password. Go to Google Account Settings > Security > 2-Step Verification > App Passwords to generate one."
                 else:
-                    error_msg += f"Error: {str(e)}"
+                    error_msg += f"Error: {message}"
                 return jsonify({'success': False, 'error': error_msg}), 500
             
             # Create test email
-            msg = MIMEMultipart('alternative')
-            msg['Subject'] = f"[TEST] {data['subject']}"
-            msg['From'] = f"{data.get('sender_name', '')} <{data['sender_email']}>" if data.get('sender_name') else data['sender_email']
-            msg['To'] = data['test_email']
-            
-            # Add HTML content
-            html_part = MIMEText(data['email_content'], 'html')
-            msg.attach(html_part)
+            template = MessageTemplate(
+                from_email=data['sender_email'],
+                from_name=data.get('sender_name') or None,
+                subject=f"[TEST] {data['subject']}",
+                html_content=data['email_content'],
+                allow_8bit=transport.supports_8bitmime
+            )
             
             # Send email
-            server.send_message(msg)
-            server.quit()
+            result = transport.send_envelopes(
+                [Envelope(data['sender_email'], [data['test_email']], template.render(data['test_email']))],
+                template.mail_options
+            )[0]
+            error_msg = result.recipient_error(data['test_email'])
+            if error_msg:
+                return jsonify({'success': False, 'error': f'Failed to send test email: {error_msg}'}), 500
             
             return jsonify({
                 'success': True,
@@ -447,6 +570,8 @@ def send_test_email():
             
         except Exception as e:
             return jsonify({'success': False, 'error': f'Failed to send test email: {str(e)}'}), 500
+        finally:
+            transport.close()
         
     except Exception as e:
         logger.error(f"Error sending test email: {str(e)}")
@@ -504,6 +629,10 @@ def delete_campaign(campaign_id):
         # Delete campaign recipients
         CampaignRecipient.query.filter_by(campaign_id=campaign_id).delete()
         
+        # Attachment rows go with the campaign; remove their stored files
+        AttachmentService.remove_campaign_files(campaign)
+        MessageSpool.discard_campaign(campaign.id)
+        
         # Delete the campaign
         db.session.delete(campaign)
         db.session.commit()
@@ -551,6 +680,23 @@ def update_campaign(campaign_id):
             campaign.html_content = data['html_content']
         if 'text_content' in data:
             campaign.text_content = data['text_content']
+        if 'max_send_attempts' in data:
+            max_send_attempts = data['max_send_attempts']
+            if max_send_attempts is not None and (not isinstance(max_send_attempts, int) or max_send_attempts < 1):
+                return jsonify({'success': False, 'error': 'max_send_attempts must be a positive integer'}), 400
+            campaign.max_send_attempts = max_send_attempts
+        if 'send_time_limit' in data:
+            send_time_limit = data['send_time_limit']
+            if send_time_limit is not None and (not isinstance(send_time_limit, int) or send_time_limit < 1):
+                return jsonify({'success': False, 'error': 'send_time_limit must be a positive integer'}), 400
+            campaign.send_time_limit = send_time_limit
+        if 'use_smtp_pool' in data:
+            if not isinstance(data['use_smtp_pool'], bool):
+                return jsonify({'success': False, 'error': 'use_smtp_pool must be a boolean'}), 400
+            campaign.use_smtp_pool = data['use_smtp_pool']
+        
+        # Recompile the sendable content if the HTML or text changed
+        ContentCompiler.ensure_compiled(campaign)
         
         # Handle scheduled_at update for scheduled campaigns
         if 'scheduled_at' in data:
@@ -561,48 +707,11 @@ def update_campaign(campaign_id):
             else:
                 campaign.scheduled_at = None
         
-        # Handle recipients update
+        # Handle recipients update - only the difference to the stored audience is written
         if 'recipients' in data:
-            # Clear existing recipients
-            from app.models.campaign import CampaignRecipient
-            CampaignRecipient.query.filter_by(campaign_id=campaign.id).delete()
-            
-            # Add new recipients if provided
-            if data['recipients']:
-                recipients = data['recipients'].split(',')
-                valid_recipients = [r.strip() for r in recipients if r.strip()]
-                campaign.total_recipients = len(valid_recipients)
-                
-                # Create or find contacts and add them as campaign recipients
-                from app.models.contact import Contact, ContactStatus
-                
-                for email in valid_recipients:
-                    # Try to find existing contact first
-                    contact = Contact.query.filter_by(email=email, user_id=current_user.id).first()
-                    
-                    # If contact doesn't exist, create a new one
-                    if not contact:
-                        # Extract name from email if possible
-                        name_part = email.split('@')[0].replace('.', ' ').replace('_', ' ').title()
-                        
-                        contact = Contact(
-                            user_id=current_user.id,
-                            email=email,
-                            first_name=name_part,
-                            status=ContactStatus.ACTIVE,
-                            subscribed=True
-                        )
-                        db.session.add(contact)
-                        db.session.flush()  # Get contact ID
-                    
-                    # Create campaign recipient record
-                    campaign_recipient = CampaignRecipient(
-                        campaign_id=campaign.id,
-                        contact_id=contact.id
-                    )
-                    db.session.add(campaign_recipient)
-            else:
-                campaign.total_recipients = 0
+            campaign.total_recipients = AudienceService.sync_campaign_audience(
+                campaign.id, current_user.id, data['recipients']
+            )
         
         campaign.updated_at = datetime.utcnow()
         db.session.commit()
@@ -629,6 +738,85 @@ def update_campaign(campaign_id):
         logger.error(f"Error updating campaign: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@bp.route('/<int:campaign_id>/attachments', methods=['GET'])
+@authenticated_required
+def get_campaign_attachments(campaign_id):
+    """List the attachments of a campaign."""
+    try:
+        campaign = Campaign.query.get_or_404(campaign_id)
+        
+        current_user = g.current_user
+        if not current_user.is_admin() and campaign.user_id != current_user.id:
+            return jsonify({'success': False, 'error': 'You do not have permission to view this campaign'}), 403
+        
+        attachments = sorted(campaign.attachments, key=lambda a: a.id)
+        return jsonify({
+            'success': True,
+            'attachments': [attachment.to_dict() for attachment in attachments]
+        })
+        
+    except Exception as e:
+        logger.error(f"Error fetching campaign attachments: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@bp.route('/<int:campaign_id>/attachments', methods=['POST'])
+@authenticated_required
+def upload_campaign_attachment(campaign_id):
+    """Attach a file to a campaign; it is MIME-encoded once, on upload."""
+    try:
+        campaign = Campaign.query.get_or_404(campaign_id)
+        
+        current_user = g.current_user
+        if not current_user.is_admin() and campaign.user_id != current_user.id:
+            return jsonify({'success': False, 'error': 'You do not have permission to edit this campaign'}), 403
+        
+        if campaign.status not in [CampaignStatus.DRAFT, CampaignStatus.FAILED, CampaignStatus.SCHEDULED]:
+            return jsonify({'success': False, 'error': 'Cannot edit campaign that has been sent or is currently sending'}), 400
+        
+        file = request.files.get('file')
+        if not file or not file.filename:
+            return jsonify({'success': False, 'error': 'No file uploaded'}), 400
+        
+        success, message, attachment = AttachmentService.add_attachment(campaign, file)
+        if not success:
+            return jsonify({'success': False, 'error': message}), 400
+        
+        return jsonify({
+            'success': True,
+            'message': message,
+            'attachment': attachment.to_dict()
+        }), 201
+        
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error uploading campaign attachment: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@bp.route('/<int:campaign_id>/attachments/<int:attachment_id>', methods=['DELETE'])
+@authenticated_required
+def delete_campaign_attachment(campaign_id, attachment_id):
+    """Remove an attachment from a campaign."""
+    try:
+        campaign = Campaign.query.get_or_404(campaign_id)
+        
+        current_user = g.current_user
+        if not current_user.is_admin() and campaign.user_id != current_user.id:
+            return jsonify({'success': False, 'error': 'You do not have permission to edit this campaign'}), 403
+        
+        if campaign.status not in [CampaignStatus.DRAFT, CampaignStatus.FAILED, CampaignStatus.SCHEDULED]:
+            return jsonify({'success': False, 'error': 'Cannot edit campaign that has been sent or is currently sending'}), 400
+        
+        attachment = CampaignAttachment.query.filter_by(id=attachment_id, campaign_id=campaign_id).first_or_404()
+        AttachmentService.remove_attachment(attachment)
+        db.session.commit()
+        
+        return jsonify({'success': True, 'message': 'Attachment removed successfully'})
+        
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error deleting campaign attachment: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @bp.route('/<int:campaign_id>/contacts', methods=['GET'])
 @authenticated_required
 def get_campaign_contacts(campaign_id):
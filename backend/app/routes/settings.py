@@ -1,6 +1,7 @@
 from flask import Blueprint, request, jsonify
 from app import db
 from app.models.smtp_settings import SMTPSettings
+from app.services.transports import transport_timeouts
 from sqlalchemy import text
 import smtplib
 from email.mime.text import MIMEText
@@ -238,10 +239,11 @@ def test_smtp_connection():
         
         # Test connection
         try:
+            timeout = transport_timeouts().connect
             if encryption.lower() == 'ssl':
-                server = smtplib.SMTP_SSL(host, port)
+                server = smtplib.SMTP_SSL(host, port, timeout=timeout)
             else:
-                server = smtplib.SMTP(host, port)
+                server = smtplib.SMTP(host, port, timeout=timeout)
                 if encryption.lower() == 'tls':
                     server.starttls()
             
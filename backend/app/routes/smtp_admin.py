@@ -8,15 +8,20 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from app import db
 from app.models.user import User, UserRole
 from app.models.smtp_account import SMTPAccount, UserSMTPAssignment
+from app.services.circuit_breaker import breaker_for_account, breaker_state
+from app.services.dkim_signer import DKIMSigner
+from app.services.transports import create_transport, validate_transport
 from datetime import datetime
-import smtplib
-import ssl
 from functools import wraps
 
 logger = logging.getLogger(__name__)
 
 smtp_admin_bp = Blueprint('smtp_admin', __name__)
 
+# Per-account SMTP timeouts in seconds (null = the SMTP_*_TIMEOUT settings)
+TIMEOUT_FIELDS = ('connect_timeout', 'command_timeout', 'data_timeout')
+
+
 def admin_required(f):
     """Decorator to require admin role for endpoint access."""
     @wraps(f)
@@ -43,8 +48,15 @@ def create_smtp_account():
         data = request.get_json()
         current_user_id = get_jwt_identity()
         
-        # Validate required fields
-        required_fields = ['name', 'provider', 'host', 'port', 'username', 'password', 'from_name', 'from_email']
+        transport = data.get('transport') or 'smtp'
+        valid, message = validate_transport(transport, data.get('transport_url'))
+        if not valid:
+            return jsonify({'success': False, 'error': message}), 400
+        
+        # Validate required fields (server settings only matter for SMTP delivery)
+        required_fields = ['name', 'provider', 'from_name', 'from_email']
+        if transport == 'smtp':
+            required_fields += ['host', 'port', 'username', 'password']
         missing_fields = [field for field in required_fields if not data.get(field)]
         
         if missing_fields:
@@ -61,21 +73,40 @@ def create_smtp_account():
                 'error': f'SMTP account with name "{data["name"]}" already exists'
             }), 409
         
+        if data.get('dkim_private_key'):
+            valid, message = DKIMSigner.validate_key(data['dkim_private_key'])
+            if not valid:
+                return jsonify({'success': False, 'error': message}), 400
+        
+        for field in TIMEOUT_FIELDS:
+            value = data.get(field)
+            if value is not None and (not isinstance(value, int) or value < 1):
+                return jsonify({'success': False, 'error': f'{field} must be a positive integer'}), 400
+        
         # Create new SMTP account
         smtp_account = SMTPAccount(
             name=data['name'],
             description=data.get('description', ''),
             provider=data['provider'],
-            host=data['host'],
-            port=int(data['port']),
-            username=data['username'],
-            password=data['password'],  # TODO: Encrypt in production
+            host=data.get('host') or '',
+            port=int(data.get('port') or 0),
+            username=data.get('username') or '',
+            password=data.get('password') or '',  # TODO: Encrypt in production
             encryption=data.get('encryption', 'tls'),
+            transport=transport,
+            transport_url=data.get('transport_url'),
             from_name=data['from_name'],
             from_email=data['from_email'],
             reply_to_email=data.get('reply_to_email'),
             is_active=data.get('is_active', True),
             daily_limit=data.get('daily_limit'),
+            max_recipients_per_message=data.get('max_recipients_per_message'),
+            connect_timeout=data.get('connect_timeout'),
+            command_timeout=data.get('command_timeout'),
+            data_timeout=data.get('data_timeout'),
+            dkim_domain=data.get('dkim_domain'),
+            dkim_selector=data.get('dkim_selector'),
+            dkim_private_key=(data.get('dkim_private_key') or '').strip() or None,
             created_by_admin_id=current_user_id
         )
         
@@ -107,7 +138,9 @@ def list_smtp_accounts():
         
         return jsonify({
             'success': True,
-            'smtp_accounts': [account.to_dict() for account in accounts],
+            'smtp_accounts': [
+                {**account.to_dict(), 'circuit_breaker': breaker_state(account.id)} for account in accounts
+            ],
             'total': len(accounts)
         })
         
@@ -131,7 +164,7 @@ def get_smtp_account(smtp_id):
         
         return jsonify({
             'success': True,
-            'smtp_account': account.to_dict()
+            'smtp_account': {**account.to_dict(), 'circuit_breaker': breaker_state(account.id)}
         })
         
     except Exception as e:
@@ -139,6 +172,40 @@ def get_smtp_account(smtp_id):
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@smtp_admin_bp.route('/smtp-accounts/<int:smtp_id>/dkim-record', methods=['GET'])
+@admin_required
+def get_dkim_record(smtp_id):
+    """Get the DNS TXT record to publish for an account's DKIM key (Admin only)."""
+    try:
+        account = SMTPAccount.query.get(smtp_id)
+
+        if not account:
+            return jsonify({
+                'success': False,
+                'error': 'SMTP account not found'
+            }), 404
+
+        key = DKIMSigner.key_for_account(account)
+        if not key:
+            return jsonify({
+                'success': False,
+                'error': 'DKIM is not configured for this SMTP account'
+            }), 400
+
+        return jsonify({
+            'success': True,
+            'record': {
+                'type': 'TXT',
+                'name': f'{key.selector}._domainkey.{key.domain}',
+                'value': DKIMSigner.public_key_record(key.private_key)
+            }
+        })
+
+    except Exception as e:
+        logger.error(f'Error building DKIM record: {str(e)}')
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 @smtp_admin_bp.route('/smtp-accounts/<int:smtp_id>', methods=['PUT'])
 @admin_required
 def update_smtp_account(smtp_id):
@@ -179,6 +246,14 @@ def update_smtp_account(smtp_id):
             account.password = data['password']
         if 'encryption' in data:
             account.encryption = data['encryption']
+        if 'transport' in data or 'transport_url' in data:
+            transport = data.get('transport', account.transport) or 'smtp'
+            transport_url = data.get('transport_url', account.transport_url)
+            valid, message = validate_transport(transport, transport_url)
+            if not valid:
+                return jsonify({'success': False, 'error': message}), 400
+            account.transport = transport
+            account.transport_url = transport_url
         if 'from_name' in data:
             account.from_name = data['from_name']
         if 'from_email' in data:
@@ -189,6 +264,24 @@ def update_smtp_account(smtp_id):
             account.is_active = data['is_active']
         if 'daily_limit' in data:
             account.daily_limit = data['daily_limit']
+        if 'max_recipients_per_message' in data:
+            account.max_recipients_per_message = data['max_recipients_per_message']
+        for field in TIMEOUT_FIELDS:
+            if field in data:
+                value = data[field]
+                if value is not None and (not isinstance(value, int) or value < 1):
+                    return jsonify({'success': False, 'error': f'{field} must be a positive integer'}), 400
+                setattr(account, field, value)
+        if 'dkim_domain' in data:
+            account.dkim_domain = data['dkim_domain']
+        if 'dkim_selector' in data:
+            account.dkim_selector = data['dkim_selector']
+        if 'dkim_private_key' in data and data['dkim_private_key'] != '••••••••':
+            if data['dkim_private_key']:
+                valid, message = DKIMSigner.validate_key(data['dkim_private_key'])
+                if not valid:
+                    return jsonify({'success': False, 'error': message}), 400
+            account.dkim_private_key = (data['dkim_private_key'] or '').strip() or None
         
         account.updated_at = datetime.utcnow()
         db.session.commit()
@@ -262,55 +355,67 @@ def test_smtp_connection(smtp_id):
                 'error': 'SMTP account not found'
             }), 404
         
-        # Test the connection
+        # Test the connection (or sink / API endpoint) the account delivers through
         try:
-            if account.encryption == 'ssl':
-                context = ssl.create_default_context()
-                server = smtplib.SMTP_SSL(account.host, account.port, context=context, timeout=10)
-            else:
-                server = smtplib.SMTP(account.host, account.port, timeout=10)
-                if account.encryption == 'tls':
-                    server.starttls()
-            
-            server.login(account.username, account.password)
-            server.quit()
-            
-            # Update test status
-            account.is_verified = True
-            account.last_tested_at = datetime.utcnow()
-            db.session.commit()
-            
-            logger.info(f'SMTP account {smtp_id} test successful')
-            
-            return jsonify({
-                'success': True,
-                'message': 'SMTP connection successful! Account verified.'
-            })
-            
-        except smtplib.SMTPAuthenticationError as e:
-            logger.warning(f'SMTP auth failed for account {smtp_id}: {str(e)}')
+            transport = create_transport(account)
+            connected, message = transport.open()
+            transport.close()
+        except ValueError as e:
+            connected, message = False, str(e)
+        
+        if not connected:
+            logger.warning(f'Transport test failed for account {smtp_id}: {message}')
             return jsonify({
                 'success': False,
-                'error': 'Authentication failed. Please check username and password.'
-            }), 400
-        except smtplib.SMTPConnectError as e:
-            logger.warning(f'SMTP connection failed for account {smtp_id}: {str(e)}')
-            return jsonify({
-                'success': False,
-                'error': f'Could not connect to SMTP server: {str(e)}'
-            }), 400
-        except Exception as e:
-            logger.error(f'SMTP test error for account {smtp_id}: {str(e)}')
-            return jsonify({
-                'success': False,
-                'error': f'Connection test failed: {str(e)}'
+                'error': f'Connection test failed: {message}'
             }), 400
+        
+        # Update test status; the account works again, so stop failing its connections
+        account.is_verified = True
+        account.last_tested_at = datetime.utcnow()
+        db.session.commit()
+        breaker_for_account(account.id).record_success()
+        
+        logger.info(f'SMTP account {smtp_id} test successful')
+        
+        return jsonify({
+            'success': True,
+            'message': 'SMTP connection successful! Account verified.'
+        })
             
     except Exception as e:
         logger.error(f'Error testing SMTP account: {str(e)}')
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@smtp_admin_bp.route('/smtp-accounts/<int:smtp_id>/circuit-breaker/reset', methods=['POST'])
+@admin_required
+def reset_circuit_breaker(smtp_id):
+    """Close an SMTP account's circuit breaker (Admin only)."""
+    try:
+        account = SMTPAccount.query.get(smtp_id)
+        
+        if not account:
+            return jsonify({
+                'success': False,
+                'error': 'SMTP account not found'
+            }), 404
+        
+        breaker = breaker_for_account(account.id)
+        breaker.reset()
+        logger.info(f'Circuit breaker of SMTP account {smtp_id} reset')
+        
+        return jsonify({
+            'success': True,
+            'message': 'Circuit breaker closed',
+            'circuit_breaker': breaker.snapshot()
+        })
+        
+    except Exception as e:
+        logger.error(f'Error resetting circuit breaker: {str(e)}')
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 # User-SMTP Assignment Endpoints
 
 @smtp_admin_bp.route('/users/<int:user_id>/smtp-accounts', methods=['POST'])
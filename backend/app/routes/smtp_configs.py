@@ -5,6 +5,7 @@ from flask import Blueprint, request, jsonify, g
 from app import db
 from app.models.smtp_config import SMTPConfig
 from app.middleware.auth import authenticated_required
+from app.services.transports import transport_timeouts
 import smtplib
 import ssl
 from email.mime.text import MIMEText
@@ -193,11 +194,12 @@ def test_smtp_config(config_id):
         
         # Test the connection
         try:
+            timeout = transport_timeouts(config).connect
             if config.encryption == 'ssl':
                 context = ssl.create_default_context()
-                server = smtplib.SMTP_SSL(config.host, config.port, context=context)
+                server = smtplib.SMTP_SSL(config.host, config.port, context=context, timeout=timeout)
             else:
-                server = smtplib.SMTP(config.host, config.port)
+                server = smtplib.SMTP(config.host, config.port, timeout=timeout)
                 if config.encryption == 'tls':
                     server.starttls()
             
@@ -4,6 +4,7 @@ logger = logging.getLogger(__name__)
 from flask import Blueprint, request, jsonify
 from app import db
 from app.models.smtp_settings import SMTPSettings
+from app.services.transports import transport_timeouts
 import smtplib
 import ssl
 from email.mime.text import MIMEText
@@ -149,11 +150,12 @@ def test_smtp_connection():
         
         # Test the connection
         try:
+            timeout = transport_timeouts().connect
             if encryption == 'ssl':
                 context = ssl.create_default_context()
-                server = smtplib.SMTP_SSL(host, port, context=context)
+                server = smtplib.SMTP_SSL(host, port, context=context, timeout=timeout)
             else:
-                server = smtplib.SMTP(host, port)
+                server = smtplib.SMTP(host, port, timeout=timeout)
                 if encryption == 'tls':
                     server.starttls()
             
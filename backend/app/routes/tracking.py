@@ -5,6 +5,8 @@ from datetime import datetime
 from flask import Blueprint, request, redirect, Response, jsonify
 from app import db
 from app.models.email_log import EmailLog, LinkClick, EmailStatus
+from app.models.suppression import SuppressionReason
+from app.services.suppression_list import SuppressionEntry, SuppressionList
 import base64
 import secrets
 import uuid
@@ -151,7 +153,10 @@ def track_unsubscribe():
     Expected query parameters:
     - log_id: The EmailLog ID
     - tracking_id: Alternative tracking identifier
-    - email: The email address to unsubscribe
+    - email: The email address to unsubscribe (must match the log's recipient)
+    
+    The recipient is suppressed for the campaign owner's future sends and
+    their contact is marked unsubscribed.
     """
     try:
         log_id = request.args.get('log_id')
@@ -165,11 +170,15 @@ def track_unsubscribe():
         elif tracking_id:
             email_log = EmailLog.query.filter_by(tracking_id=tracking_id).first()
         
-        if email_log or email:
-            # Here you would implement your unsubscribe logic
-            # For now, we'll just track it as a special status
-            # You could add an 'unsubscribed' status to the EmailStatus enum
-            pass
+        # The log identifies both the address and the user it unsubscribes from
+        if email_log and (not email or email.strip().lower() == email_log.recipient_email.lower()):
+            campaign = email_log.campaign
+            if campaign:
+                SuppressionList.add(
+                    [SuppressionEntry(campaign.user_id, email_log.recipient_email, SuppressionReason.UNSUBSCRIBE)],
+                    campaign.id
+                )
+                logger.info(f"Unsubscribed {email_log.recipient_email} from user {campaign.user_id}'s campaigns")
         
         # Return a simple unsubscribe confirmation page
         return '''
@@ -0,0 +1,253 @@
+"""
+Account Pool
+
+A campaign can send through every SMTP account its owner is assigned
+(UserSMTPAssignment) instead of only its own, so one account's daily limit
+and throughput no longer cap the campaign, and a failing account does not
+fail the rest of its recipients.
+
+Each pipeline batch is dispatched to one account by smooth weighted round
+robin. An account's weight is its remaining daily_limit headroom (reserved as
+batches are assigned) scaled by its health, a moving average of how many of
+its deliveries failed for reasons of its own: connection and login failures,
+lost connections, a refused sender, 421 replies. When envelopes fail that
+way, they and the rest of their batch are rendered again for another
+account of the pool and sent through it (failover); a recipient is only
+failed once every account was tried. Accounts whose circuit breaker is open
+are passed over while another one is available.
+
+A campaign without a pool is a pool of one account and sends as before.
+"""
+
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+from app.models.campaign import Campaign
+from app.models.smtp_account import SMTPAccount, UserSMTPAssignment
+from app.services.adaptive_limiter import AdaptiveLimiter, CONGESTION_CODES, limiter_for_account
+from app.services.message_template import MessageTemplate, RenderedMessage
+from app.services.send_records import Recipient
+from app.services.smtp_client import Envelope, EnvelopeResult
+from app.services.smtp_service import DEFAULT_MAX_RECIPIENTS_PER_MESSAGE, SMTPService
+from app.utils.helpers import chunked
+
+logger = logging.getLogger(__name__)
+
+# Transaction failure stages that are the account's (or its server's) fault, not the recipient's
+ACCOUNT_FAILURE_STAGES = ('sign', 'connect', 'connection', 'MAIL')
+
+# Weight of the latest delivery window in an account's health
+HEALTH_DECAY = 0.2
+
+# Lowest health: a failing account still gets the odd batch, which shows when it recovers
+MIN_HEALTH = 0.05
+
+
+def is_account_failure(verdict: EnvelopeResult) -> bool:
+    """Whether an envelope failed because of the account it was sent through."""
+    if not verdict.error:
+        return False
+    return verdict.stage in ACCOUNT_FAILURE_STAGES or verdict.error[0] in CONGESTION_CODES
+
+
+class PoolMember:
+    """One account of the pool, with the campaign's message built for it."""
+
+    def __init__(self, smtp_account: SMTPAccount, service: SMTPService, template: Optional[MessageTemplate],
+                 template_error: Optional[str], limiter: AdaptiveLimiter):
+        self.account = smtp_account
+        # Signs the account's messages (DKIM); delivery workers open their own transports
+        self.service = service
+        self.account_id = smtp_account.id
+        self.name = smtp_account.name
+        self.from_email = smtp_account.from_email
+        self.max_rcpts = smtp_account.max_recipients_per_message or DEFAULT_MAX_RECIPIENTS_PER_MESSAGE
+        self.template = template
+        self.template_error = template_error
+        # Identical message for everyone: rendered once, sent with multi-recipient envelopes
+        self.shared_message: Optional[RenderedMessage] = None
+        if template and not template.is_personalized:
+            self.shared_message = template.render_shared()
+        self.limiter = limiter
+        self.breaker = service.breaker
+        # Recipients the account may still send today (None = no daily limit)
+        self.headroom: Optional[int] = None
+        if smtp_account.daily_limit:
+            self.headroom = max(0, smtp_account.daily_limit - (smtp_account.emails_sent_today or 0))
+        self.health = 1.0
+        self.assigned = 0
+        self.failed_over = 0
+        # Smooth weighted round robin state
+        self.current_weight = 0.0
+
+    def render(self, recipients: Sequence[Recipient]) -> Tuple[List[List[Recipient]], List[Envelope]]:
+        """
+        Envelopes of the message for addressed recipients.
+
+        Returns:
+            Tuple of (recipients per envelope, envelopes)
+        """
+        if self.template_error:
+            raise ValueError(self.template_error)
+        if self.shared_message is not None:
+            groups = list(chunked(recipients, self.max_rcpts))
+            return groups, [Envelope(self.from_email, [r.email for r in group], self.shared_message) for group in groups]
+        # Splice each recipient into the pre-built message
+        return [[recipient] for recipient in recipients], [
+            Envelope(self.from_email, [r.email], self.template.render(r.email, fields=r.template_fields()))
+            for r in recipients
+        ]
+
+    def to_dict(self) -> Dict:
+        """Convert dispatch state to dictionary."""
+        return {
+            'smtp_account_id': self.account_id,
+            'name': self.name,
+            'assigned': self.assigned,
+            'failed_over': self.failed_over,
+            'health': round(self.health, 3),
+            'headroom': self.headroom,
+            'adaptive': self.limiter.snapshot(),
+            'circuit_breaker': self.breaker.snapshot()
+        }
+
+
+class Dispatch:
+    """The account a batch was dispatched to and the deliveries each account made for it."""
+
+    __slots__ = ('member', 'delivered')
+
+    def __init__(self, member: PoolMember):
+        self.member = member
+        # Recipients accepted per account ID
+        self.delivered: Dict[int, int] = {}
+
+
+class AccountPool:
+    """Weighted dispatch of a campaign's batches over its SMTP accounts."""
+
+    def __init__(self, members: List[PoolMember], expected: int = 0):
+        self.members = members
+        # Weight of an account without a daily limit: the whole campaign fits
+        self.expected = max(expected, 1)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def accounts_for(campaign: Campaign) -> List[SMTPAccount]:
+        """
+        SMTP accounts a campaign sends through.
+
+        The campaign's own account, plus, when it uses the pool, every other
+        active and verified account assigned to its owner.
+        """
+        accounts = [campaign.smtp_account] if campaign.smtp_account else []
+        if campaign.use_smtp_pool:
+            assigned = SMTPAccount.query.join(
+                UserSMTPAssignment, UserSMTPAssignment.smtp_account_id == SMTPAccount.id
+            ).filter(
+                UserSMTPAssignment.user_id == campaign.user_id,
+                SMTPAccount.is_active.is_(True),
+                SMTPAccount.is_verified.is_(True),
+                SMTPAccount.id != campaign.smtp_account_id
+            ).order_by(SMTPAccount.id).all()
+            accounts = [account for account in accounts if account.is_active and account.is_verified] + assigned
+        return accounts
+
+    @staticmethod
+    def build(accounts: Iterable[SMTPAccount], subject: str, html_content: Optional[str],
+              text_content: Optional[str], encoded_attachments: Optional[Sequence] = None,
+              expected: int = 0) -> 'AccountPool':
+        """
+        Build the campaign's message for every account.
+
+        Headers, boundaries and static parts are encoded once per account
+        (sender, 8bit support and DKIM differ between accounts).
+        """
+        members = []
+        for account in accounts:
+            service = SMTPService(account)
+            template = None
+            template_error = None
+            try:
+                template = service.build_template(
+                    subject=subject,
+                    html_content=html_content,
+                    text_content=text_content,
+                    encoded_attachments=encoded_attachments
+                )
+            except ValueError as e:
+                template_error = str(e)
+            finally:
+                service.disconnect()
+            members.append(PoolMember(account, service, template, template_error, limiter_for_account(account)))
+        return AccountPool(members, expected)
+
+    def choose(self, count: int, exclude: Set[int] = frozenset()) -> Optional[PoolMember]:
+        """
+        Pick the account for ``count`` recipients and reserve its headroom.
+
+        Accounts whose circuit breaker is open, then accounts out of daily
+        headroom, are only picked when there is no other.
+
+        Args:
+            count: Recipients to send
+            exclude: IDs of accounts not to pick (already tried)
+
+        Returns:
+            The account, or None if there is none left to try
+        """
+        with self._lock:
+            candidates = [
+                member for member in self.members
+                if member.account_id not in exclude and member.template_error is None
+            ]
+            if not candidates:
+                return None
+            closed = [member for member in candidates if not member.breaker.blocked]
+            candidates = closed or candidates
+            with_room = [member for member in candidates if member.headroom is None or member.headroom > 0]
+            candidates = with_room or candidates
+
+            # Smooth weighted round robin: spreads picks evenly in proportion to the weights
+            total = 0.0
+            for member in candidates:
+                room = self.expected if member.headroom is None else min(member.headroom, self.expected)
+                weight = max(room, 1) * member.health
+                member.current_weight += weight
+                total += weight
+            chosen = max(candidates, key=lambda member: member.current_weight)
+            chosen.current_weight -= total
+
+            chosen.assigned += count
+            if chosen.headroom is not None:
+                chosen.headroom = max(0, chosen.headroom - count)
+            return chosen
+
+    def fail_over(self, member: PoolMember, count: int, exclude: Set[int]) -> Optional[PoolMember]:
+        """
+        Move ``count`` recipients from a failing account to another one.
+
+        Returns:
+            The account to send them through, or None if there is none left to try
+        """
+        fallback = self.choose(count, exclude)
+        if fallback is not None:
+            with self._lock:
+                member.failed_over += count
+                member.assigned -= count
+                if member.headroom is not None:
+                    member.headroom += count
+        return fallback
+
+    def report(self, member: PoolMember, delivered: int, failed: int):
+        """Update an account's health with a delivery window's results."""
+        if not delivered + failed:
+            return
+        with self._lock:
+            success = delivered / (delivered + failed)
+            member.health = max(MIN_HEALTH, (1 - HEALTH_DECAY) * member.health + HEALTH_DECAY * success)
+
+    def snapshot(self) -> List[Dict]:
+        """Dispatch state of every account."""
+        with self._lock:
+            return [member.to_dict() for member in self.members]
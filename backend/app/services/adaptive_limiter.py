@@ -0,0 +1,245 @@
+"""
+Adaptive Limiter
+
+How fast an SMTP account can deliver depends on the server behind it: a
+relay like SES takes many parallel connections, Gmail defers a sender that
+opens more than a few. Instead of a fixed setting, every account gets an
+AIMD controller (additive increase, multiplicative decrease, as in TCP
+congestion control) for its concurrent deliveries and send rate:
+
+- a delivered window whose latency per message stays close to the best seen
+  raises concurrency by about one per round of windows, and the rate (once
+  there is one) by RATE_STEP messages per second;
+- a window that draws a 421 / 451 reply, times out or loses its connection
+  halves both, at most once per window in flight. The first cut after
+  messages were delivered turns the rate from unlimited into half the
+  throughput measured at that point.
+
+The learned state is kept per process, shared by concurrent campaigns on the
+account, and saved on the SMTPAccount when a campaign finishes, so the next
+campaign starts where the last one settled.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Sequence
+from flask import current_app
+from app import db
+from app.models.smtp_account import SMTPAccount
+from app.services.smtp_client import EnvelopeResult
+
+logger = logging.getLogger(__name__)
+
+# Defaults for SEND_ACCOUNT_INITIAL_CONCURRENCY and SEND_ACCOUNT_MAX_CONCURRENCY
+DEFAULT_INITIAL_CONCURRENCY = 2
+DEFAULT_MAX_CONCURRENCY = 8
+
+# Factor applied to concurrency and rate on congestion
+DECREASE_FACTOR = 0.5
+
+# Messages per second added to the rate per uncongested window
+RATE_STEP = 2.0
+
+# Lowest rate a cut goes down to, in messages per second
+MIN_RATE = 1.0
+
+# Windows slower per message than the best seen by this factor do not raise the limits
+LATENCY_TOLERANCE = 2.0
+
+# Seconds of deliveries the throughput (the rate after a first cut) is measured over
+THROUGHPUT_WINDOW = 5.0
+
+# Replies meaning the server is overloaded or throttling the sender
+CONGESTION_CODES = (421, 451)
+
+# Failure stages meaning the connection could not be made or was lost (incl. timeouts)
+CONGESTION_STAGES = ('connect', 'connection')
+
+# Longest single wait before the stop callback is checked again, in seconds
+WAIT_POLL_INTERVAL = 0.5
+
+
+def is_congested(verdicts: Sequence[EnvelopeResult]) -> bool:
+    """Whether a window's results signal that the server wants less traffic."""
+    for verdict in verdicts:
+        if verdict.error:
+            if verdict.stage in CONGESTION_STAGES or verdict.error[0] in CONGESTION_CODES:
+                return True
+        elif any(code in CONGESTION_CODES for code, _ in verdict.refused.values()):
+            return True
+    return False
+
+
+class AdaptiveLimiter:
+    """AIMD-controlled concurrency and rate of one SMTP account's deliveries."""
+
+    def __init__(self, concurrency: float, rate: Optional[float] = None, max_concurrency: int = DEFAULT_MAX_CONCURRENCY):
+        self.max_concurrency = max(1, max_concurrency)
+        self.concurrency = min(max(1.0, float(concurrency)), self.max_concurrency)
+        # Messages per second; None until the first congestion (unlimited)
+        self.rate = max(MIN_RATE, rate) if rate else None
+        self.active = 0
+        self.tokens = self._burst
+        self.updated = time.monotonic()
+        self.best_latency: Optional[float] = None
+        self.last_cut = 0.0
+        self.increases = 0
+        self.cuts = 0
+        # (finished at, messages) of recent windows, for the throughput
+        self._delivered: deque = deque()
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self) -> int:
+        """Deliveries allowed in flight at once."""
+        return int(self.concurrency)
+
+    def acquire(self, count: int, stop: Optional[Callable[[], bool]] = None) -> Optional[float]:
+        """
+        Wait for a delivery slot and the rate tokens of ``count`` messages.
+
+        Args:
+            count: Messages about to be delivered
+            stop: Polled while waiting; the wait is abandoned once it returns True
+
+        Returns:
+            Start time to pass to ``release``, or None if stopped (nothing was acquired)
+        """
+        with self._condition:
+            while True:
+                if stop is not None and stop():
+                    return None
+                now = time.monotonic()
+                self._refill(now)
+                delay = None
+                if self.active < self.limit:
+                    # A window larger than the bucket goes out once it is full, leaving it in debt
+                    needed = min(count, self._burst) if self.rate else 0
+                    delay = max(0.0, (needed - self.tokens) / self.rate) if self.rate else 0.0
+                    if delay <= 0:
+                        self.active += 1
+                        if self.rate:
+                            self.tokens -= count
+                        return now
+                self._condition.wait(min(delay or WAIT_POLL_INTERVAL, WAIT_POLL_INTERVAL))
+
+    def release(self, started: float, verdicts: Optional[List[EnvelopeResult]] = None):
+        """
+        Give back a delivery slot and adapt the limits to the window's results.
+
+        Args:
+            started: Value returned by ``acquire``
+            verdicts: Results of the delivered window (None if it was not sent)
+        """
+        with self._condition:
+            self.active -= 1
+            if verdicts:
+                now = time.monotonic()
+                if is_congested(verdicts):
+                    # Windows already in flight at the last cut saw the old limits
+                    if started >= self.last_cut:
+                        self._decrease(now)
+                else:
+                    self._delivered.append((now, len(verdicts)))
+                    latency = (now - started) / len(verdicts)
+                    if self.best_latency is None or latency < self.best_latency:
+                        self.best_latency = latency
+                    if latency <= self.best_latency * LATENCY_TOLERANCE:
+                        self._increase()
+            self._condition.notify_all()
+
+    def snapshot(self) -> Dict:
+        """Current limits and counters."""
+        with self._condition:
+            return {
+                'concurrency': round(self.concurrency, 2),
+                'rate': round(self.rate, 1) if self.rate else None,
+                'active': self.active,
+                'increases': self.increases,
+                'cuts': self.cuts
+            }
+
+    @property
+    def _burst(self) -> float:
+        # One second's worth of messages
+        return max(self.rate or 0.0, 1.0)
+
+    def _refill(self, now: float):
+        if self.rate:
+            self.tokens = min(self._burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _throughput(self, now: float) -> float:
+        while self._delivered and self._delivered[0][0] < now - THROUGHPUT_WINDOW:
+            self._delivered.popleft()
+        if not self._delivered:
+            return 0.0
+        span = max(1.0, now - self._delivered[0][0])
+        return sum(count for _, count in self._delivered) / span
+
+    def _increase(self):
+        self.increases += 1
+        self.concurrency = min(self.max_concurrency, self.concurrency + 1.0 / self.concurrency)
+        if self.rate:
+            self.rate += RATE_STEP
+
+    def _decrease(self, now: float):
+        self.cuts += 1
+        self.last_cut = now
+        self.concurrency = max(1.0, self.concurrency * DECREASE_FACTOR)
+        throughput = self._throughput(now)
+        if self.rate and throughput:
+            # A rate that was never reached is no guide to what the server takes
+            rate = min(self.rate, throughput)
+        else:
+            rate = self.rate or throughput
+        # Nothing delivered yet (e.g. the server cannot be reached): no rate to go by
+        if rate:
+            self.rate = max(MIN_RATE, rate * DECREASE_FACTOR)
+            self._refill(now)
+            self.tokens = min(self.tokens, self._burst)
+        logger.info(f"Congestion: concurrency cut to {self.limit}, rate to "
+                    + (f"{self.rate:.1f}/s" if self.rate else "unlimited"))
+
+
+_limiters: Dict[int, AdaptiveLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def limiter_for_account(smtp_account: SMTPAccount) -> AdaptiveLimiter:
+    """
+    The process-wide limiter of an SMTP account.
+
+    Created from the state saved on the account, or from
+    SEND_ACCOUNT_INITIAL_CONCURRENCY for an account without one.
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(smtp_account.id)
+        if limiter is None:
+            limiter = _limiters[smtp_account.id] = AdaptiveLimiter(
+                concurrency=smtp_account.adaptive_concurrency or current_app.config.get(
+                    'SEND_ACCOUNT_INITIAL_CONCURRENCY', DEFAULT_INITIAL_CONCURRENCY),
+                rate=smtp_account.adaptive_rate,
+                max_concurrency=current_app.config.get('SEND_ACCOUNT_MAX_CONCURRENCY', DEFAULT_MAX_CONCURRENCY)
+            )
+        return limiter
+
+
+def save_limiter_state(smtp_account_id: int):
+    """Save an account's learned concurrency and rate for its next campaign."""
+    limiter = _limiters.get(smtp_account_id)
+    if limiter is None:
+        return
+    try:
+        SMTPAccount.query.filter_by(id=smtp_account_id).update({
+            SMTPAccount.adaptive_concurrency: round(limiter.concurrency, 2),
+            SMTPAccount.adaptive_rate: round(limiter.rate, 1) if limiter.rate else None,
+            SMTPAccount.adaptive_updated_at: datetime.utcnow()
+        }, synchronize_session=False)
+        db.session.commit()
+    except Exception as e:
+        logger.error(f"Error saving send limits of SMTP account {smtp_account_id}: {e}")
+        db.session.rollback()
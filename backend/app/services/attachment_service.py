@@ -0,0 +1,211 @@
+"""
+Attachment Service
+
+Campaign attachments are stored under the uploads area and MIME-encoded
+exactly once, when they are uploaded: the part headers and base64 body are
+written to a sidecar ``.mime`` file next to the original. At send time the
+encoded parts are memory-mapped read-only and cached per campaign, so every
+outgoing message references the same pages instead of re-encoding (or even
+copying) the attachment.
+"""
+
+import base64
+import logging
+import mmap
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+from flask import current_app
+from app import db
+from app.models.campaign import Campaign, CampaignAttachment
+from app.services.message_template import CRLF, attachment_headers
+from app.utils.file_manager import FileManager
+
+logger = logging.getLogger(__name__)
+
+# Raw bytes per base64 line (57 bytes -> 76 characters) and lines per read
+BASE64_LINE_BYTES = 57
+ENCODE_READ_LINES = 1024
+
+MIME_TYPE_PATTERN = re.compile(r'[\w.+-]+/[\w.+-]+')
+
+
+def map_file(path: str) -> 'MappedFile':
+    """Memory-map a file read-only."""
+    with open(path, 'rb') as f:
+        mapped = MappedFile(f.fileno(), 0, access=mmap.ACCESS_READ)
+    mapped.path = path
+    return mapped
+
+
+class MappedFile(mmap.mmap):
+    """
+    Read-only file mapping that remembers its path.
+
+    Pickles as its path, so messages referencing it can be handed to worker
+    processes (e.g. for DKIM signing) without copying the contents.
+    """
+
+    def __reduce__(self):
+        return map_file, (self.path,)
+
+
+class AttachmentCache:
+    """
+    Process-wide cache of encoded attachment parts, memory-mapped read-only.
+
+    Entries are keyed by attachment ID and revalidated against the encoded
+    file's size and mtime, so a re-encoded file is picked up automatically.
+    """
+
+    def __init__(self):
+        self._entries: Dict[int, Tuple[Tuple[int, float], MappedFile]] = {}
+        self._campaigns: Dict[int, List[int]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, attachment: CampaignAttachment) -> MappedFile:
+        """Return the mapped MIME part of one attachment."""
+        stat = os.stat(attachment.encoded_path)
+        stamp = (stat.st_size, stat.st_mtime)
+
+        with self._lock:
+            entry = self._entries.get(attachment.id)
+            if entry and entry[0] == stamp:
+                return entry[1]
+
+            mapped = map_file(attachment.encoded_path)
+            self._entries[attachment.id] = (stamp, mapped)
+            self._campaigns.setdefault(attachment.campaign_id, [])
+            if attachment.id not in self._campaigns[attachment.campaign_id]:
+                self._campaigns[attachment.campaign_id].append(attachment.id)
+
+        if entry:
+            self._close(entry[1])
+        return mapped
+
+    def parts_for_campaign(self, campaign: Campaign) -> List[MappedFile]:
+        """Mapped MIME parts of every attachment of a campaign, in upload order."""
+        attachments = sorted(campaign.attachments, key=lambda a: a.id)
+        return [self.get(attachment) for attachment in attachments if attachment.encoded_path]
+
+    def evict_campaign(self, campaign_id: int):
+        """Unmap a campaign's attachments (e.g. once it finished sending)."""
+        with self._lock:
+            attachment_ids = self._campaigns.pop(campaign_id, [])
+            entries = [self._entries.pop(i) for i in attachment_ids if i in self._entries]
+        for _, mapped in entries:
+            self._close(mapped)
+
+    @staticmethod
+    def _close(mapped: MappedFile):
+        try:
+            mapped.close()
+        except BufferError:
+            # Still referenced by a message being written; freed with it
+            pass
+
+
+attachment_cache = AttachmentCache()
+
+
+class AttachmentService:
+    """Service for storing and encoding campaign attachments."""
+
+    @staticmethod
+    def add_attachment(campaign: Campaign, file) -> Tuple[bool, str, Optional[CampaignAttachment]]:
+        """
+        Store an uploaded file and encode its MIME part.
+
+        Args:
+            campaign: Campaign to attach the file to
+            file: FileStorage object from request.files
+
+        Returns:
+            Tuple of (success, message, attachment)
+        """
+        try:
+            file_manager = FileManager(current_app.config.get('UPLOAD_DIR', 'uploads'))
+            info = file_manager.save_uploaded_file(
+                file, campaign.user_id, subdirectory=os.path.join('attachments', f'campaign_{campaign.id}')
+            )
+
+            max_size = current_app.config.get('MAX_ATTACHMENT_SIZE')
+            if max_size and info['file_size'] > max_size:
+                file_manager.delete_file(info['file_path'])
+                return False, f"Attachment exceeds the maximum size of {max_size} bytes", None
+
+            # Client-supplied type ends up in a header; only accept type/subtype
+            mime_type = info['mime_type'] if MIME_TYPE_PATTERN.fullmatch(info['mime_type'] or '') else None
+
+            encoded_path = info['file_path'] + '.mime'
+            encoded_size = AttachmentService.encode_file(
+                info['file_path'], encoded_path, info['original_filename'], mime_type
+            )
+
+            attachment = CampaignAttachment(
+                campaign_id=campaign.id,
+                original_filename=info['original_filename'],
+                file_path=info['file_path'],
+                file_size=info['file_size'],
+                mime_type=mime_type or 'application/octet-stream',
+                encoded_path=encoded_path,
+                encoded_size=encoded_size
+            )
+            db.session.add(attachment)
+            db.session.commit()
+
+            logger.info(f"Attached {attachment.original_filename} ({attachment.file_size} bytes) "
+                        f"to campaign {campaign.id}")
+            return True, "Attachment uploaded successfully", attachment
+
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error adding attachment to campaign {campaign.id}: {e}")
+            return False, f"Failed to add attachment: {str(e)}", None
+
+    @staticmethod
+    def remove_attachment(attachment: CampaignAttachment):
+        """Delete an attachment row and its files (not committed)."""
+        attachment_cache.evict_campaign(attachment.campaign_id)
+        AttachmentService._delete_files(attachment)
+        db.session.delete(attachment)
+
+    @staticmethod
+    def remove_campaign_files(campaign: Campaign):
+        """Delete the stored files of all of a campaign's attachments."""
+        attachment_cache.evict_campaign(campaign.id)
+        for attachment in campaign.attachments:
+            AttachmentService._delete_files(attachment)
+
+    @staticmethod
+    def encode_file(source_path: str, target_path: str, filename: str, mime_type: Optional[str] = None) -> int:
+        """
+        Write the complete MIME part (headers and base64 body) for a file.
+
+        The source is streamed in whole base64 lines, so large files are never
+        held in memory.
+
+        Returns:
+            Size of the encoded part in bytes
+        """
+        chunk_size = BASE64_LINE_BYTES * ENCODE_READ_LINES
+        tmp_path = target_path + '.tmp'
+        with open(source_path, 'rb') as source, open(tmp_path, 'wb') as target:
+            target.write(attachment_headers(filename, mime_type))
+            while True:
+                chunk = source.read(chunk_size)
+                if not chunk:
+                    break
+                target.write(base64.encodebytes(chunk).replace(b'\n', CRLF))
+        os.replace(tmp_path, target_path)
+        return os.path.getsize(target_path)
+
+    @staticmethod
+    def _delete_files(attachment: CampaignAttachment):
+        for path in (attachment.file_path, attachment.encoded_path):
+            try:
+                if path and os.path.exists(path):
+                    os.remove(path)
+            except OSError as e:
+                logger.warning(f"Could not delete attachment file {path}: {e}")
@@ -0,0 +1,159 @@
+"""
+Audience Service
+
+Resolves the recipient lists submitted with a campaign into contacts and
+CampaignRecipient rows using chunked set-based queries, so large audiences
+do not cost one round-trip per address.
+"""
+
+import logging
+from typing import Dict, Iterable, List, Tuple, Union
+from app import db
+from app.models.campaign import CampaignRecipient
+from app.models.contact import Contact, ContactStatus
+from app.utils.helpers import chunked
+
+logger = logging.getLogger(__name__)
+
+# Keep IN (...) lists below SQLite's default bound-parameter limit
+LOOKUP_CHUNK_SIZE = 500
+
+# Rows per executemany() batch for bulk inserts
+INSERT_CHUNK_SIZE = 1000
+
+
+class AudienceService:
+    """Service for bulk audience resolution and campaign recipient management."""
+
+    @staticmethod
+    def parse_recipients(raw: Union[str, Iterable[str], None]) -> List[str]:
+        """
+        Normalize a submitted recipients value into a de-duplicated email list.
+
+        Args:
+            raw: Comma separated string or list of email addresses
+
+        Returns:
+            List of lowercased emails in submission order, without duplicates
+        """
+        if not raw:
+            return []
+
+        if isinstance(raw, str):
+            raw = raw.split(',')
+
+        emails = []
+        seen = set()
+        for value in raw:
+            # Contacts are stored lowercased (see Contact.__init__)
+            email = (value or '').strip().lower()
+            if email and email not in seen:
+                seen.add(email)
+                emails.append(email)
+
+        return emails
+
+    @staticmethod
+    def resolve_contacts(user_id: int, emails: List[str]) -> Dict[str, int]:
+        """
+        Map emails to contact IDs for a user, creating missing contacts in bulk.
+
+        Args:
+            user_id: Owner of the contacts
+            emails: Normalized email addresses (see parse_recipients)
+
+        Returns:
+            Dictionary of email -> contact ID for every requested email
+        """
+        contact_ids = AudienceService._lookup_contact_ids(user_id, emails)
+
+        missing = [email for email in emails if email not in contact_ids]
+        if missing:
+            for batch in chunked(missing, INSERT_CHUNK_SIZE):
+                db.session.bulk_insert_mappings(Contact, [
+                    {
+                        'user_id': user_id,
+                        'email': email,
+                        # Extract name from email if possible
+                        'first_name': email.split('@')[0].replace('.', ' ').replace('_', ' ').title(),
+                        'status': ContactStatus.ACTIVE,
+                        'subscribed': True
+                    }
+                    for email in batch
+                ])
+
+            contact_ids.update(AudienceService._lookup_contact_ids(user_id, missing))
+            logger.info(f"Created {len(missing)} new contacts for user {user_id}")
+
+        return contact_ids
+
+    @staticmethod
+    def set_campaign_recipients(campaign_id: int, contact_ids: Iterable[int]) -> Tuple[int, int]:
+        """
+        Make the campaign's recipient rows match the given contacts.
+
+        Only the difference between the stored and requested audience is
+        written: new contacts are bulk inserted and dropped ones deleted.
+
+        Args:
+            campaign_id: Campaign to update
+            contact_ids: Contact IDs that should be recipients
+
+        Returns:
+            Tuple of (added: int, removed: int)
+        """
+        wanted = set(contact_ids)
+        current = {
+            row.contact_id for row in
+            db.session.query(CampaignRecipient.contact_id).filter_by(campaign_id=campaign_id)
+        }
+
+        to_remove = current - wanted
+        to_add = wanted - current
+
+        for batch in chunked(to_remove, LOOKUP_CHUNK_SIZE):
+            CampaignRecipient.query.filter(
+                CampaignRecipient.campaign_id == campaign_id,
+                CampaignRecipient.contact_id.in_(batch)
+            ).delete(synchronize_session=False)
+
+        for batch in chunked(sorted(to_add), INSERT_CHUNK_SIZE):
+            db.session.bulk_insert_mappings(CampaignRecipient, [
+                {'campaign_id': campaign_id, 'contact_id': contact_id}
+                for contact_id in batch
+            ])
+
+        return len(to_add), len(to_remove)
+
+    @staticmethod
+    def sync_campaign_audience(campaign_id: int, user_id: int, raw_recipients) -> int:
+        """
+        Resolve submitted recipients and store them as the campaign audience.
+
+        Args:
+            campaign_id: Campaign to update
+            user_id: Owner of the contacts to resolve or create
+            raw_recipients: Comma separated string or list of email addresses
+
+        Returns:
+            Number of unique recipients in the new audience
+        """
+        emails = AudienceService.parse_recipients(raw_recipients)
+        contact_ids = AudienceService.resolve_contacts(user_id, emails) if emails else {}
+        added, removed = AudienceService.set_campaign_recipients(campaign_id, contact_ids.values())
+
+        logger.info(f"Campaign {campaign_id} audience synced: {len(emails)} recipients (+{added}/-{removed})")
+        return len(emails)
+
+    @staticmethod
+    def _lookup_contact_ids(user_id: int, emails: List[str]) -> Dict[str, int]:
+        """Fetch existing contact IDs for the given emails using chunked IN queries."""
+        contact_ids = {}
+        for batch in chunked(emails, LOOKUP_CHUNK_SIZE):
+            rows = db.session.query(Contact.id, Contact.email).filter(
+                Contact.user_id == user_id,
+                Contact.email.in_(batch)
+            )
+            for contact_id, email in rows:
+                contact_ids[email] = contact_id
+        return contact_ids
@@ -0,0 +1,343 @@
+"""
+Bounce Classifier
+
+Classifies delivery failures from their SMTP reply. The enhanced status code
+(RFC 3463, e.g. 5.1.1 vs 4.2.2) is looked up first; failures without one are
+matched against the text rules of the recipient's provider, then the generic
+ones, all compiled once and tried in order on the lower-cased text; the basic
+reply code class (4xx / 5xx) decides what is left. Failures to connect to our
+own relay, or of a connection to it, never reached the recipient's server:
+they are classified as ``connection`` whatever their text says.
+
+Every rule names a category, and the category decides the bounce type and
+whether the failure is worth retrying. Rules are data: the built-in table
+(DEFAULT_RULES) can be extended or overridden with a JSON file named by
+BOUNCE_RULES_FILE, in the same format:
+
+    {
+      "categories": {"<name>": {"type": "hard" | "soft" | "complaint" | null, "retry": bool, "suppress": bool}},
+      "enhanced_codes": {"5.1.1": "<category>", "x.2.2": "<category>"},
+      "providers": {"<name>": {"domains": ["example.com"], "enhanced_codes": {...}, "rules": [...]}},
+      "rules": [{"pattern": "...", "category": "...", "class": 5}]
+    }
+
+``suppress`` marks failures that prove the address itself is dead, so it is
+added to the suppression list. ``x`` in an enhanced code matches either class. Patterns are case-insensitive
+regular expressions, tried in order; a rule with a ``class`` only applies to
+replies of that class (4 or 5). File rules take precedence over built-in
+ones, provider codes and rules over generic ones.
+"""
+
+import json
+import logging
+import re
+import smtplib
+import threading
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from flask import current_app
+from app.models.email_log import BounceType
+
+logger = logging.getLogger(__name__)
+
+# Reply code and enhanced status code in a failure message, e.g. "550 5.1.1 User unknown"
+REPLY_CODE = re.compile(r'(?<![\d.])([245])\d\d(?![\d.])')
+ENHANCED_CODE = re.compile(r'(?<![\d.])([245])\.(\d{1,3})\.(\d{1,3})(?![\d.])')
+
+# Delivery stages (see smtp_client.STAGE_LABELS) at which the relay itself failed
+CONNECTION_STAGES = ('connect', 'connection')
+
+DEFAULT_RULES = {
+    'categories': {
+        'mailbox_unknown': {'type': 'hard', 'retry': False, 'suppress': True},
+        'domain_unknown': {'type': 'hard', 'retry': False, 'suppress': True},
+        'mailbox_full': {'type': 'soft', 'retry': True},
+        'rate_limited': {'type': 'soft', 'retry': True},
+        'blocked': {'type': 'soft', 'retry': False},
+        'message_rejected': {'type': None, 'retry': False},
+        'connection': {'type': None, 'retry': True},
+        # Reply codes no rule explained, and failures without any
+        'permanent': {'type': 'hard', 'retry': False},
+        'temporary': {'type': 'soft', 'retry': True},
+        'unknown': {'type': 'soft', 'retry': True}
+    },
+    'enhanced_codes': {
+        'x.1.1': 'mailbox_unknown',
+        'x.1.2': 'domain_unknown',
+        'x.1.3': 'mailbox_unknown',
+        'x.1.6': 'mailbox_unknown',
+        'x.1.10': 'domain_unknown',
+        'x.2.1': 'mailbox_unknown',
+        'x.2.2': 'mailbox_full',
+        'x.2.3': 'message_rejected',
+        'x.3.4': 'message_rejected',
+        'x.4.1': 'connection',
+        'x.4.2': 'connection',
+        'x.4.4': 'domain_unknown',
+        'x.4.7': 'connection',
+        'x.5.3': 'rate_limited',
+        '5.7.1': 'blocked',
+        'x.7.23': 'blocked',
+        'x.7.25': 'blocked',
+        'x.7.26': 'blocked',
+        '4.7.0': 'rate_limited',
+        '4.7.28': 'rate_limited'
+    },
+    'providers': {
+        'gmail': {
+            'domains': ['gmail.com', 'googlemail.com'],
+            'enhanced_codes': {'4.2.1': 'rate_limited'},
+            'rules': [
+                {'pattern': r'account that you tried to reach does not exist', 'category': 'mailbox_unknown'},
+                {'pattern': r'account that you tried to reach is (over quota|disabled)', 'category': 'mailbox_full'},
+                {'pattern': r'unusual rate of unsolicited mail|receiving mail at a rate', 'category': 'rate_limited'},
+                {'pattern': r'likely unsolicited mail|poses a security risk|unauthenticated email', 'category': 'blocked'}
+            ]
+        },
+        'microsoft': {
+            'domains': ['outlook.com', 'hotmail.com', 'live.com', 'msn.com'],
+            'enhanced_codes': {'5.1.10': 'mailbox_unknown'},
+            'rules': [
+                {'pattern': r'recipient not found by smtp address lookup|recipientnotfound', 'category': 'mailbox_unknown'},
+                {'pattern': r'\bs3140\b|temporarily rate limited|server busy', 'category': 'rate_limited'},
+                {'pattern': r'\bs3150\b|banned sending ip|on our block list', 'category': 'blocked'}
+            ]
+        },
+        'yahoo': {
+            'domains': ['yahoo.com', 'ymail.com', 'aol.com'],
+            'rules': [
+                {'pattern': r'\bdd this user doesn.t have an? .{0,30}account', 'category': 'mailbox_unknown'},
+                {'pattern': r'\[ts0[1-4]\]|temporarily deferred', 'category': 'rate_limited'},
+                {'pattern': r'\[bl21\]|\[ps\d\d\]|blocked', 'category': 'blocked'}
+            ]
+        }
+    },
+    'rules': [
+        {'pattern': r'user unknown|unknown (user|recipient|mailbox)|no such (user|mailbox|recipient)'
+                    r'|invalid (recipient|mailbox)'
+                    r'|(mailbox|address|user|account) (does not exist|not found|is disabled|has been disabled)'
+                    r'|user not found|not our customer|no mailbox here',
+         'category': 'mailbox_unknown'},
+        # Only in remote replies: the same words from our resolver are about the relay
+        {'pattern': r'domain (not found|does not exist)|host (not found|unknown)|no mx\b|unrouteable address'
+                    r'|name or service not known|nxdomain',
+         'category': 'domain_unknown', 'class': 5},
+        {'pattern': r'mailbox (is )?full|quota exceeded|over ?quota|insufficient (system )?(storage|disk)|exceeded storage',
+         'category': 'mailbox_full'},
+        {'pattern': r'rate limit|too many (\w+ )?(messages|connections|recipients)|try (again )?later|throttl|greylist'
+                    r'|temporar(y|ily) (failure(?! in name resolution)|deferred|rejected|unavailable)|deferred',
+         'category': 'rate_limited'},
+        {'pattern': r'spam|blacklist|blocklist|block list|listed (at|on|in)|reputation|policy (violation|reasons)'
+                    r'|not authorized|access denied|rejected for policy|dmarc|spf (check )?fail',
+         'category': 'blocked'},
+        {'pattern': r'message (size )?(exceeds|too (large|big))|message content rejected|virus',
+         'category': 'message_rejected'},
+        {'pattern': r'connection (refused|reset|lost|closed|timed out|unexpectedly closed)|timed out'
+                    r'|network is unreachable|server disconnected|broken pipe|service not available'
+                    r'|name or service not known|temporary failure in name resolution|nodename nor servname',
+         'category': 'connection'}
+    ]
+}
+
+BOUNCE_TYPES = {'hard': BounceType.HARD, 'soft': BounceType.SOFT, 'complaint': BounceType.COMPLAINT, None: None}
+
+
+class Rule(NamedTuple):
+    """A compiled text rule."""
+    pattern: 're.Pattern'
+    provider: Optional[str]
+    category: str
+    # Reply code class the rule is limited to, if any
+    reply_class: Optional[int] = None
+
+
+class BounceVerdict(NamedTuple):
+    """How a delivery failure was classified."""
+    bounce_type: Optional[BounceType]
+    retryable: bool
+    category: str
+    code: Optional[int] = None
+    enhanced_code: Optional[str] = None
+    provider: Optional[str] = None
+    # Whether the address should be suppressed from further sends
+    suppress: bool = False
+
+    @property
+    def diagnostic(self) -> str:
+        """Short explanation, e.g. '550 5.1.1 mailbox_unknown (gmail)'."""
+        parts = [str(part) for part in (self.code, self.enhanced_code) if part]
+        parts.append(self.category)
+        if self.provider:
+            parts.append(f'({self.provider})')
+        return ' '.join(parts)
+
+
+class BounceClassifier:
+    """Compiled bounce rules."""
+
+    def __init__(self, rules: Optional[Dict] = None):
+        rules = rules or DEFAULT_RULES
+        self.categories: Dict[str, Tuple[Optional[BounceType], bool]] = {
+            name: (BOUNCE_TYPES[spec.get('type')], bool(spec.get('retry')))
+            for name, spec in rules['categories'].items()
+        }
+        self.suppressed_categories = {name for name, spec in rules['categories'].items() if spec.get('suppress')}
+        self.enhanced_codes: Dict[str, str] = {
+            code: self._category(name) for code, name in rules.get('enhanced_codes', {}).items()
+        }
+        self.domains: Dict[str, str] = {}
+        self.provider_codes: Dict[str, Dict[str, str]] = {}
+        provider_rules: Dict[str, List[Rule]] = {}
+        generic: List[Rule] = []
+
+        for provider, spec in rules.get('providers', {}).items():
+            for domain in spec.get('domains', []):
+                self.domains[domain.lower()] = provider
+            self.provider_codes[provider] = {
+                code: self._category(name) for code, name in spec.get('enhanced_codes', {}).items()
+            }
+            provider_rules[provider] = [self._rule(rule, provider) for rule in spec.get('rules', [])]
+        generic = [self._rule(rule, None) for rule in rules.get('rules', [])]
+
+        # Rules tried for unknown domains (every provider's, then generic) and per provider (its own, then generic)
+        self._matchers: Dict[Optional[str], List[Rule]] = {
+            None: [rule for rules_of in provider_rules.values() for rule in rules_of] + generic
+        }
+        for provider, rules_of in provider_rules.items():
+            self._matchers[provider] = rules_of + generic
+
+    @staticmethod
+    def from_file(path: Optional[str]) -> 'BounceClassifier':
+        """Built-in rules extended with those of a JSON file, if any."""
+        if not path:
+            return BounceClassifier()
+        with open(path) as f:
+            extra = json.load(f)
+        rules = {
+            'categories': {**DEFAULT_RULES['categories'], **extra.get('categories', {})},
+            'enhanced_codes': {**DEFAULT_RULES['enhanced_codes'], **extra.get('enhanced_codes', {})},
+            'providers': {},
+            'rules': extra.get('rules', []) + DEFAULT_RULES['rules']
+        }
+        for name in list(extra.get('providers', {})) + list(DEFAULT_RULES['providers']):
+            if name in rules['providers']:
+                continue
+            mine = extra.get('providers', {}).get(name, {})
+            builtin = DEFAULT_RULES['providers'].get(name, {})
+            rules['providers'][name] = {
+                'domains': mine.get('domains', []) + builtin.get('domains', []),
+                'enhanced_codes': {**builtin.get('enhanced_codes', {}), **mine.get('enhanced_codes', {})},
+                'rules': mine.get('rules', []) + builtin.get('rules', [])
+            }
+        return BounceClassifier(rules)
+
+    def classify(self, message: Optional[str], code: Optional[int] = None,
+                 domain: Optional[str] = None, stage: Optional[str] = None) -> BounceVerdict:
+        """
+        Classify a failure.
+
+        Args:
+            message: Failure text, usually containing the SMTP reply
+            code: Reply code, if known separately from the text
+            domain: Recipient domain, to apply that provider's rules first
+            stage: Delivery stage that failed (EnvelopeResult.stage), if known
+
+        Returns:
+            BounceVerdict
+        """
+        if stage in CONNECTION_STAGES:
+            # The relay failed (DNS, refused, login, lost connection): nothing is known about the recipient
+            bounce_type, retryable = self.categories['connection']
+            return BounceVerdict(bounce_type, retryable, 'connection', code)
+
+        message = message or ''
+        if code is None:
+            match = REPLY_CODE.search(message)
+            code = int(match.group(0)) if match else None
+        code_class = code // 100 if code else None
+
+        enhanced = ENHANCED_CODE.search(message)
+        enhanced_code = enhanced.group(0) if enhanced else None
+        provider = self.domains.get((domain or '').lower())
+
+        category = None
+        if enhanced_code:
+            wildcard = 'x.' + enhanced_code.split('.', 1)[1]
+            for codes in (self.provider_codes.get(provider, {}), self.enhanced_codes):
+                category = codes.get(enhanced_code) or codes.get(wildcard)
+                if category:
+                    break
+            code_class = code_class or int(enhanced.group(1))
+        if category is None:
+            text = message.lower()
+            for pattern, rule_provider, rule_category, reply_class in self._matchers.get(provider, self._matchers[None]):
+                if reply_class and reply_class != code_class:
+                    continue
+                if pattern.search(text):
+                    category = rule_category
+                    provider = provider or rule_provider
+                    break
+        if category is None:
+            category = {5: 'permanent', 4: 'temporary'}.get(code_class, 'unknown')
+
+        bounce_type, retryable = self.categories[category]
+        suppress = category in self.suppressed_categories
+        if code_class == 4:
+            # A 4xx reply is temporary whatever the text says
+            retryable = True
+            suppress = False
+            if bounce_type == BounceType.HARD:
+                bounce_type = BounceType.SOFT
+        return BounceVerdict(bounce_type, retryable, category, code, enhanced_code, provider, suppress)
+
+    def classify_exception(self, exc: Exception, recipient: Optional[str] = None) -> BounceVerdict:
+        """Classify an smtplib exception from its reply code and text."""
+        domain = recipient.rsplit('@', 1)[-1] if recipient and '@' in recipient else None
+        if isinstance(exc, smtplib.SMTPRecipientsRefused) and exc.recipients:
+            code, text = exc.recipients.get(recipient) or next(iter(exc.recipients.values()))
+            return self.classify(_text(text), code, domain)
+        if isinstance(exc, smtplib.SMTPResponseException):
+            return self.classify(_text(exc.smtp_error), exc.smtp_code, domain)
+        return self.classify(str(exc), None, domain)
+
+    def _category(self, name: str) -> str:
+        if name not in self.categories:
+            raise ValueError(f"Unknown bounce category: {name}")
+        return name
+
+    def _rule(self, rule: Dict, provider: Optional[str]) -> 'Rule':
+        pattern = rule['pattern']
+        # Text is lower-cased before matching, which is much cheaper than IGNORECASE;
+        # patterns with capitals (e.g. escapes such as \S) still get the flag
+        flags = re.DOTALL if pattern == pattern.lower() else re.DOTALL | re.IGNORECASE
+        return Rule(re.compile(pattern, flags), provider, self._category(rule['category']), rule.get('class'))
+
+
+def _text(value) -> str:
+    return value.decode('utf-8', 'replace') if isinstance(value, bytes) else str(value)
+
+
+_classifier: Optional[BounceClassifier] = None
+_classifier_path: Optional[str] = None
+_classifier_lock = threading.Lock()
+
+
+def get_classifier() -> BounceClassifier:
+    """Classifier for the app's BOUNCE_RULES_FILE, compiled once."""
+    global _classifier, _classifier_path
+    path = current_app.config.get('BOUNCE_RULES_FILE')
+    with _classifier_lock:
+        if _classifier is None or path != _classifier_path:
+            try:
+                _classifier = BounceClassifier.from_file(path)
+            except (OSError, ValueError, KeyError, re.error) as e:
+                logger.error(f"Invalid bounce rules file {path}, using built-in rules: {e}")
+                _classifier = BounceClassifier()
+            _classifier_path = path
+        return _classifier
+
+
+def classify_bounce(message: Optional[str], recipient: Optional[str] = None,
+                    stage: Optional[str] = None) -> BounceVerdict:
+    """Classify a delivery failure message for a recipient address (and the stage that failed, if known)."""
+    domain = recipient.rsplit('@', 1)[-1] if recipient and '@' in recipient else None
+    return get_classifier().classify(message, domain=domain, stage=stage)
@@ -0,0 +1,225 @@
+"""
+Circuit Breaker
+
+An SMTP account whose server cannot be reached, or that no longer logs in,
+fails every delivery the same way, each after a connect timeout. Every
+account therefore has a circuit breaker:
+
+- closed: deliveries go through; SMTP_BREAKER_THRESHOLD consecutive
+  connection or login failures (a failed connect, a connection lost
+  mid-transaction) open it;
+- open: connecting fails at once, without touching the network, for
+  SMTP_BREAKER_COOLDOWN seconds;
+- half-open: once the cooldown is over, the next connection is let through
+  as a probe while the others keep failing fast. A probe that connects
+  closes the breaker; one that fails opens it again for twice the cooldown
+  (up to SMTP_BREAKER_MAX_COOLDOWN).
+
+Only a delivered message resets the failure count of a closed breaker; a
+connection that is made and then lost again does not.
+
+The breaker sits in SMTPService.connect, so campaigns, test emails and
+connection prewarming all respect it; a campaign whose accounts are all open
+is paused instead of failing its remaining recipients. Breakers are kept per
+process; admins see their state on the SMTP account API and can close one by
+hand after fixing the account.
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+# Defaults for SMTP_BREAKER_THRESHOLD, SMTP_BREAKER_COOLDOWN and SMTP_BREAKER_MAX_COOLDOWN
+DEFAULT_THRESHOLD = 5
+DEFAULT_COOLDOWN = 60
+DEFAULT_MAX_COOLDOWN = 15 * 60
+
+# Longest single wait before the stop callback is checked again, in seconds
+WAIT_POLL_INTERVAL = 0.5
+
+# Breaker states
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker over one SMTP account's connections."""
+
+    def __init__(self, name: str = 'SMTP', threshold: int = DEFAULT_THRESHOLD, cooldown: float = DEFAULT_COOLDOWN,
+                 max_cooldown: float = DEFAULT_MAX_COOLDOWN):
+        self.name = name
+        self.threshold = max(1, threshold)
+        self.base_cooldown = max(0.0, float(cooldown))
+        self.max_cooldown = max(self.base_cooldown, float(max_cooldown))
+        self.state = CLOSED
+        # Consecutive connection / login failures
+        self.failures = 0
+        self.cooldown = self.base_cooldown
+        self.opened_at: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+        self.trips = 0
+        # Whether the half-open probe is in flight
+        self.probing = False
+        self._retry_at = 0.0
+        self._condition = threading.Condition()
+
+    @property
+    def blocked(self) -> bool:
+        """Whether a connection attempt would be refused right now (does not take the probe)."""
+        with self._condition:
+            return self._blocked(time.monotonic())
+
+    def wait_ready(self, stop: Optional[Callable[[], bool]] = None) -> bool:
+        """
+        Wait for the outcome of a half-open probe in flight, if there is one.
+
+        Args:
+            stop: Polled while waiting; the wait is abandoned once it returns True
+
+        Returns:
+            Whether a connection may be attempted (False while open, or if stopped)
+        """
+        with self._condition:
+            while self.state == HALF_OPEN and self.probing:
+                if stop is not None and stop():
+                    return False
+                self._condition.wait(WAIT_POLL_INTERVAL)
+            return not self._blocked(time.monotonic())
+
+    def allow(self) -> bool:
+        """
+        Whether to attempt a connection.
+
+        Once the cooldown of an open breaker is over, the first caller gets
+        True and becomes the half-open probe; report its result with
+        ``record_connect`` or ``record_failure``.
+        """
+        with self._condition:
+            if self.state == CLOSED:
+                return True
+            if self._blocked(time.monotonic()):
+                return False
+            self.state = HALF_OPEN
+            self.probing = True
+            return True
+
+    def record_connect(self):
+        """
+        A connection was made: close the breaker if this was the half-open probe.
+
+        Failures counted while closed are kept; a server that accepts
+        connections but drops them mid-transaction still opens the breaker.
+        """
+        with self._condition:
+            if self.state != CLOSED:
+                self.failures = 0
+                logger.info(f"{self.name} circuit closed")
+                self._close()
+
+    def record_success(self):
+        """A message was delivered: close the breaker."""
+        with self._condition:
+            self.failures = 0
+            if self.state != CLOSED:
+                logger.info(f"{self.name} circuit closed")
+                self._close()
+
+    def record_failure(self, error: Optional[str] = None):
+        """A connection or login failed, or a connection was lost."""
+        with self._condition:
+            self.failures += 1
+            self.last_error = error
+            if self.state == HALF_OPEN:
+                # The probe failed: stay away for longer
+                self._open(min(self.max_cooldown, self.cooldown * 2))
+            elif self.state == CLOSED and self.failures >= self.threshold:
+                self._open(self.base_cooldown)
+
+    def reset(self):
+        """Close the breaker by hand (e.g. after the account was fixed)."""
+        with self._condition:
+            self.failures = 0
+            self._close()
+
+    def refusal(self) -> str:
+        """Error for a connection refused while open."""
+        with self._condition:
+            wait = max(0.0, self._retry_at - time.monotonic())
+            return (f"SMTP account circuit open after {self.failures} connection failures "
+                    f"(retry in {wait:.0f}s): {self.last_error}")
+
+    def snapshot(self) -> Dict:
+        """Current state and counters."""
+        with self._condition:
+            retry_at = None
+            if self.state != CLOSED and self.opened_at is not None:
+                retry_at = self.opened_at + timedelta(seconds=self.cooldown)
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'threshold': self.threshold,
+                'cooldown_seconds': self.cooldown,
+                'opened_at': self.opened_at.isoformat() if self.opened_at else None,
+                'retry_at': retry_at.isoformat() if retry_at else None,
+                'last_error': self.last_error,
+                'trips': self.trips
+            }
+
+    def _blocked(self, now: float) -> bool:
+        if self.state == OPEN:
+            return now < self._retry_at
+        if self.state == HALF_OPEN:
+            return self.probing
+        return False
+
+    def _open(self, cooldown: float):
+        self._condition.notify_all()
+        self.state = OPEN
+        self.probing = False
+        self.cooldown = cooldown
+        self.trips += 1
+        self.opened_at = datetime.utcnow()
+        self._retry_at = time.monotonic() + cooldown
+        logger.warning(f"{self.name} circuit opened for {cooldown:.0f}s after {self.failures} "
+                       f"consecutive failures: {self.last_error}")
+
+    def _close(self):
+        self._condition.notify_all()
+        self.state = CLOSED
+        self.probing = False
+        self.cooldown = self.base_cooldown
+        self.opened_at = None
+        self._retry_at = 0.0
+
+
+_breakers: Dict[int, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_for_account(smtp_account_id: int) -> CircuitBreaker:
+    """The process-wide circuit breaker of an SMTP account."""
+    with _breakers_lock:
+        breaker = _breakers.get(smtp_account_id)
+        if breaker is None:
+            config = current_app.config
+            breaker = _breakers[smtp_account_id] = CircuitBreaker(
+                name=f"SMTP account {smtp_account_id}",
+                threshold=config.get('SMTP_BREAKER_THRESHOLD', DEFAULT_THRESHOLD),
+                cooldown=config.get('SMTP_BREAKER_COOLDOWN', DEFAULT_COOLDOWN),
+                max_cooldown=config.get('SMTP_BREAKER_MAX_COOLDOWN', DEFAULT_MAX_COOLDOWN)
+            )
+        return breaker
+
+
+def breaker_state(smtp_account_id: int) -> Dict:
+    """Breaker state of an SMTP account for the admin API (closed if it has none yet)."""
+    breaker = _breakers.get(smtp_account_id)
+    if breaker is None:
+        return {'state': CLOSED, 'consecutive_failures': 0, 'trips': 0}
+    return breaker.snapshot()
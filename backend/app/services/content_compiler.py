@@ -0,0 +1,506 @@
+"""
+Content Compiler
+
+Campaign HTML is compiled once when a campaign is saved or scheduled instead
+of being sent exactly as authored:
+
+- ``<style>`` rules with simple selectors are inlined into ``style``
+  attributes (rules that cannot be inlined, such as ``@media`` blocks or
+  pseudo-classes, stay in a single ``<style>`` block);
+- markup is minified (comments and redundant whitespace removed, except in
+  ``<pre>``/``<textarea>`` and conditional comments);
+- a plain-text alternative is generated when the campaign has none.
+
+The compiled artifact is stored on the campaign together with a hash of the
+source it was built from, so the send path can use it without any per-send
+transformation and detect content edited outside the routes.
+"""
+
+import hashlib
+import html
+import logging
+import re
+from datetime import datetime
+from html.parser import HTMLParser
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from app.models.campaign import Campaign
+
+logger = logging.getLogger(__name__)
+
+# Elements around which whitespace never renders
+BLOCK_TAGS = frozenset((
+    'html', 'head', 'body', 'title', 'meta', 'link', 'style', 'script', 'div', 'p', 'table', 'thead',
+    'tbody', 'tfoot', 'tr', 'td', 'th', 'ul', 'ol', 'li', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+    'blockquote', 'center', 'section', 'header', 'footer', 'article', 'hr', 'br', 'form', 'dl',
+    'dt', 'dd', 'caption', 'colgroup', 'col', 'nav', 'main', 'aside', 'pre'
+))
+
+# Elements whose content is kept byte for byte
+PRESERVE_TAGS = frozenset(('pre', 'textarea'))
+
+# Elements without content or end tag
+VOID_TAGS = frozenset(('area', 'base', 'br', 'col', 'hr', 'img', 'input', 'link', 'meta', 'source', 'wbr'))
+
+# Elements that end a line / paragraph in the generated plain text
+TEXT_LINE_TAGS = frozenset(('div', 'tr', 'table', 'ul', 'ol', 'blockquote', 'center', 'section',
+                            'header', 'footer', 'article', 'dl', 'dt', 'dd', 'pre'))
+TEXT_PARAGRAPH_TAGS = frozenset(('p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'))
+TEXT_SKIP_TAGS = frozenset(('head', 'title', 'style', 'script'))
+
+# tag, tag.class, .class, #id, tag#id.class ... (no combinators or pseudo-classes)
+SIMPLE_SELECTOR = re.compile(r'^([a-zA-Z][\w-]*|\*)?((?:[.#][\w-]+)*)$')
+
+CSS_COMMENT = re.compile(r'/\*.*?\*/', re.S)
+WHITESPACE = re.compile(r'\s+')
+
+
+class CompiledContent(NamedTuple):
+    """Result of compiling campaign content."""
+    html: Optional[str]
+    text: Optional[str]
+    source_hash: str
+
+
+class CSSRule(NamedTuple):
+    """One inlinable rule: a simple selector and its declarations."""
+    specificity: Tuple[int, int, int]
+    order: int
+    tag: Optional[str]
+    ids: Tuple[str, ...]
+    classes: Tuple[str, ...]
+    declarations: Tuple[Tuple[str, str], ...]
+
+    def matches(self, tag: str, element_id: Optional[str], classes: set) -> bool:
+        return (
+            (self.tag is None or self.tag == tag) and
+            all(i == element_id for i in self.ids) and
+            all(c in classes for c in self.classes)
+        )
+
+
+def content_hash(html_content: Optional[str], text_content: Optional[str]) -> str:
+    """Fingerprint of the authored content a compiled artifact was built from."""
+    digest = hashlib.sha256()
+    digest.update((html_content or '').encode('utf-8'))
+    digest.update(b'\0')
+    digest.update((text_content or '').encode('utf-8'))
+    return digest.hexdigest()
+
+
+def split_declarations(block: str) -> List[Tuple[str, str]]:
+    """Split ``a: b; c: d`` into pairs, ignoring ';' inside quotes or parentheses."""
+    declarations = []
+    depth = 0
+    quote = None
+    start = 0
+    for i, char in enumerate(block + ';'):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in '"\'':
+            quote = char
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth = max(depth - 1, 0)
+        elif char == ';' and depth == 0:
+            name, sep, value = block[start:i].partition(':')
+            if sep and name.strip() and value.strip():
+                declarations.append((name.strip().lower(), WHITESPACE.sub(' ', value.strip())))
+            start = i + 1
+    return declarations
+
+
+def minify_css(css: str) -> str:
+    """Drop comments and collapse whitespace in a stylesheet."""
+    css = WHITESPACE.sub(' ', CSS_COMMENT.sub('', css)).strip()
+    return re.sub(r'\s*([{};:,>])\s*', r'\1', css).replace(';}', '}')
+
+
+def parse_stylesheet(css: str, first_order: int = 0) -> Tuple[List[CSSRule], str]:
+    """
+    Split a stylesheet into inlinable rules and the CSS that must stay.
+
+    Returns:
+        Tuple of (rules with simple selectors, remaining CSS text)
+    """
+    css = CSS_COMMENT.sub('', css)
+    rules = []
+    leftover = []
+    i = 0
+    order = first_order
+    while i < len(css):
+        open_brace = css.find('{', i)
+        if open_brace < 0:
+            break
+        prelude = css[i:open_brace].strip()
+
+        # Find the matching closing brace (at-rules such as @media nest)
+        depth = 1
+        j = open_brace + 1
+        while j < len(css) and depth:
+            if css[j] == '{':
+                depth += 1
+            elif css[j] == '}':
+                depth -= 1
+            j += 1
+        body = css[open_brace + 1:j - 1]
+        i = j
+
+        if prelude.startswith('@') or '{' in body:
+            leftover.append(f"{prelude}{{{body}}}")
+            continue
+
+        declarations = tuple(split_declarations(body))
+        kept = []
+        for selector in (s.strip() for s in prelude.split(',')):
+            match = SIMPLE_SELECTOR.match(selector)
+            if not selector or not match:
+                kept.append(selector)
+                continue
+            tag = match.group(1)
+            tag = None if tag in (None, '*') else tag.lower()
+            qualifiers = re.findall(r'[.#][\w-]+', match.group(2))
+            ids = tuple(q[1:] for q in qualifiers if q[0] == '#')
+            classes = tuple(q[1:] for q in qualifiers if q[0] == '.')
+            rules.append(CSSRule(
+                (len(ids), len(classes), 1 if tag else 0), order, tag, ids, classes, declarations
+            ))
+            order += 1
+        if kept:
+            leftover.append(f"{','.join(kept)}{{{body}}}")
+
+    return rules, minify_css(''.join(leftover))
+
+
+class _HTMLRewriter(HTMLParser):
+    """Single pass that inlines CSS and minifies markup."""
+
+    def __init__(self, rules: List[CSSRule], leftover_css: str, minify: bool = True):
+        super().__init__(convert_charrefs=False)
+        self.rules = rules
+        self.leftover_css = leftover_css
+        self.minify = minify
+        self.out: List[str] = []
+        self.preserve_depth = 0
+        self.raw_depth = 0
+        self.in_inlined_style = False
+        self.pending_space = False
+
+    def result(self) -> str:
+        self.close()
+        return ''.join(self.out).strip()
+
+    # Output helpers -------------------------------------------------
+
+    def _emit_tag(self, text: str, tag: str):
+        if self.pending_space and tag not in BLOCK_TAGS:
+            self.out.append(' ')
+        self.pending_space = False
+        if tag in BLOCK_TAGS and self.out and self.out[-1] == ' ':
+            self.out.pop()
+        self.out.append(text)
+
+    def _format_tag(self, tag: str, attrs, self_closing: bool) -> str:
+        parts = [tag]
+        for name, value in attrs:
+            if value is None:
+                parts.append(name)
+            else:
+                parts.append(f'{name}="{html.escape(value, quote=True)}"')
+        return f"<{' '.join(parts)}{' /' if self_closing else ''}>"
+
+    def _inline_styles(self, tag: str, attrs):
+        if not self.rules:
+            return attrs
+        attr_map = dict(attrs)
+        classes = set((attr_map.get('class') or '').split())
+        matched = sorted(
+            (rule for rule in self.rules if rule.matches(tag, attr_map.get('id'), classes)),
+            key=lambda rule: (rule.specificity, rule.order)
+        )
+        if not matched:
+            return attrs
+
+        styles: Dict[str, str] = {}
+        for rule in matched:
+            for name, value in rule.declarations:
+                styles.pop(name, None)
+                styles[name] = value
+        # Existing inline declarations win over stylesheet rules
+        for name, value in split_declarations(attr_map.get('style') or ''):
+            styles.pop(name, None)
+            styles[name] = value
+
+        style = ';'.join(f"{name}:{value}" for name, value in styles.items())
+        return [(n, v) for n, v in attrs if n != 'style'] + [('style', style)]
+
+    # Parser callbacks -----------------------------------------------
+
+    def handle_starttag(self, tag, attrs):
+        self._start(tag, attrs, False)
+
+    def handle_startendtag(self, tag, attrs):
+        self._start(tag, attrs, True)
+
+    def _start(self, tag, attrs, self_closing):
+        if tag == 'style' and not self_closing:
+            media = (dict(attrs).get('media') or 'all').lower()
+            if media in ('all', 'screen'):
+                # Inlined block; only the rules that could not be inlined are written back
+                self.in_inlined_style = True
+                if self.leftover_css:
+                    self._emit_tag(f"<style>{self.leftover_css}</style>", tag)
+                    self.leftover_css = ''
+                return
+
+        attrs = self._inline_styles(tag, attrs)
+        self._emit_tag(self._format_tag(tag, attrs, self_closing), tag)
+        if tag in PRESERVE_TAGS and not self_closing:
+            self.preserve_depth += 1
+        elif tag in ('script', 'style') and not self_closing:
+            self.raw_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag == 'style' and self.in_inlined_style:
+            self.in_inlined_style = False
+            return
+        if tag in PRESERVE_TAGS and self.preserve_depth:
+            self.preserve_depth -= 1
+        elif tag in ('script', 'style') and self.raw_depth:
+            self.raw_depth -= 1
+        if tag not in VOID_TAGS:
+            self._emit_tag(f"</{tag}>", tag)
+
+    def handle_data(self, data):
+        if self.in_inlined_style:
+            return
+        if self.raw_depth and self.minify and self.lasttag == 'style':
+            self.out.append(minify_css(data))
+            return
+        if self.preserve_depth or self.raw_depth or not self.minify:
+            self._flush_space()
+            self.out.append(data)
+            return
+
+        collapsed = WHITESPACE.sub(' ', data)
+        if collapsed == ' ':
+            self.pending_space = True
+            return
+        if collapsed.startswith(' '):
+            self.pending_space = True
+            collapsed = collapsed[1:]
+        self._flush_space()
+        if collapsed.endswith(' '):
+            collapsed = collapsed[:-1]
+            self.pending_space = True
+        self.out.append(collapsed)
+
+    def _flush_space(self):
+        if self.pending_space and self.out and not self._after_block():
+            self.out.append(' ')
+        self.pending_space = False
+
+    def _after_block(self) -> bool:
+        last = self.out[-1]
+        match = re.match(r'</?([a-zA-Z][\w-]*)', last) if last.startswith('<') else None
+        return bool(match and match.group(1).lower() in BLOCK_TAGS)
+
+    def handle_entityref(self, name):
+        self._flush_space()
+        self.out.append(f"&{name};")
+
+    def handle_charref(self, name):
+        self._flush_space()
+        self.out.append(f"&#{name};")
+
+    def handle_comment(self, data):
+        # Keep Outlook conditional comments, drop everything else
+        if data.startswith('[if') or data.startswith('<![endif]') or not self.minify:
+            self._flush_space()
+            self.out.append(f"<!--{data}-->")
+
+    def handle_decl(self, decl):
+        self.out.append(f"<!{decl}>")
+
+    def unknown_decl(self, data):
+        self.out.append(f"<![{data}]>")
+
+    def handle_pi(self, data):
+        self.out.append(f"<?{data}>")
+
+
+class _TextExtractor(HTMLParser):
+    """Render HTML as readable plain text."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.out: List[str] = []
+        self.skip_depth = 0
+        self.preserve_depth = 0
+        self.links: List[Tuple[Optional[str], int]] = []
+
+    def result(self) -> str:
+        self.close()
+        text = ''.join(self.out)
+        text = '\n'.join(line.strip() for line in text.split('\n'))
+        return re.sub(r'\n{3,}', '\n\n', text).strip() + '\n'
+
+    def handle_starttag(self, tag, attrs):
+        attr_map = dict(attrs)
+        if tag in TEXT_SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag == 'br':
+            self.out.append('\n')
+        elif tag == 'hr':
+            self.out.append('\n\n----------\n\n')
+        elif tag == 'li':
+            self.out.append('\n- ')
+        elif tag in ('td', 'th'):
+            self.out.append(' ')
+        elif tag == 'img' and attr_map.get('alt'):
+            self.out.append(attr_map['alt'])
+        elif tag == 'a':
+            self.links.append((attr_map.get('href'), len(self.out)))
+        elif tag in PRESERVE_TAGS:
+            self.preserve_depth += 1
+
+        if tag in TEXT_PARAGRAPH_TAGS:
+            self.out.append('\n\n')
+        elif tag in TEXT_LINE_TAGS:
+            self.out.append('\n')
+
+    def handle_startendtag(self, tag, attrs):
+        if tag not in TEXT_SKIP_TAGS:
+            self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag in TEXT_SKIP_TAGS:
+            self.skip_depth = max(self.skip_depth - 1, 0)
+        elif tag == 'a' and self.links:
+            # Show the target after the link text unless the text already is the URL
+            href, start = self.links.pop()
+            label = ''.join(self.out[start:]).strip()
+            if href and not href.startswith(('mailto:', '#')) and label != href:
+                self.out.append(f" ({href})")
+        elif tag in PRESERVE_TAGS:
+            self.preserve_depth = max(self.preserve_depth - 1, 0)
+
+        if tag in TEXT_PARAGRAPH_TAGS:
+            self.out.append('\n\n')
+        elif tag in TEXT_LINE_TAGS:
+            self.out.append('\n')
+
+    def handle_data(self, data):
+        if self.skip_depth:
+            return
+        self.out.append(data if self.preserve_depth else WHITESPACE.sub(' ', data))
+
+
+def inline_and_minify(html_content: str, minify: bool = True) -> str:
+    """
+    Inline ``<style>`` rules with simple selectors and minify the markup.
+
+    Args:
+        html_content: Authored HTML
+        minify: Also strip comments and redundant whitespace
+
+    Returns:
+        Compiled HTML
+    """
+    rules: List[CSSRule] = []
+    leftover = []
+    for attrs, css in re.findall(r'<style([^>]*)>(.*?)</style>', html_content, re.S | re.I):
+        media = re.search(r'media\s*=\s*["\']?([^"\'\s>]+)', attrs, re.I)
+        if media and media.group(1).lower() not in ('all', 'screen'):
+            continue
+        block_rules, block_leftover = parse_stylesheet(css, len(rules))
+        rules.extend(block_rules)
+        if block_leftover:
+            leftover.append(block_leftover)
+
+    rewriter = _HTMLRewriter(rules, ''.join(leftover), minify)
+    rewriter.feed(html_content)
+    return rewriter.result()
+
+
+def html_to_text(html_content: str) -> str:
+    """Generate a plain-text alternative from HTML."""
+    extractor = _TextExtractor()
+    extractor.feed(html_content)
+    return extractor.result()
+
+
+class ContentCompiler:
+    """Service for compiling campaign content once, ahead of sending."""
+
+    @staticmethod
+    def compile(html_content: Optional[str], text_content: Optional[str]) -> CompiledContent:
+        """
+        Compile authored content.
+
+        Args:
+            html_content: Authored HTML (may contain placeholders)
+            text_content: Authored plain text; generated from the HTML when empty
+
+        Returns:
+            CompiledContent with the HTML and text to send
+        """
+        compiled_html = inline_and_minify(html_content) if html_content else None
+        compiled_text = text_content or (html_to_text(compiled_html) if compiled_html else None)
+        return CompiledContent(compiled_html, compiled_text, content_hash(html_content, text_content))
+
+    @staticmethod
+    def compile_campaign(campaign: Campaign) -> bool:
+        """
+        Compile a campaign's content and store the artifact on it (not committed).
+
+        Returns:
+            True if compiled, False if compilation failed (raw content is sent)
+        """
+        try:
+            compiled = ContentCompiler.compile(campaign.html_content, campaign.text_content)
+        except Exception as e:
+            logger.error(f"Error compiling content for campaign {campaign.id}: {e}")
+            campaign.compiled_html = None
+            campaign.compiled_text = None
+            campaign.content_hash = None
+            return False
+
+        campaign.compiled_html = compiled.html
+        campaign.compiled_text = compiled.text
+        campaign.content_hash = compiled.source_hash
+        campaign.compiled_at = datetime.utcnow()
+
+        if campaign.html_content and compiled.html:
+            logger.info(f"Compiled campaign {campaign.id} content: HTML {len(campaign.html_content)} -> "
+                        f"{len(compiled.html)} chars")
+        return True
+
+    @staticmethod
+    def ensure_compiled(campaign: Campaign) -> bool:
+        """
+        Recompile the campaign only if its content changed since the last compile.
+
+        Returns:
+            True if the stored artifact matches the current content
+        """
+        if campaign.content_hash == content_hash(campaign.html_content, campaign.text_content):
+            return True
+        return ContentCompiler.compile_campaign(campaign)
+
+    @staticmethod
+    def content_for_sending(campaign: Campaign) -> Tuple[Optional[str], Optional[str]]:
+        """
+        HTML and text to send for a campaign.
+
+        Uses the stored artifact, compiling it first if the content changed
+        outside the save routes; falls back to the authored content if
+        compilation fails.
+
+        Returns:
+            Tuple of (html_content, text_content)
+        """
+        if not ContentCompiler.ensure_compiled(campaign):
+            return campaign.html_content, campaign.text_content
+        return campaign.compiled_html, campaign.compiled_text
@@ -0,0 +1,325 @@
+"""
+DKIM Signer
+
+Signs outgoing messages with DKIM (RFC 6376, rsa-sha256, relaxed/relaxed
+canonicalization) using the private key configured on each SMTP account.
+
+RSA signing and body hashing are CPU-bound, so they are kept off the
+delivery threads: messages are signed in batches on a process pool and
+the resulting ``DKIM-Signature`` header is prepended to each message.
+Parsed private keys are cached in every worker process. Memory-mapped
+attachment parts are shipped to workers by file path, not by content.
+"""
+
+import base64
+import hashlib
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from flask import current_app, has_app_context
+from app.services.message_template import CRLF, RenderedMessage, SplicedMessage, message_parts
+
+logger = logging.getLogger(__name__)
+
+# Headers covered by the signature (when present), in signing order
+DKIM_SIGNED_HEADERS = (
+    'from', 'reply-to', 'subject', 'date', 'to', 'message-id', 'mime-version', 'content-type'
+)
+
+# Messages per worker task; large enough to amortize pickling and IPC
+DKIM_BATCH_SIZE = 16
+
+# Smallest RSA key accepted for signing (RFC 8301)
+DKIM_MIN_KEY_BITS = 1024
+
+# Width of the folded b= signature lines
+SIGNATURE_LINE_LENGTH = 72
+
+WSP_RUN = re.compile(rb'[ \t]+')
+
+
+class DKIMKey(NamedTuple):
+    """Signing identity of an SMTP account."""
+    domain: str
+    selector: str
+    private_key: str  # PEM
+
+
+@lru_cache(maxsize=32)
+def load_private_key(pem: str) -> rsa.RSAPrivateKey:
+    """Parse a PEM private key (cached per process)."""
+    key = serialization.load_pem_private_key(pem.encode('ascii'), password=None)
+    if not isinstance(key, rsa.RSAPrivateKey):
+        raise ValueError("DKIM key must be an RSA private key")
+    if key.key_size < DKIM_MIN_KEY_BITS:
+        raise ValueError(f"DKIM key must be at least {DKIM_MIN_KEY_BITS} bits")
+    return key
+
+
+def relaxed_header(name: bytes, value: bytes) -> bytes:
+    """Relaxed canonical form of one header field (RFC 6376 3.4.2)."""
+    value = WSP_RUN.sub(b' ', value.replace(CRLF, b'')).strip(b' ')
+    return name.strip().lower() + b':' + value + CRLF
+
+
+def parse_headers(block: bytes) -> List[Tuple[bytes, bytes]]:
+    """Split a header block into (name, raw value) fields, keeping folds."""
+    fields = []
+    for line in block.split(CRLF):
+        if not line:
+            continue
+        if line[:1] in (b' ', b'\t') and fields:
+            name, value = fields[-1]
+            fields[-1] = (name, value + CRLF + line)
+        else:
+            name, _, value = line.partition(b':')
+            fields.append((name, value))
+    return fields
+
+
+class RelaxedBodyHash:
+    """
+    Incremental SHA-256 of a body in relaxed canonical form (RFC 6376 3.4.4).
+
+    Lines are only rewritten up to the last whitespace of each buffer; the
+    rest (e.g. the base64 body of an attachment) is hashed in place.
+    """
+
+    def __init__(self):
+        self._hash = hashlib.sha256()
+        self._tail = b''
+        self._empty_lines = 0
+
+    def update(self, data):
+        size = len(data)
+        if not size:
+            return
+        if self._tail or data[-2:] != CRLF:
+            self._update_lines(bytes(data))
+            return
+
+        last_wsp = max(data.rfind(b' '), data.rfind(b'\t'))
+        cut = data.find(CRLF, last_wsp) + 2 if last_wsp != -1 else 0
+        if cut:
+            self._update_lines(bytes(data[:cut]))
+        if cut < size:
+            self._update_clean(memoryview(data)[cut:])
+
+    def digest(self) -> bytes:
+        if self._tail:
+            self._line(self._tail)
+            self._tail = b''
+        return self._hash.digest()
+
+    def _update_lines(self, data: bytes):
+        lines = (self._tail + data).split(CRLF)
+        self._tail = lines.pop()
+        for line in lines:
+            self._line(line)
+
+    def _line(self, line: bytes):
+        line = WSP_RUN.sub(b' ', line).rstrip(b' ')
+        if not line:
+            # Trailing empty lines are dropped; only emit them once content follows
+            self._empty_lines += 1
+            return
+        self._hash.update(CRLF * self._empty_lines + line + CRLF)
+        self._empty_lines = 0
+
+    def _update_clean(self, view: memoryview):
+        """Hash whole lines without whitespace, holding back trailing empty lines."""
+        end = len(view)
+        empty = 0
+        while end >= 2 and view[end - 2:end] == CRLF and (end == 2 or view[end - 4:end - 2] == CRLF):
+            end -= 2
+            empty += 1
+        if end:
+            self._hash.update(CRLF * self._empty_lines)
+            self._hash.update(view[:end])
+            self._empty_lines = empty
+        else:
+            self._empty_lines += empty
+
+
+def signature_header(key: DKIMKey, message: RenderedMessage, timestamp: int) -> bytes:
+    """
+    Compute the DKIM-Signature header for a message.
+
+    Args:
+        key: Signing identity
+        message: Complete rendered message
+        timestamp: Signature time (t= tag)
+
+    Returns:
+        Header line(s) terminated by CRLF, to be prepended to the message
+    """
+    parts = list(message_parts(message))
+    separator = parts[0].find(CRLF + CRLF) if isinstance(parts[0], bytes) else -1
+    if separator == -1:
+        parts = [bytes(SplicedMessage(parts))]
+        separator = parts[0].find(CRLF + CRLF)
+        if separator == -1:
+            raise ValueError("Message has no header/body separator")
+
+    head = parts[0]
+    fields = parse_headers(head[:separator + 2])
+    body = RelaxedBodyHash()
+    body.update(head[separator + 4:])
+    for part in parts[1:]:
+        body.update(part)
+
+    # Sign the last instance of each listed header
+    latest = {}
+    for name, value in fields:
+        latest[name.strip().lower()] = (name, value)
+    signed = [latest[h.encode()] for h in DKIM_SIGNED_HEADERS if h.encode() in latest]
+
+    tags = (
+        f"v=1; a=rsa-sha256; c=relaxed/relaxed; d={key.domain}; s={key.selector};\r\n"
+        f"\tt={timestamp}; h={':'.join(name.strip().lower().decode() for name, _ in signed)};\r\n"
+        f"\tbh={base64.b64encode(body.digest()).decode()};\r\n"
+        f"\tb="
+    ).encode('ascii')
+
+    signing_input = b''.join(relaxed_header(name, value) for name, value in signed)
+    signing_input += relaxed_header(b'DKIM-Signature', tags)[:-2]
+    signature = base64.b64encode(
+        load_private_key(key.private_key).sign(signing_input, padding.PKCS1v15(), hashes.SHA256())
+    )
+
+    folded = b'\r\n\t'.join(
+        signature[i:i + SIGNATURE_LINE_LENGTH] for i in range(0, len(signature), SIGNATURE_LINE_LENGTH)
+    )
+    return b'DKIM-Signature: ' + tags + folded + CRLF
+
+
+def check_key(pem: str) -> bool:
+    """Parse a key into the worker's cache (used to warm up the pool)."""
+    load_private_key(pem)
+    return True
+
+
+def sign_batch(key: DKIMKey, messages: Sequence[RenderedMessage], timestamp: int) -> List[bytes]:
+    """Signature headers for a batch of messages (runs in a worker process)."""
+    return [signature_header(key, message, timestamp) for message in messages]
+
+
+def with_header(message: RenderedMessage, header: bytes) -> RenderedMessage:
+    """Prepend a header to a rendered message without copying shared parts."""
+    if isinstance(message, SplicedMessage):
+        return SplicedMessage((header,) + message.parts)
+    return header + message
+
+
+class DKIMSigner:
+    """Service for DKIM-signing outgoing messages."""
+
+    _executor = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def key_for_account(smtp_account) -> Optional[DKIMKey]:
+        """Signing identity of an SMTP account, or None if DKIM is not configured."""
+        if not (smtp_account.dkim_domain and smtp_account.dkim_selector and smtp_account.dkim_private_key):
+            return None
+        return DKIMKey(smtp_account.dkim_domain, smtp_account.dkim_selector, smtp_account.dkim_private_key)
+
+    @staticmethod
+    def validate_key(pem: str) -> Tuple[bool, str]:
+        """
+        Check that a PEM string is a usable DKIM signing key.
+
+        Returns:
+            Tuple of (valid: bool, message: str)
+        """
+        try:
+            load_private_key(pem.strip())
+            return True, "DKIM key is valid"
+        except (ValueError, TypeError, UnicodeEncodeError) as e:
+            return False, f"Invalid DKIM private key: {str(e)}"
+
+    @staticmethod
+    def public_key_record(pem: str) -> str:
+        """DNS TXT record value publishing the public half of a key."""
+        public_key = load_private_key(pem.strip()).public_key().public_bytes(
+            serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo
+        )
+        return f"v=DKIM1; k=rsa; p={base64.b64encode(public_key).decode()}"
+
+    @staticmethod
+    def sign_messages(key: DKIMKey, messages: Sequence[RenderedMessage]) -> List[RenderedMessage]:
+        """
+        Sign messages, fanning batches out over the worker processes.
+
+        The same message object (e.g. one shared body for many envelopes) is
+        signed only once.
+
+        Args:
+            key: Signing identity
+            messages: Rendered messages
+
+        Returns:
+            Signed messages in input order
+        """
+        timestamp = int(time.time())
+        unique = list({id(message): message for message in messages}.values())
+        batches = [unique[i:i + DKIM_BATCH_SIZE] for i in range(0, len(unique), DKIM_BATCH_SIZE)]
+
+        executor = DKIMSigner._get_executor()
+        headers = []
+        if executor is None:
+            for batch in batches:
+                headers.extend(sign_batch(key, batch, timestamp))
+        else:
+            try:
+                futures = [executor.submit(sign_batch, key, batch, timestamp) for batch in batches]
+                for future in futures:
+                    headers.extend(future.result())
+            except BrokenProcessPool as e:
+                logger.error(f"DKIM signing pool failed, signing in-process: {e}")
+                DKIMSigner.shutdown()
+                headers = sign_batch(key, unique, timestamp)
+
+        signed = {id(message): with_header(message, header) for message, header in zip(unique, headers)}
+        return [signed[id(message)] for message in messages]
+
+    @staticmethod
+    def warm_up(key: DKIMKey):
+        """Start the signing processes and load the key into each of them."""
+        load_private_key(key.private_key)
+        executor = DKIMSigner._get_executor()
+        if executor is None:
+            return
+        try:
+            futures = [executor.submit(check_key, key.private_key) for _ in range(executor._max_workers)]
+            for future in futures:
+                future.result()
+        except BrokenProcessPool as e:
+            logger.error(f"DKIM signing pool failed to start: {e}")
+            DKIMSigner.shutdown()
+
+    @staticmethod
+    def _get_executor() -> Optional[ProcessPoolExecutor]:
+        """The shared signing pool (None when signing in-process is configured)."""
+        workers = current_app.config.get('DKIM_SIGNING_WORKERS') if has_app_context() else None
+        if workers == 0:
+            return None
+        with DKIMSigner._lock:
+            if DKIMSigner._executor is None:
+                DKIMSigner._executor = ProcessPoolExecutor(max_workers=workers or None)
+            return DKIMSigner._executor
+
+    @staticmethod
+    def shutdown():
+        """Stop the signing pool; it is recreated on next use."""
+        with DKIMSigner._lock:
+            executor, DKIMSigner._executor = DKIMSigner._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,274 @@
+"""
+Domain Throttle
+
+Receiving providers limit how fast one sender may deliver to their users, and
+answer bursts with 421 deferrals. Sends therefore respect per-domain limits:
+a cap on concurrent deliveries (batches in flight) and a token-bucket rate in
+recipients per second. Gmail, Outlook and Yahoo have their own limits for all
+their domains; every other domain gets the ``default`` limits on its own.
+
+Limits are data: the built-in table (DEFAULT_DOMAIN_LIMITS) can be overridden
+per group with the SEND_DOMAIN_LIMITS setting, a JSON object in the same
+format ("rate": 0 and "concurrency": 0 mean unlimited):
+
+    {"gmail": {"concurrency": 4, "rate": 50}, "acme": {"domains": ["acme.com"], "rate": 5}}
+
+One throttle is shared by every send in the process, so concurrent campaigns
+draw from the same budget. Recipients are also regrouped into batches of one
+domain group, taking turns between groups (``interleave``), so delivery
+workers keep every provider busy at its own rate instead of draining the list
+in database order, one provider at a time.
+"""
+
+import json
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional
+from flask import current_app
+from app.services.send_records import Recipient
+
+logger = logging.getLogger(__name__)
+
+# Built-in limits per domain group; ``default`` applies to each other domain separately
+DEFAULT_DOMAIN_LIMITS = {
+    'gmail': {
+        'domains': ['gmail.com', 'googlemail.com'],
+        'concurrency': 4,
+        'rate': 50
+    },
+    'outlook': {
+        'domains': ['outlook.com', 'hotmail.com', 'live.com', 'msn.com'],
+        'concurrency': 2,
+        'rate': 20
+    },
+    'yahoo': {
+        'domains': ['yahoo.com', 'ymail.com', 'aol.com'],
+        'concurrency': 2,
+        'rate': 10
+    },
+    'default': {
+        'concurrency': 4,
+        'rate': 20
+    }
+}
+
+# Recipients read ahead of the send to regroup them by domain
+INTERLEAVE_LOOKAHEAD = 5000
+
+# Tracked domain groups above which idle, refilled ones are forgotten
+MAX_IDLE_GATES = 1000
+
+# Longest single wait before the stop callback is checked again, in seconds
+WAIT_POLL_INTERVAL = 0.5
+
+
+class DomainLimit(NamedTuple):
+    """Delivery limits of one domain group (0 = unlimited)."""
+    concurrency: int
+    rate: float
+    # Tokens the bucket holds when idle: recipients that may go out at once
+    burst: float
+
+
+class _Gate:
+    """Usage of one domain group's limits."""
+
+    __slots__ = ('limit', 'active', 'tokens', 'updated')
+
+    def __init__(self, limit: DomainLimit):
+        self.limit = limit
+        self.active = 0
+        self.tokens = limit.burst
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        if self.limit.rate:
+            self.tokens = min(self.limit.burst, self.tokens + (now - self.updated) * self.limit.rate)
+        self.updated = now
+
+    def wait_time(self, count: int) -> Optional[float]:
+        """Seconds until ``count`` recipients may go out (None = wait for a free slot)."""
+        if self.limit.concurrency and self.active >= self.limit.concurrency:
+            return None
+        if not self.limit.rate:
+            return 0.0
+        # A window larger than the burst goes out once the bucket is full, leaving it in debt
+        needed = min(count, self.limit.burst)
+        return max(0.0, (needed - self.tokens) / self.limit.rate)
+
+
+class DomainThrottle:
+    """Per-domain concurrency and rate limits, shared by concurrent deliveries."""
+
+    def __init__(self, limits: Optional[Dict] = None):
+        spec = {name: dict(group) for name, group in DEFAULT_DOMAIN_LIMITS.items()}
+        for name, group in (limits or {}).items():
+            spec[name] = {**spec.get(name, {}), **group}
+
+        self.domains: Dict[str, str] = {}
+        self.limits: Dict[str, DomainLimit] = {}
+        for name, group in spec.items():
+            rate = float(group.get('rate') or 0)
+            self.limits[name] = DomainLimit(
+                concurrency=int(group.get('concurrency') or 0),
+                rate=rate,
+                burst=float(group.get('burst') or max(rate, 1.0))
+            )
+            for domain in group.get('domains', []):
+                self.domains[domain.lower()] = name
+        self._gates: Dict[str, _Gate] = {}
+        self._condition = threading.Condition()
+
+    def key(self, email: Optional[str]) -> str:
+        """Domain group an address is throttled under: a provider name, or its own domain."""
+        domain = (email or '').rsplit('@', 1)[-1].strip().lower()
+        return self.domains.get(domain, domain)
+
+    def limit(self, key: str) -> DomainLimit:
+        """Limits that apply to a domain group."""
+        return self.limits.get(key) or self.limits['default']
+
+    def counts(self, recipients: Iterable[Recipient]) -> Dict[str, int]:
+        """Number of recipients per domain group."""
+        counts: Dict[str, int] = {}
+        for recipient in recipients:
+            key = self.key(recipient.email)
+            counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    def acquire(self, counts: Dict[str, int], stop: Optional[Callable[[], bool]] = None) -> Optional[float]:
+        """
+        Wait until recipients of the given domain groups may be delivered.
+
+        Takes a delivery slot of every group and its recipients' rate tokens,
+        all at once; release the slots with ``release`` after delivering.
+
+        Args:
+            counts: Recipients to deliver per domain group (see ``counts``)
+            stop: Polled while waiting; the wait is abandoned once it returns True
+
+        Returns:
+            Seconds waited, or None if stopped (nothing was acquired)
+        """
+        started = time.monotonic()
+        with self._condition:
+            while True:
+                if stop is not None and stop():
+                    return None
+                now = time.monotonic()
+                delay = 0.0
+                for key, count in counts.items():
+                    gate = self._gates.get(key)
+                    if gate is None:
+                        gate = self._gates[key] = _Gate(self.limit(key))
+                    gate.refill(now)
+                    wait = gate.wait_time(count)
+                    delay = WAIT_POLL_INTERVAL if wait is None else max(delay, wait)
+                    if wait is None:
+                        break
+                if delay <= 0:
+                    for key, count in counts.items():
+                        gate = self._gates[key]
+                        gate.active += 1
+                        if gate.limit.rate:
+                            gate.tokens -= count
+                    return now - started
+                self._condition.wait(min(delay, WAIT_POLL_INTERVAL))
+
+    def release(self, counts: Dict[str, int]):
+        """Give back the delivery slots taken by ``acquire``."""
+        with self._condition:
+            for key in counts:
+                gate = self._gates.get(key)
+                if gate is not None and gate.active:
+                    gate.active -= 1
+            if len(self._gates) > MAX_IDLE_GATES:
+                self._prune(time.monotonic())
+            self._condition.notify_all()
+
+    def _prune(self, now: float):
+        """Forget groups with nothing in flight and a full bucket (their state is the initial one)."""
+        for key, gate in list(self._gates.items()):
+            gate.refill(now)
+            if not gate.active and gate.tokens >= gate.limit.burst:
+                del self._gates[key]
+
+    def interleave(self, recipients: Iterable[Recipient], batch_size: int,
+                   lookahead: int = INTERLEAVE_LOOKAHEAD) -> Iterator[List[Recipient]]:
+        """
+        Regroup recipients into batches of one domain group, taking turns.
+
+        Up to ``lookahead`` recipients are read ahead and queued per group;
+        every round yields one full batch of each group that has one. Groups
+        too small to fill a batch within the lookahead (e.g. many small
+        company domains) are sent together in mixed batches.
+
+        Args:
+            recipients: Recipients in any order, e.g. a RecipientSource
+            batch_size: Recipients per batch
+            lookahead: Recipients buffered at most
+
+        Yields:
+            Lists of at most ``batch_size`` recipients
+        """
+        source = iter(recipients)
+        lookahead = max(lookahead, batch_size)
+        queues: Dict[str, List[Recipient]] = {}
+        buffered = 0
+        exhausted = False
+        while True:
+            while not exhausted and buffered < lookahead:
+                recipient = next(source, None)
+                if recipient is None:
+                    exhausted = True
+                    break
+                queues.setdefault(self.key(recipient.email), []).append(recipient)
+                buffered += 1
+            if not queues:
+                return
+
+            full = [key for key, queue in queues.items() if len(queue) >= batch_size]
+            if full:
+                for key in full:
+                    queue = queues[key]
+                    yield queue[:batch_size]
+                    del queue[:batch_size]
+                    buffered -= batch_size
+                    if not queue:
+                        del queues[key]
+                continue
+
+            # No group fills a batch: mix the groups, smallest first, into one
+            mixed: List[Recipient] = []
+            for key in sorted(queues, key=lambda name: len(queues[name])):
+                queue = queues[key]
+                taken = queue[:batch_size - len(mixed)]
+                mixed.extend(taken)
+                del queue[:len(taken)]
+                if not queue:
+                    del queues[key]
+                if len(mixed) >= batch_size:
+                    break
+            buffered -= len(mixed)
+            yield mixed
+
+
+_throttle: Optional[DomainThrottle] = None
+_throttle_spec: Optional[str] = None
+_throttle_lock = threading.Lock()
+
+
+def get_domain_throttle() -> DomainThrottle:
+    """The process-wide throttle for the app's SEND_DOMAIN_LIMITS."""
+    global _throttle, _throttle_spec
+    spec = current_app.config.get('SEND_DOMAIN_LIMITS')
+    with _throttle_lock:
+        if _throttle is None or spec != _throttle_spec:
+            try:
+                _throttle = DomainThrottle(json.loads(spec) if spec else None)
+            except (ValueError, TypeError, AttributeError) as e:
+                logger.error(f"Invalid SEND_DOMAIN_LIMITS, using built-in limits: {e}")
+                _throttle = DomainThrottle()
+            _throttle_spec = spec
+        return _throttle
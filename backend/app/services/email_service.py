@@ -1,15 +1,38 @@
 from datetime import datetime
-from typing import List, Dict, Optional, Tuple, Union
+from typing import Iterable, List, Dict, Optional, Tuple, Union
 import logging
+import threading
+import time
+from sqlalchemy import func
 from app import db
 from app.models.campaign import Campaign, CampaignRecipient, CampaignStatus
-from app.models.contact import Contact, ContactStatus
+from app.models.smtp_account import SMTPAccount
 from app.models.smtp_config import SMTPConfig
 from app.models.smtp_settings import SMTPSettings
+from app.services.account_pool import AccountPool, Dispatch, PoolMember, is_account_failure
+from app.services.adaptive_limiter import save_limiter_state
 from app.services.smtp_service import SMTPService
+from app.services.attachment_service import attachment_cache
+from app.services.bounce_classifier import CONNECTION_STAGES, classify_bounce
+from app.services.content_compiler import ContentCompiler
+from app.services.dkim_signer import DKIMSigner
+from app.services.domain_throttle import get_domain_throttle
+from app.services.recipient_source import RecipientSource
+from app.services.send_control import SendControl
+from app.services.send_ledger import SendLedger
+from app.services.send_pipeline import SendBatch, SendPipeline, Stage, envelope_outcomes, stage_workers
+from app.services.send_records import Recipient, SendOutcome, SendSummary
+from app.services.smtp_client import POOL_MAX_IDLE
+from app.services.suppression_list import SuppressionEntry, SuppressionList
 
 logger = logging.getLogger(__name__)
 
+# Recipients per pipeline batch: rendered, delivered and recorded (one commit) together
+SEND_BATCH_SIZE = 200
+
+# Connection-stage failures of one message on the last account left before the send is paused
+RELAY_RETRY_LIMIT = 3
+
 class EmailService:
     """High-level service for managing email campaigns and delivery."""
     
@@ -35,12 +58,11 @@ class EmailService:
             if not campaign.can_be_sent():
                 return False, "Campaign cannot be sent - missing required fields", {}
             
-            if campaign.status not in [CampaignStatus.DRAFT, CampaignStatus.SCHEDULED]:
+            if campaign.status not in [CampaignStatus.DRAFT, CampaignStatus.SCHEDULED, CampaignStatus.PAUSED]:
                 return False, f"Campaign cannot be sent - status is {campaign.status.value}", {}
+            resuming = campaign.status == CampaignStatus.PAUSED
             
             # Get the SMTP account assigned to this campaign
-            from app.models.smtp_account import SMTPAccount
-            
             if not campaign.smtp_account_id:
                 return False, "No SMTP account assigned to this campaign. Please select an SMTP account.", {}
             
@@ -48,45 +70,63 @@ class EmailService:
             if not smtp_account:
                 return False, "SMTP account not found", {}
             
-            if not smtp_account.is_active:
-                return False, "SMTP account is not active", {}
+            # A campaign using the pool may also send through the owner's other accounts
+            if not campaign.use_smtp_pool:
+                if not smtp_account.is_active:
+                    return False, "SMTP account is not active", {}
+                
+                if not smtp_account.is_verified:
+                    return False, "SMTP account is not verified. Please contact your administrator.", {}
             
-            if not smtp_account.is_verified:
-                return False, "SMTP account is not verified. Please contact your administrator.", {}
+            smtp_accounts = AccountPool.accounts_for(campaign)
+            if not smtp_accounts:
+                return False, "No active, verified SMTP account is assigned to you", {}
             
-            logger.info(f"Using SMTP account '{smtp_account.name}' (ID: {smtp_account.id}) for campaign {campaign_id}")
+            logger.info(f"Using SMTP account(s) {', '.join(repr(a.name) for a in smtp_accounts)} for campaign {campaign_id}")
             
-            # Get campaign recipients
+            # Get campaign recipients (streamed lazily during the send)
             recipients = EmailService._get_campaign_recipients(campaign)
-            if not recipients:
+            total_recipients = recipients.count()
+            if not total_recipients:
                 return False, "No valid recipients found for this campaign", {}
             
+            summary = SendSummary()
+            if resuming:
+                # Continue after the recipients the paused send already recorded
+                recipients = RecipientSource(campaign, pending_only=True)
+                summary.succeeded = campaign.emails_delivered or 0
+                summary.failed = campaign.emails_failed or 0
+                summary.total = summary.succeeded + summary.failed
+                summary.bytes_sent = campaign.bytes_sent or 0
+                logger.info(f"Resuming campaign {campaign_id} after {summary.total} recorded recipients")
+            
             # Update campaign status
+            SendControl.clear(campaign_id)
             campaign.status = CampaignStatus.SENDING
-            campaign.sent_at = datetime.utcnow()
-            campaign.total_recipients = len(recipients)
+            if not resuming:
+                campaign.sent_at = datetime.utcnow()
+            campaign.total_recipients = total_recipients
             db.session.commit()
             
             # Send emails
-            results = EmailService._send_campaign_emails(campaign, recipients, smtp_account)
+            summary = EmailService._send_campaign_emails(campaign, recipients, smtp_accounts, summary)
             
             # Update campaign with results
-            EmailService._update_campaign_results(campaign, results)
+            EmailService._update_campaign_results(campaign, summary)
+            
+            if summary.stopped:
+                # Paused or cancelled mid-send: keep the requested status
+                campaign.status = CampaignStatus(summary.stopped)
+                db.session.commit()
+                SendControl.clear(campaign_id)
+                return True, f"Campaign {summary.stopped}: {summary.succeeded}/{total_recipients} emails delivered", summary.to_dict()
             
             # Mark campaign as completed
             campaign.status = CampaignStatus.SENT
             campaign.completed_at = datetime.utcnow()
             db.session.commit()
             
-            success_count = sum(1 for r in results if r['success'])
-            total_count = len(results)
-            
-            return True, f"Campaign sent: {success_count}/{total_count} emails delivered", {
-                'total_recipients': total_count,
-                'successful_sends': success_count,
-                'failed_sends': total_count - success_count,
-                'results': results
-            }
+            return True, f"Campaign sent: {summary.succeeded}/{summary.total} emails delivered", summary.to_dict()
             
         except Exception as e:
             logger.error(f"Error sending campaign {campaign_id}: {e}")
@@ -98,6 +138,86 @@ class EmailService:
             
             return False, f"Failed to send campaign: {str(e)}", {}
     
+    @staticmethod
+    def prepare_campaign(campaign_id: int) -> Tuple[bool, str]:
+        """
+        Do a scheduled campaign's setup work ahead of its send time.
+        
+        Snapshots the audience (CampaignRecipient rows), compiles the content,
+        maps the encoded attachments and starts the DKIM signing processes, so
+        that none of it delays the first message at the scheduled instant.
+        Every step is idempotent; send_campaign reuses what was prepared.
+        
+        Args:
+            campaign_id: ID of the scheduled campaign
+            
+        Returns:
+            Tuple of (success: bool, message: str)
+        """
+        try:
+            campaign = Campaign.query.get(campaign_id)
+            if not campaign:
+                return False, "Campaign not found"
+            
+            if campaign.status != CampaignStatus.SCHEDULED:
+                return False, f"Campaign is not scheduled - status is {campaign.status.value}"
+            
+            recipients = EmailService._get_campaign_recipients(campaign)
+            campaign.total_recipients = recipients.count()
+            ContentCompiler.content_for_sending(campaign)
+            db.session.commit()
+            
+            attachment_cache.parts_for_campaign(campaign)
+            
+            smtp_account = SMTPAccount.query.get(campaign.smtp_account_id) if campaign.smtp_account_id else None
+            dkim_key = DKIMSigner.key_for_account(smtp_account) if smtp_account else None
+            if dkim_key:
+                DKIMSigner.warm_up(dkim_key)
+            
+            logger.info(f"Prepared scheduled campaign {campaign_id}: {campaign.total_recipients} recipients")
+            return True, f"Campaign prepared for {campaign.total_recipients} recipients"
+            
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error preparing campaign {campaign_id}: {e}")
+            return False, f"Failed to prepare campaign: {str(e)}"
+    
+    @staticmethod
+    def prewarm_connections(campaign_id: int) -> int:
+        """
+        Open a campaign's delivery connections shortly before it is sent.
+        
+        One authenticated connection per delivery worker is opened in
+        parallel and parked in the shared connection pool, where the send
+        pipeline picks them up.
+        
+        Args:
+            campaign_id: ID of the scheduled campaign
+            
+        Returns:
+            Number of connections opened
+        """
+        campaign = Campaign.query.get(campaign_id)
+        if not campaign or not campaign.smtp_account_id:
+            return 0
+        smtp_account = SMTPAccount.query.get(campaign.smtp_account_id)
+        if not smtp_account or not smtp_account.is_active:
+            return 0
+        
+        services = [SMTPService(smtp_account) for _ in range(min(stage_workers('deliver'), POOL_MAX_IDLE))]
+        threads = [threading.Thread(target=service.connect, daemon=True) for service in services]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        opened = sum(1 for service in services if service.transport.is_open)
+        for service in services:
+            service.disconnect()
+        
+        logger.info(f"Pre-warmed {opened}/{len(services)} connections for campaign {campaign_id}")
+        return opened
+    
     @staticmethod
     def send_test_email(campaign_id: int, user_id: int, test_email: str) -> Tuple[bool, str]:
         """
@@ -127,13 +247,15 @@ class EmailService:
             if not smtp_config:
                 return False, "No active SMTP configuration found"
             
-            # Send test email
+            # Send test email with the same compiled content recipients get
+            html_content, text_content = ContentCompiler.content_for_sending(campaign)
             with SMTPService(smtp_config) as smtp_service:
                 success, message = smtp_service.send_email(
                     to_email=test_email,
                     subject=f"[TEST] {campaign.subject}",
-                    html_content=campaign.html_content,
-                    text_content=campaign.text_content
+                    html_content=html_content,
+                    text_content=text_content,
+                    encoded_attachments=attachment_cache.parts_for_campaign(campaign)
                 )
             
             if success:
@@ -198,132 +320,311 @@ class EmailService:
             return False, f"Failed to test SMTP configuration: {str(e)}"
     
     @staticmethod
-    def _get_campaign_recipients(campaign: Campaign) -> List[Dict]:
-        """Get all valid recipients for a campaign."""
-        try:
-            # First, check if this campaign has specific recipients assigned
-            existing_recipients = CampaignRecipient.query.filter_by(
-                campaign_id=campaign.id
-            ).all()
-            
-            if existing_recipients:
-                # Campaign has specific recipients - use only those
-                logger.info(f"Campaign {campaign.id} has {len(existing_recipients)} specific recipients assigned")
-                recipients = []
-                
-                for recipient_record in existing_recipients:
-                    contact = Contact.query.get(recipient_record.contact_id)
-                    if contact and contact.is_sendable():
-                        recipients.append({
-                            'email': contact.email,
-                            'first_name': contact.first_name or '',
-                            'last_name': contact.last_name or '',
-                            'full_name': contact.full_name or contact.email,
-                            'contact_id': contact.id,
-                            'recipient_record': recipient_record
-                        })
-                
-                return recipients
-            
-            # No specific recipients - use all active, subscribed contacts for the user (legacy behavior)
-            logger.info(f"Campaign {campaign.id} has no specific recipients, using all active contacts")
-            contacts = Contact.query.filter_by(
-                user_id=campaign.user_id,
-                status=ContactStatus.ACTIVE,
-                subscribed=True
-            ).all()
-            
-            recipients = []
-            for contact in contacts:
-                if contact.is_sendable():
-                    # Create campaign recipient record
-                    recipient_record = CampaignRecipient(
-                        campaign_id=campaign.id,
-                        contact_id=contact.id
-                    )
-                    db.session.add(recipient_record)
-                    
-                    recipients.append({
-                        'email': contact.email,
-                        'first_name': contact.first_name or '',
-                        'last_name': contact.last_name or '',
-                        'full_name': contact.full_name or contact.email,
-                        'contact_id': contact.id,
-                        'recipient_record': recipient_record
-                    })
-            
-            db.session.commit()
-            return recipients
-            
-        except Exception as e:
-            logger.error(f"Error getting campaign recipients: {e}")
-            return []
+    def _get_campaign_recipients(campaign: Campaign) -> RecipientSource:
+        """Get a lazy source over all valid recipients for a campaign."""
+        recipients = RecipientSource(campaign)
+        recipients.materialize()
+        return recipients
     
     @staticmethod
     def _send_campaign_emails(
         campaign: Campaign, 
-        recipients: List[Dict], 
-        smtp_account
-    ) -> List[Dict]:
-        """Send emails to all campaign recipients."""
-        from app.models.smtp_account import SMTPAccount
+        recipients: Iterable[Recipient], 
+        smtp_accounts: List[SMTPAccount],
+        summary: Optional[SendSummary] = None
+    ) -> SendSummary:
+        """
+        Send emails to all campaign recipients through the staged send pipeline.
         
-        results = []
+        Recipients are resolved in batches of SEND_BATCH_SIZE, rendered,
+        DKIM-signed (when the account has a key), delivered over one pooled
+        connection per delivery worker and recorded with one commit per batch.
         
-        try:
-            with SMTPService(smtp_account) as smtp_service:
-                results = smtp_service.bulk_send_emails(
-                    recipients=recipients,
-                    subject=campaign.subject,
-                    html_template=campaign.html_content,
-                    text_template=campaign.text_content,
-                    batch_size=10  # Reconnect every 10 emails to avoid timeouts
-                )
-                
+        Each batch is dispatched to one of ``smtp_accounts`` (AccountPool),
+        weighted by daily limit headroom and health; messages an account
+        fails to deliver for reasons of its own fail over to another one.
+        
+        Batches hold recipients of one domain group and take turns between
+        groups, and delivery waits for each group's concurrency and rate
+        limits (DomainThrottle), so no receiving provider is hit in bursts.
+        The account's own concurrency and rate adapt to how its server
+        copes (AdaptiveLimiter) and are saved on the account afterwards.
+        
+        Every batch is claimed in the send ledger before it is sent, so
+        recipients another send of the campaign has reached are skipped.
+        Suppressed addresses are dropped from each batch, and hard bounces
+        and complaints are added to the suppression list.
+        
+        A pause or cancel request (SendControl) stops the pipeline between
+        batches; recipients of dropped batches stay pending for a resume.
+        So does the campaign's send time limit, whose deadline also bounds
+        every SMTP operation of the send.
+        Results are folded into ``summary`` when given (a resumed send).
+        """
+        summary = summary or SendSummary()
+        deadline = SendControl.deadline_for(campaign)
+        html_content, text_content = ContentCompiler.content_for_sending(campaign)
+        
+        # Persist lazily compiled content: pipeline threads use their own sessions
+        db.session.commit()
+        
+        # Attachments were encoded at upload; every message shares the mapped parts
+        attachment_parts = attachment_cache.parts_for_campaign(campaign)
+        
+        # The campaign's message is built once for every account it sends through
+        pool = AccountPool.build(
+            smtp_accounts,
+            subject=campaign.subject,
+            html_content=html_content,
+            text_content=text_content,
+            encoded_attachments=attachment_parts,
+            expected=campaign.total_recipients or 0
+        )
+        
+        campaign_id = campaign.id
+        user_id = campaign.user_id
+        claim_token = SendLedger.new_token()
+        suppressed = SuppressionList.load(user_id)
+        skipped = {'suppressed': 0}
+        throttle = get_domain_throttle()
+        throttled = {'seconds': 0.0}
+        timed_out = {'count': 0}
+        throttled_lock = threading.Lock()
+        
+        def resolve():
+            seq = 0
+            for window in throttle.interleave(recipients, SEND_BATCH_SIZE):
+                claimed = SendLedger.claim(campaign_id, [r.recipient_id for r in window], claim_token)
+                window = [r for r in window if r.recipient_id in claimed]
+                window, count = SuppressionList.skip_suppressed(campaign_id, window, suppressed)
+                skipped['suppressed'] += count
+                if window:
+                    # The account is picked up front: the message is rendered for it
+                    member = pool.choose(len(window))
+                    yield SendBatch(seq, window, context=Dispatch(member) if member else None)
+                    seq += 1
+        
+        def render(batch: SendBatch):
+            if batch.context is None:
+                raise ValueError(pool.members[0].template_error if pool.members else "No SMTP account to send with")
+            
+            addressed = []
+            for recipient in batch.recipients:
+                if recipient.email:
+                    addressed.append(recipient)
+                else:
+                    batch.outcomes.append((recipient, SendOutcome('unknown', False, 'No email address provided')))
+            
+            batch.groups, batch.envelopes = batch.context.member.render(addressed)
+        
+        def sign(batch: SendBatch):
+            batch.envelopes = batch.context.member.service.sign_envelopes(batch.envelopes)
+        
+        def make_deliverer():
+            # One transport (e.g. pooled SMTP connection) per account and delivery worker, opened on first use
+            services: Dict[int, SMTPService] = {}
+            
+            def send_window(batch: SendBatch, member: PoolMember, window: List, sign: bool):
+                """Deliver a window within the domain and account limits (None if the pipeline stopped)."""
+                counts = throttle.counts(r for _, group in window for r in group)
+                waited = throttle.acquire(counts, stop=lambda: pipeline.stopping)
+                if waited is None:
+                    return None
+                started = member.limiter.acquire(len(window), stop=lambda: pipeline.stopping)
+                if started is None:
+                    throttle.release(counts)
+                    return None
+                service = services.get(member.account_id)
+                if service is None:
+                    service = services[member.account_id] = SMTPService(member.account)
+                    service.transport.deadline = deadline
+                bytes_before = service.bytes_sent
+                timed_out_before = service.transport.timed_out
+                verdicts = None
+                try:
+                    verdicts = service.send_envelopes(
+                        [envelope for envelope, _ in window], member.template.mail_options, sign=sign
+                    )
+                finally:
+                    member.limiter.release(started, verdicts)
+                    throttle.release(counts)
+                    batch.bytes_sent += service.bytes_sent - bytes_before
+                with throttled_lock:
+                    throttled['seconds'] += waited
+                    timed_out['count'] += service.transport.timed_out - timed_out_before
+                return verdicts
+            
+            def deliver(batch: SendBatch):
+                dispatch = batch.context
+                member = dispatch.member
+                tried = {member.account_id}
+                # The sign stage signed the batch; failed-over messages are signed as they are sent
+                sign = False
+                pending = list(zip(batch.envelopes, batch.groups))
+                # Connection-stage failures per envelope (by id) on the last account left
+                attempts: Dict[int, int] = {}
+                while pending:
+                    if pipeline.stopping:
+                        # The rest of the batch stays pending for a resume
+                        return
+                    failed = []
+                    if member.breaker.wait_ready(stop=lambda: pipeline.stopping):
+                        size = member.service.transport.batch_size
+                        window, pending = pending[:size], pending[size:]
+                        verdicts = send_window(batch, member, window, sign)
+                        if verdicts is None:
+                            return
+                        for (envelope, group), verdict in zip(window, verdicts):
+                            if is_account_failure(verdict):
+                                failed.append((envelope, group, verdict))
+                                continue
+                            outcomes = envelope_outcomes(group, verdict)
+                            batch.outcomes.extend(outcomes)
+                            accepted = sum(1 for _, outcome in outcomes if outcome.success)
+                            dispatch.delivered[member.account_id] = dispatch.delivered.get(member.account_id, 0) + accepted
+                        pool.report(member, len(window) - len(failed), len(failed))
+                        if not failed:
+                            continue
+                    elif pipeline.stopping:
+                        return
+                    
+                    # Move the failed envelopes and the rest of the batch to another account (or all of
+                    # it, if the account's circuit is open); once every account was tried, the failures are
+                    # final - except those of the relay itself, which are tried again until it recovers,
+                    # its circuit opens or a message has failed RELAY_RETRY_LIMIT times
+                    stranded = [recipient for _, group, _ in failed for recipient in group]
+                    stranded += [recipient for _, group in pending for recipient in group]
+                    fallback = pool.fail_over(member, len(stranded), exclude=tried)
+                    if fallback is None:
+                        if member.breaker.blocked:
+                            # No account can connect: leave the rest of the campaign for a resume
+                            logger.warning(f"Campaign {campaign_id}: circuit of SMTP account '{member.name}' "
+                                           f"is open and no other account is left, pausing the send")
+                            pipeline.stop(CampaignStatus.PAUSED)
+                            return
+                        retry = []
+                        for envelope, group, verdict in failed:
+                            if verdict.stage in CONNECTION_STAGES:
+                                attempts[id(envelope)] = attempts.get(id(envelope), 0) + 1
+                                retry.append((envelope, group))
+                            else:
+                                batch.outcomes.extend(envelope_outcomes(group, verdict))
+                        if any(attempts[id(envelope)] >= RELAY_RETRY_LIMIT for envelope, _ in retry):
+                            # The relay keeps dropping the connection: leave the rest of the campaign for a resume
+                            logger.warning(f"Campaign {campaign_id}: SMTP account '{member.name}' lost the connection "
+                                           f"{RELAY_RETRY_LIMIT} times on the same message and no other account "
+                                           f"is left, pausing the send")
+                            pipeline.stop(CampaignStatus.PAUSED)
+                            return
+                        pending = retry + pending
+                        continue
+                    logger.warning(f"Campaign {campaign_id}: failing {len(stranded)} recipients over "
+                                   f"from SMTP account '{member.name}' to '{fallback.name}'")
+                    groups, envelopes = fallback.render(stranded)
+                    pending = list(zip(envelopes, groups))
+                    member = fallback
+                    tried.add(member.account_id)
+                    sign = True
+            
+            def close():
+                for service in services.values():
+                    service.disconnect()
+            
+            deliver.close = close
+            return deliver
+        
+        def record(batch: SendBatch):
+            if batch.error:
+                batch.fail_all(batch.error)
+            
+            try:
                 # Update recipient records with results
-                for i, result in enumerate(results):
-                    if i < len(recipients):
-                        recipient = recipients[i]
-                        recipient_record = recipient['recipient_record']
-                        
-                        if result['success']:
-                            recipient_record.email_sent = True
-                            recipient_record.sent_at = datetime.utcnow()
-                            # Update SMTP account usage
-                            smtp_account.total_emails_sent += 1
-                            smtp_account.emails_sent_today += 1
-                            smtp_account.last_used_at = datetime.utcnow()
-                        else:
-                            recipient_record.email_failed = True
-                            recipient_record.error_message = result.get('error', 'Unknown error')
+                now = datetime.utcnow()
+                updates = []
+                suppress = []
+                sent = 0
+                for recipient, outcome in batch.outcomes:
+                    if outcome.success:
+                        sent += 1
+                        updates.append({'id': recipient.recipient_id, 'email_sent': True, 'sent_at': now})
+                    else:
+                        updates.append({
+                            'id': recipient.recipient_id,
+                            'email_failed': True,
+                            'error_message': outcome.error or 'Unknown error'
+                        })
+                        if recipient.email and not batch.error:
+                            verdict = classify_bounce(outcome.error, recipient.email, outcome.stage)
+                            reason = SuppressionList.reason_for(verdict, outcome.stage, outcome.shared)
+                            if reason:
+                                suppress.append(SuppressionEntry(user_id, recipient.email, reason, verdict.diagnostic))
+                db.session.bulk_update_mappings(CampaignRecipient, updates)
+                
+                # Update the usage of the SMTP accounts that delivered
+                for smtp_account_id, delivered in (batch.context.delivered.items() if batch.context else ()):
+                    if not delivered:
+                        continue
+                    SMTPAccount.query.filter_by(id=smtp_account_id).update({
+                        SMTPAccount.total_emails_sent: func.coalesce(SMTPAccount.total_emails_sent, 0) + delivered,
+                        SMTPAccount.emails_sent_today: func.coalesce(SMTPAccount.emails_sent_today, 0) + delivered,
+                        SMTPAccount.last_used_at: now
+                    }, synchronize_session=False)
                 
                 db.session.commit()
                 
-        except Exception as e:
-            logger.error(f"Error sending campaign emails: {e}")
-            # Mark all remaining as failed
-            for recipient in recipients:
-                results.append({
-                    'email': recipient['email'],
-                    'success': False,
-                    'error': str(e)
-                })
+                if suppress:
+                    SuppressionList.add(suppress, campaign_id)
+                
+            except Exception as e:
+                logger.error(f"Error recording campaign send results: {e}")
+                db.session.rollback()
+            
+            summary.record_all(outcome for _, outcome in batch.outcomes)
+            summary.bytes_sent += batch.bytes_sent
         
-        return results
+        stages = [Stage('render', lambda: render)]
+        if any(member.service.dkim_key for member in pool.members):
+            stages.append(Stage('sign', lambda: sign))
+        # Enough delivery workers for the concurrency every account's limiter may grow to
+        stages.append(Stage('deliver', make_deliverer,
+                            workers=sum(member.limiter.max_concurrency for member in pool.members)))
+        # A single recorder keeps commits and summary updates serialized
+        stages.append(Stage('record', lambda: record, workers=1, always=True))
+        
+        pipeline = SendPipeline(resolve(), stages, control=SendControl.controller(campaign_id, deadline))
+        try:
+            summary.pipeline = pipeline.run()
+            summary.pipeline['deliver']['throttled_seconds'] = round(throttled['seconds'], 3)
+            summary.pipeline['deliver']['timeouts'] = timed_out['count']
+            summary.pipeline['deliver']['deadline_exceeded'] = deadline is not None and time.monotonic() >= deadline
+            summary.pipeline['deliver']['accounts'] = pool.snapshot()
+            if pipeline.stopped is not None:
+                summary.stopped = pipeline.stopped.value
+        finally:
+            attachment_cache.evict_campaign(campaign_id)
+            for member in pool.members:
+                save_limiter_state(member.account_id)
+            # Recipients claimed but never sent (stopped or failed send) are free for a later send
+            SendLedger.release(campaign_id, claim_token)
+        summary.suppressed += skipped['suppressed']
+        
+        return summary
     
     @staticmethod
-    def _update_campaign_results(campaign: Campaign, results: List[Dict]):
+    def _update_campaign_results(campaign: Campaign, summary: SendSummary):
         """Update campaign statistics based on sending results."""
         try:
-            successful_sends = sum(1 for r in results if r['success'])
-            failed_sends = len(results) - successful_sends
-            
-            campaign.emails_sent = len(results)
-            campaign.emails_delivered = successful_sends  # Assume delivered if sent successfully
-            campaign.emails_failed = failed_sends
+            campaign.emails_sent = summary.total
+            campaign.emails_delivered = summary.succeeded  # Assume delivered if sent successfully
+            campaign.emails_failed = summary.failed
+            campaign.bytes_sent = summary.bytes_sent
             
             db.session.commit()
             
+            if summary.total:
+                logger.info(f"Campaign {campaign.id}: {summary.bytes_sent} bytes on the wire "
+                            f"({summary.bytes_sent // summary.total} per recipient)")
+            
         except Exception as e:
             logger.error(f"Error updating campaign results: {e}")
     
@@ -3,20 +3,40 @@ Enhanced Email Service with EmailLog tracking and bounce handling.
 """
 
 from datetime import datetime
-from typing import List, Dict, Optional, Tuple
+from typing import Iterable, Dict, Optional, Tuple
+import itertools
 import logging
+import threading
+import time
 import uuid
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 from app import db
-from app.models.campaign import Campaign
-from app.models.email_log import EmailLog, EmailStatus, BounceType
+from app.models.campaign import Campaign, CampaignRecipient, CampaignStatus
+from app.models.contact import Contact
+from app.models.email_log import EmailLog, EmailStatus
 from app.models.smtp_config import SMTPConfig
 from app.routes.tracking import rewrite_links_for_tracking, add_tracking_pixel
+from app.services.attachment_service import attachment_cache
+from app.services.bounce_classifier import classify_bounce
+from app.services.content_compiler import ContentCompiler
+from app.services.domain_throttle import get_domain_throttle
+from app.services.message_spool import CHECKPOINT_COUNTERS, MessageSpool, SpoolBusyError
+from app.services.message_template import MessageTemplate, compile_placeholders, fill_placeholders
+from app.services.recipient_source import RecipientSource
+from app.services.retry_queue import RetryQueue
+from app.services.send_control import SendControl
+from app.services.send_ledger import SendLedger
+from app.services.send_pipeline import SendBatch, SendPipeline, Stage, envelope_outcomes
+from app.services.send_records import Recipient, SendSummary
+from app.services.smtp_client import Envelope, failed_result
+from app.services.suppression_list import SuppressionEntry, SuppressionList
+from app.services.transports import SMTPTransport, transport_timeouts
+from app.utils.helpers import chunked
 
 logger = logging.getLogger(__name__)
 
+# Recipients per pipeline batch; their EmailLog rows are inserted, then updated, with one commit each
+TRACKED_BATCH_SIZE = 100
+
 class EmailTrackingService:
     """Service for sending emails with engagement tracking."""
     
@@ -39,60 +59,51 @@ class EmailTrackingService:
                 return False, "Campaign not found", {}
             
             # Get SMTP config - try user-specific first, fall back to global settings
-            smtp_config = SMTPConfig.query.filter_by(
-                user_id=user_id, 
-                is_active=True, 
-                is_default=True
-            ).first()
-            
-            # If no user-specific config, try global settings
+            smtp_config = EmailTrackingService._smtp_config(user_id)
             if not smtp_config:
-                from app.models.smtp_settings import SMTPSettings
-                smtp_settings = SMTPSettings.query.filter_by(is_configured=True).first()
-                
-                if not smtp_settings:
-                    return False, "No SMTP configuration found. Please configure SMTP settings first.", {}
-                    
-                # Convert SMTPSettings to SMTPConfig-like object for compatibility
-                class FakeSMTPConfig:
-                    def __init__(self):
-                        self.id = smtp_settings.id
-                        self.user_id = smtp_settings.user_id or user_id
-                        self.host = smtp_settings.host
-                        self.port = smtp_settings.port
-                        self.username = smtp_settings.username
-                        self.password = smtp_settings.password
-                        self.encryption = smtp_settings.encryption
-                        self.sender_name = smtp_settings.sender_name or smtp_settings.sender_email
-                        self.sender_email = smtp_settings.sender_email or smtp_settings.username
-                        self.from_name = smtp_settings.sender_name or smtp_settings.sender_email
-                        self.from_email = smtp_settings.sender_email or smtp_settings.username
-                        self.use_tls = smtp_settings.encryption == 'tls'
-                    
-                    def get_decrypted_password(self):
-                        return smtp_settings.password
-                
-                smtp_config = FakeSMTPConfig()
+                return False, "No SMTP configuration found. Please configure SMTP settings first.", {}
             
-            # Get recipients (you can integrate with existing Contact model)
+            # Get recipients (streamed lazily during the send)
             recipients = EmailTrackingService._get_campaign_recipients(campaign, user_id)
-            if not recipients:
+            total_recipients = recipients.count()
+            if not total_recipients:
                 return False, "No valid recipients found", {}
             
-            # Update campaign status to sending
-            from app.models.campaign import CampaignStatus
-            campaign.status = CampaignStatus.SENDING
-            db.session.commit()
+            # Lock the campaign's spool first, so a send already running keeps its status and control requests
+            try:
+                spool = MessageSpool(campaign_id)
+            except SpoolBusyError as e:
+                return False, str(e), {}
             
-            # Send emails with tracking
-            results = EmailTrackingService._send_tracked_emails(
-                campaign, recipients, smtp_config
-            )
+            try:
+                # Update campaign status to sending
+                SendControl.clear(campaign_id)
+                campaign.status = CampaignStatus.SENDING
+                db.session.commit()
+                
+                # Send emails with tracking
+                summary = EmailTrackingService._send_tracked_emails(
+                    campaign, recipients, smtp_config, spool
+                )
+            finally:
+                spool.close()
             
-            # Update campaign counters and final status
-            successful_sends = sum(1 for r in results if r['success'])
+            # Update campaign counters and final status; the ledger also counts
+            # recipients an earlier, interrupted send of the campaign reached
+            successful_sends, _ = SendLedger.totals(campaign_id)
             campaign.emails_sent = successful_sends
-            campaign.total_recipients = len(recipients)
+            campaign.total_recipients = total_recipients
+            campaign.bytes_sent = summary.bytes_sent
+            
+            if summary.stopped:
+                # Paused or cancelled mid-send: keep the requested status
+                campaign.status = CampaignStatus(summary.stopped)
+                db.session.commit()
+                SendControl.clear(campaign_id)
+                results = summary.to_dict()
+                results['total_recipients'] = total_recipients
+                results['successful_sends'] = successful_sends
+                return True, f"Campaign {summary.stopped}: {successful_sends}/{total_recipients} emails sent", results
             
             # Set final status based on results
             if successful_sends == 0:
@@ -106,242 +117,499 @@ class EmailTrackingService:
             
             db.session.commit()
             
-            return True, f"Campaign sent: {successful_sends}/{len(recipients)} emails", {
-                'total_recipients': len(recipients),
-                'successful_sends': successful_sends,
-                'failed_sends': len(recipients) - successful_sends
-            }
+            results = summary.to_dict()
+            results['total_recipients'] = total_recipients
+            results['successful_sends'] = successful_sends
+            results['failed_sends'] = total_recipients - successful_sends
+            return True, f"Campaign sent: {successful_sends}/{total_recipients} emails", results
             
         except Exception as e:
             logger.error(f"Error sending tracked campaign {campaign_id}: {e}")
             return False, f"Failed to send campaign: {str(e)}", {}
     
     @staticmethod
-    def _get_campaign_recipients(campaign: Campaign, user_id: int) -> List[Dict]:
-        """Get recipients for campaign."""
-        from app.models.contact import Contact, ContactStatus
-        from app.models.campaign import CampaignRecipient
+    def _smtp_config(user_id: int):
+        """
+        SMTP configuration for a user's tracked sends: the user's default
+        SMTPConfig, else the global SMTPSettings in an SMTPConfig-like wrapper.
         
-        # First, try to get campaign-specific recipients
-        campaign_recipients = db.session.query(CampaignRecipient, Contact)\
-            .join(Contact, CampaignRecipient.contact_id == Contact.id)\
-            .filter(
-                CampaignRecipient.campaign_id == campaign.id,
-                Contact.status == ContactStatus.ACTIVE,
-                Contact.subscribed == True
-            ).all()
+        Returns:
+            The configuration, or None if neither is set up
+        """
+        smtp_config = SMTPConfig.query.filter_by(
+            user_id=user_id, 
+            is_active=True, 
+            is_default=True
+        ).first()
+        if smtp_config:
+            return smtp_config
         
-        recipients = []
+        # If no user-specific config, try global settings
+        from app.models.smtp_settings import SMTPSettings
+        smtp_settings = SMTPSettings.query.filter_by(is_configured=True).first()
+        if not smtp_settings:
+            return None
         
-        if campaign_recipients:
-            # Use campaign-specific recipients
-            for campaign_recipient, contact in campaign_recipients:
-                if contact.is_sendable():  # Additional check for sendable status
-                    recipients.append({
-                        'email': contact.email,
-                        'name': f"{contact.first_name or ''} {contact.last_name or ''}".strip() or contact.email,
-                        'contact_id': contact.id
-                    })
-        else:
-            # Fallback to all active, subscribed contacts for the user (legacy behavior)
-            contacts = Contact.query.filter_by(
-                user_id=user_id,
-                status=ContactStatus.ACTIVE,
-                subscribed=True
-            ).all()
+        # Convert SMTPSettings to SMTPConfig-like object for compatibility
+        class FakeSMTPConfig:
+            def __init__(self):
+                self.id = smtp_settings.id
+                self.user_id = smtp_settings.user_id or user_id
+                self.host = smtp_settings.host
+                self.port = smtp_settings.port
+                self.username = smtp_settings.username
+                self.password = smtp_settings.password
+                self.encryption = smtp_settings.encryption
+                self.sender_name = smtp_settings.sender_name or smtp_settings.sender_email
+                self.sender_email = smtp_settings.sender_email or smtp_settings.username
+                self.from_name = smtp_settings.sender_name or smtp_settings.sender_email
+                self.from_email = smtp_settings.sender_email or smtp_settings.username
+                self.use_tls = smtp_settings.encryption == 'tls'
             
-            for contact in contacts:
-                if contact.is_sendable():  # Additional check for sendable status
-                    recipients.append({
-                        'email': contact.email,
-                        'name': f"{contact.first_name or ''} {contact.last_name or ''}".strip() or contact.email,
-                        'contact_id': contact.id
-                    })
+            def get_decrypted_password(self):
+                return smtp_settings.password
         
+        return FakeSMTPConfig()
+    
+    @staticmethod
+    def _get_campaign_recipients(campaign: Campaign, user_id: int) -> RecipientSource:
+        """Get a lazy source over the recipients for campaign."""
+        recipients = RecipientSource(campaign)
+        recipients.materialize()
         return recipients
     
     @staticmethod
     def _send_tracked_emails(
         campaign: Campaign, 
-        recipients: List[Dict], 
-        smtp_config: SMTPConfig
-    ) -> List[Dict]:
-        """Send emails with tracking pixels and link rewriting."""
-        logger.info(f"Starting to send {len(recipients)} emails for campaign {campaign.id}")
-        results = []
+        recipients: Iterable[Recipient], 
+        smtp_config: SMTPConfig,
+        spool: MessageSpool
+    ) -> SendSummary:
+        """
+        Send emails with tracking pixels and link rewriting.
         
-        for recipient in recipients:
-            logger.debug(f"Processing recipient: {recipient['email']}")
-            try:
-                # Create EmailLog entry
-                tracking_id = str(uuid.uuid4()).replace('-', '')
-                
-                email_log = EmailLog(
-                    campaign_id=campaign.id,
-                    smtp_account_id=smtp_config.id,
-                    recipient_email=recipient['email'],
-                    recipient_name=recipient['name'],
-                    status=EmailStatus.SENT,
-                    tracking_id=tracking_id,
-                    subject=campaign.subject,
-                    sent_at=datetime.utcnow()
-                )
-                db.session.add(email_log)
-                db.session.flush()  # Get the ID
-                
-                # Prepare HTML content with tracking
-                html_content = campaign.html_content or ""
-                
-                # Add tracking pixel
-                html_content = add_tracking_pixel(
-                    html_content, email_log.id, tracking_id
-                )
-                
-                # Rewrite links for click tracking
-                html_content = rewrite_links_for_tracking(
-                    html_content, email_log.id, tracking_id
-                )
-                
-                # Send email
-                success, error_msg = EmailTrackingService._send_single_email(
-                    smtp_config=smtp_config,
-                    to_email=recipient['email'],
-                    to_name=recipient['name'],
-                    subject=campaign.subject,
-                    html_content=html_content,
-                    text_content=campaign.text_content
-                )
-                
-                if success:
-                    results.append({
-                        'email': recipient['email'],
-                        'success': True,
-                        'email_log_id': email_log.id
-                    })
-                else:
-                    # Check if it's a bounce
-                    bounce_type, bounce_reason = EmailTrackingService._classify_bounce(error_msg)
-                    if bounce_type:
-                        email_log.status = EmailStatus.BOUNCED
-                        email_log.bounce_type = bounce_type
-                        email_log.bounce_reason = bounce_reason
-                        email_log.bounced_at = datetime.utcnow()
-                    else:
-                        email_log.status = EmailStatus.FAILED
-                    
-                    results.append({
-                        'email': recipient['email'],
-                        'success': False,
-                        'error': error_msg,
-                        'email_log_id': email_log.id
-                    })
-                
-                db.session.commit()
-                
-            except Exception as e:
-                logger.error(f"Error sending to {recipient['email']}: {e}")
-                results.append({
-                    'email': recipient['email'],
-                    'success': False,
-                    'error': str(e)
-                })
+        Runs the staged send pipeline: recipients are resolved in batches of
+        TRACKED_BATCH_SIZE and get their EmailLog rows (whose IDs the tracking
+        links need), then each batch is rendered, delivered over one pooled
+        connection per delivery worker, and its failures and bounces are
+        recorded with one commit. Temporary failures are queued for retry
+        (RetryQueue). Suppressed addresses are dropped as batches are resolved,
+        and hard bounces and complaints are added to the suppression list.
+        Fresh batches hold recipients of one domain group, taking turns
+        between groups, and delivery waits for each group's concurrency and
+        rate limits (DomainThrottle).
         
-        return results
-    
-    @staticmethod
-    def _send_single_email(
-        smtp_config: SMTPConfig,
-        to_email: str,
-        to_name: str,
-        subject: str,
-        html_content: str,
-        text_content: str = None
-    ) -> Tuple[bool, str]:
-        """Send a single email via SMTP."""
+        Rendered messages are appended to the campaign's MessageSpool (opened,
+        and locked, by the caller) before delivery, and the spool checkpoint
+        advances as results are recorded. If an earlier send of the campaign
+        was interrupted, its spooled but unrecorded messages are delivered
+        first, as they were rendered, and only recipients that never reached
+        the spool are resolved again. Spooled recipients are claimed in the
+        send ledger like fresh ones; those another send reached meanwhile are
+        skipped.
+        
+        A pause or cancel request (SendControl) stops the pipeline between
+        batches. A paused send keeps its spool, so resuming it continues from
+        the checkpoint; a cancelled send discards it. Running out of the
+        campaign's send time limit pauses it too; the deadline also bounds
+        every SMTP operation of the send.
+        """
+        summary = SendSummary()
+        deadline = SendControl.deadline_for(campaign)
+        resume_end = spool.end
+        if spool.resumed:
+            logger.info(f"Resuming campaign {campaign.id} from spool offset {spool.offset} of {resume_end}")
+            for name in CHECKPOINT_COUNTERS:
+                setattr(summary, name, spool.state['counters'].get(name, 0))
+        else:
+            logger.info(f"Starting to send emails for campaign {campaign.id}")
+        html_content, text_content = ContentCompiler.content_for_sending(campaign)
+        
+        # Persist lazily compiled content: pipeline threads use their own sessions
+        db.session.commit()
+        
+        # Connect up front so the template can use 8bit bodies when allowed
+        connect_error = None
+        allow_8bit = False
         try:
-            logger.debug(f"Preparing to send email to {to_email}")
-            logger.debug(f"SMTP Config - Host: {smtp_config.host}, Port: {smtp_config.port}")
-            logger.debug(f"From: {smtp_config.from_name} <{smtp_config.from_email}>")
+            transport = EmailTrackingService._transport(smtp_config)
+            connected, connect_message = transport.open()
+            if connected:
+                allow_8bit = transport.supports_8bitmime
+                transport.close()
+            else:
+                connect_error = connect_message
+        except Exception as e:
+            logger.error(f"SMTP connection failed: {e}")
+            connect_error = str(e)
+        
+        # Messages already in the spool were rendered for the original connection
+        if spool.state['mail_options'] is not None:
+            allow_8bit = bool(spool.state['mail_options'])
+        
+        # Headers, boundaries and the text part are encoded once for the campaign
+        template = MessageTemplate(
+            from_email=smtp_config.from_email,
+            from_name=smtp_config.from_name,
+            subject=campaign.subject,
+            html_content=html_content,
+            text_content=text_content,
+            encoded_attachments=attachment_cache.parts_for_campaign(campaign),
+            allow_8bit=allow_8bit
+        )
+        # Tracked HTML replaces the template's, so its placeholders are filled before tracking is added
+        html_segments = compile_placeholders(html_content)
+        campaign_id = campaign.id
+        subject = campaign.subject
+        from_email = smtp_config.from_email
+        smtp_config_id = smtp_config.id
+        mail_options = template.mail_options
+        # Spools written before the send ledger existed have no claim token yet
+        claim_token = spool.owner or SendLedger.new_token()
+        max_attempts = RetryQueue.max_attempts(campaign)
+        user_id = campaign.user_id
+        suppressed = SuppressionList.load(user_id)
+        skipped = {'suppressed': 0}
+        throttle = get_domain_throttle()
+        throttled = {'seconds': 0.0}
+        timed_out = {'count': 0}
+        if spool.state['mail_options'] is None:
+            spool.checkpoint(spool.offset, mail_options=mail_options)
+        
+        # Fresh batches resolved / seen by the spool stage; the spool is sealed once they match
+        progress = {'resolved': None, 'spooled': 0}
+        progress_lock = threading.Lock()
+        
+        def seal_if_complete():
+            if progress['resolved'] is not None and progress['spooled'] == progress['resolved']:
+                spool.seal()
+        
+        def resolve():
+            seq = 0
+            # Spooled but unrecorded messages go out exactly as they were rendered
+            for records in spool.read(spool.offset, TRACKED_BATCH_SIZE, end=resume_end):
+                claimed = SendLedger.claim(campaign_id, [record.meta['recipient'][0] for record in records], claim_token)
+                # Runs of records not claimed (already recorded, or being sent by another send) are
+                # passed on empty, so the checkpoint still moves past them
+                for owned, run in itertools.groupby(records, key=lambda record: record.meta['recipient'][0] in claimed):
+                    run = list(run)
+                    kept = run if owned else []
+                    batch = SendBatch(seq, [Recipient(*record.meta['recipient']) for record in kept],
+                                      context=[tuple(record.meta['log']) for record in kept])
+                    batch.envelopes = [record.envelope for record in kept]
+                    batch.groups = [[recipient] for recipient in batch.recipients]
+                    batch.spooled = (run[0].offset, run[-1].end)
+                    seq += 1
+                    yield batch
+            if spool.sealed:
+                return
             
-            # Create message
-            msg = MIMEMultipart('alternative')
-            msg['Subject'] = subject
-            msg['From'] = f"{smtp_config.from_name} <{smtp_config.from_email}>"
-            msg['To'] = f"{to_name} <{to_email}>" if to_name else to_email
+            spooled_ids = {meta['recipient'][0] for meta in spool.metadata(end=resume_end)}
+            pending = (recipient for recipient in recipients if recipient.recipient_id not in spooled_ids)
+            fresh = 0
+            for window in throttle.interleave(pending, TRACKED_BATCH_SIZE):
+                # Reserve the batch in the send ledger; recipients already sent, or claimed
+                # by a concurrent send of the campaign, are skipped
+                claimed = SendLedger.claim(campaign_id, [recipient.recipient_id for recipient in window], claim_token)
+                window = [recipient for recipient in window if recipient.recipient_id in claimed]
+                window, count = SuppressionList.skip_suppressed(campaign_id, window, suppressed)
+                skipped['suppressed'] += count
+                if not window:
+                    continue
+                batch = SendBatch(seq, window)
+                seq += 1
+                fresh += 1
+                try:
+                    # Reuse logs an interrupted send created but never spooled
+                    existing = {}
+                    if spool.resumed:
+                        existing = {
+                            log.recipient_email: log
+                            for log in EmailLog.query.filter(
+                                EmailLog.campaign_id == campaign_id,
+                                EmailLog.recipient_email.in_([recipient.email for recipient in window])
+                            )
+                        }
+                    
+                    # Create EmailLog entries for the batch
+                    email_logs = [
+                        existing.get(recipient.email) or EmailLog(
+                            campaign_id=campaign_id,
+                            smtp_account_id=smtp_config_id,
+                            recipient_email=recipient.email,
+                            recipient_name=recipient.name,
+                            status=EmailStatus.SENT,
+                            tracking_id=str(uuid.uuid4()).replace('-', ''),
+                            message_id=template.new_message_id(),
+                            subject=subject,
+                            sent_at=datetime.utcnow()
+                        )
+                        for recipient in window
+                    ]
+                    db.session.add_all([log for log in email_logs if log.id is None])
+                    db.session.commit()
+                    batch.context = [(log.id, log.tracking_id, log.message_id) for log in email_logs]
+                except Exception as e:
+                    logger.error(f"Error creating email logs for {len(window)} recipients: {e}")
+                    db.session.rollback()
+                    batch.error = str(e)
+                yield batch
             
-            # Add text part if available
-            if text_content:
-                text_part = MIMEText(text_content, 'plain')
-                msg.attach(text_part)
+            with progress_lock:
+                progress['resolved'] = fresh
+                seal_if_complete()
+        
+        def render(batch: SendBatch):
+            if batch.spooled:
+                return
+            batch.groups = [[recipient] for recipient in batch.recipients]
+            batch.envelopes = []
+            for recipient, (log_id, tracking_id, message_id) in zip(batch.recipients, batch.context):
+                fields = recipient.template_fields()
+                html = EmailTrackingService._tracked_html(fill_placeholders(html_segments, fields), log_id, tracking_id)
+                batch.envelopes.append(Envelope(
+                    from_email,
+                    [recipient.email],
+                    template.render(
+                        recipient.email,
+                        to_name=recipient.name,
+                        fields=fields,
+                        html_content=html,
+                        message_id=message_id
+                    )
+                ))
+        
+        def spool_batch(batch: SendBatch):
+            if batch.spooled:
+                return
+            with progress_lock:
+                if batch.error is None:
+                    batch.spooled = spool.append([
+                        (envelope, {'recipient': list(recipient), 'log': list(log)})
+                        for envelope, recipient, log in zip(batch.envelopes, batch.recipients, batch.context)
+                    ])
+                progress['spooled'] += 1
+                seal_if_complete()
+        
+        def make_deliverer():
+            # One pooled connection per delivery worker
+            transport = EmailTrackingService._transport(smtp_config) if connect_error is None else None
+            if transport is not None:
+                transport.deadline = deadline
             
-            # Add HTML part
-            html_part = MIMEText(html_content, 'html')
-            msg.attach(html_part)
+            def deliver(batch: SendBatch):
+                for window in chunked(zip(batch.envelopes, batch.groups), SMTPTransport.batch_size):
+                    if pipeline.stopping:
+                        # Undelivered messages stay in the spool, past the checkpoint
+                        break
+                    envelopes = [envelope for envelope, _ in window]
+                    if transport is None:
+                        verdicts = [failed_result(connect_error, 'connect') for _ in envelopes]
+                    else:
+                        counts = throttle.counts(recipient for _, group in window for recipient in group)
+                        waited = throttle.acquire(counts, stop=lambda: pipeline.stopping)
+                        if waited is None:
+                            break
+                        bytes_before = transport.bytes_sent
+                        timed_out_before = transport.timed_out
+                        try:
+                            verdicts = transport.send_envelopes(envelopes, mail_options)
+                        finally:
+                            throttle.release(counts)
+                        batch.bytes_sent += transport.bytes_sent - bytes_before
+                        with progress_lock:
+                            throttled['seconds'] += waited
+                            timed_out['count'] += transport.timed_out - timed_out_before
+                    for (_, group), verdict in zip(window, verdicts):
+                        batch.outcomes.extend(envelope_outcomes(group, verdict))
             
-            # Connect to SMTP server
-            logger.debug(f"Connecting to SMTP server {smtp_config.host}:{smtp_config.port}, use_tls={smtp_config.use_tls}")
-            if smtp_config.use_tls:
-                server = smtplib.SMTP(smtp_config.host, smtp_config.port)
-                server.starttls()
-                logger.debug("Started TLS connection")
-            else:
-                server = smtplib.SMTP_SSL(smtp_config.host, smtp_config.port)
-                logger.debug("Started SSL connection")
+            if transport is not None:
+                deliver.close = transport.close
+            return deliver
+        
+        # Spool ranges recorded out of order, by start offset, with their counter deltas
+        # (ranges a paused send recorded are already in the resumed counters)
+        recorded = {start: (end, dict.fromkeys(CHECKPOINT_COUNTERS, 0)) for start, end in spool.state['done']}
+        committed = {name: getattr(summary, name) for name in CHECKPOINT_COUNTERS}
+        cursor = {'offset': spool.offset}
+        
+        def record(batch: SendBatch):
+            before = {name: getattr(summary, name) for name in CHECKPOINT_COUNTERS}
+            # Messages delivered before a stop cut the batch short
+            delivered = None if batch.error else len(batch.outcomes)
+            if batch.error:
+                batch.fail_all(batch.error)
+            log_ids = [log_id for log_id, _, _ in batch.context] if batch.context else [None] * len(batch.recipients)
+            log_by_recipient = {id(recipient): log_id for recipient, log_id in zip(batch.recipients, log_ids)}
             
-            # Authenticate
-            if smtp_config.username and hasattr(smtp_config, 'get_decrypted_password'):
-                password = smtp_config.get_decrypted_password()
-                logger.debug(f"Authenticating with username: {smtp_config.username}")
-                if password:
-                    server.login(smtp_config.username, password)
-                    logger.debug("Authentication successful")
+            updates = []
+            suppress = []
+            # Results settle the recipients' send ledger entries
+            now = datetime.utcnow()
+            ledger = []
+            for recipient, outcome in batch.outcomes:
+                log_id = log_by_recipient.get(id(recipient))
+                summary.record(outcome._replace(email_log_id=log_id))
+                if outcome.success:
+                    ledger.append({'id': recipient.recipient_id, 'email_sent': True, 'sent_at': now})
                 else:
-                    logger.error("No password available for authentication")
-                    return False, "No password available for SMTP authentication"
-            
-            # Send email
-            logger.debug("Sending email message...")
-            server.send_message(msg)
-            server.quit()
-            logger.info(f"Email sent successfully to {to_email}")
+                    ledger.append({
+                        'id': recipient.recipient_id,
+                        'email_failed': True,
+                        'error_message': outcome.error or 'Unknown error'
+                    })
+                if outcome.success or log_id is None:
+                    continue
+                
+                # Check if it's a bounce
+                verdict = classify_bounce(outcome.error, recipient.email, outcome.stage)
+                if verdict.bounce_type:
+                    update = {
+                        'id': log_id,
+                        'status': EmailStatus.BOUNCED,
+                        'bounce_type': verdict.bounce_type,
+                        'bounce_reason': outcome.error,
+                        'bounced_at': now
+                    }
+                else:
+                    update = {'id': log_id, 'status': EmailStatus.FAILED}
+                update['bounce_diagnostic'] = verdict.diagnostic
+                reason = SuppressionList.reason_for(verdict, outcome.stage, outcome.shared)
+                if reason and not batch.error:
+                    suppress.append(SuppressionEntry(user_id, recipient.email, reason, verdict.diagnostic))
+                # Temporary failures go to the retry queue
+                if max_attempts > 1 and verdict.retryable:
+                    update['next_retry_at'] = RetryQueue.next_attempt_at(1, now)
+                updates.append(update)
+            summary.bytes_sent += batch.bytes_sent
             
-            return True, "Email sent successfully"
+            try:
+                if updates:
+                    db.session.bulk_update_mappings(EmailLog, updates)
+                if ledger:
+                    db.session.bulk_update_mappings(CampaignRecipient, ledger)
+                if updates or ledger:
+                    db.session.commit()
+                if suppress:
+                    SuppressionList.add(suppress, campaign_id)
+            except Exception as e:
+                logger.error(f"Error recording results for {len(batch.recipients)} recipients: {e}")
+                db.session.rollback()
             
-        except smtplib.SMTPRecipientsRefused as e:
-            return False, f"Recipient refused: {str(e)}"
-        except smtplib.SMTPDataError as e:
-            return False, f"SMTP data error: {str(e)}"
-        except smtplib.SMTPAuthenticationError as e:
-            return False, f"SMTP authentication error: {str(e)}"
-        except Exception as e:
-            logger.error(f"Email sending error for {to_email}: {str(e)}")
-            return False, f"Email sending error: {str(e)}"
-    
-    @staticmethod
-    def _classify_bounce(error_message: str) -> Tuple[Optional[BounceType], str]:
-        """Classify bounce type based on error message."""
-        error_lower = error_message.lower()
+            # Advance the checkpoint over the contiguous prefix of recorded batches
+            delta = {name: getattr(summary, name) - before[name] for name in CHECKPOINT_COUNTERS}
+            if batch.spooled is None:
+                # Never reached the spool, so it will not be resent: count it now
+                settled = [delta]
+            else:
+                end = batch.spooled[1]
+                if delivered is not None and delivered < len(batch.envelopes):
+                    end = spool.offset_after(batch.spooled[0], delivered)
+                recorded[batch.spooled[0]] = (end, delta)
+                settled = []
+                while cursor['offset'] in recorded:
+                    cursor['offset'], pending_delta = recorded.pop(cursor['offset'])
+                    settled.append(pending_delta)
+            for pending_delta in settled:
+                for name in CHECKPOINT_COUNTERS:
+                    committed[name] += pending_delta[name]
+            spool.checkpoint(cursor['offset'], committed)
         
-        # Hard bounces (permanent failures)
-        hard_bounce_indicators = [
-            'user unknown', 'no such user', 'invalid recipient',
-            'recipient address rejected', 'user not found',
-            'does not exist', 'invalid mailbox', 'unknown user'
+        stages = [
+            Stage('render', lambda: render),
+            # One writer appends to the spool, with one fsync per batch
+            Stage('spool', lambda: spool_batch, workers=1, always=True),
+            Stage('deliver', make_deliverer),
+            # A single recorder keeps commits and summary updates serialized
+            Stage('record', lambda: record, workers=1, always=True)
         ]
         
-        # Soft bounces (temporary failures)
-        soft_bounce_indicators = [
-            'mailbox full', 'quota exceeded', 'temporarily unavailable',
-            'try again later', 'temporary failure', 'deferred'
-        ]
+        pipeline = SendPipeline(resolve(), stages, control=SendControl.controller(campaign_id, deadline))
+        try:
+            summary.pipeline = pipeline.run()
+            summary.pipeline['deliver']['throttled_seconds'] = round(throttled['seconds'], 3)
+            summary.pipeline['deliver']['timeouts'] = timed_out['count']
+            summary.pipeline['deliver']['deadline_exceeded'] = deadline is not None and time.monotonic() >= deadline
+            if pipeline.stopped is not None:
+                summary.stopped = pipeline.stopped.value
+                # Batches recorded past the cursor must not be sent again on resume
+                spool.checkpoint(
+                    cursor['offset'],
+                    {name: getattr(summary, name) for name in CHECKPOINT_COUNTERS},
+                    done=sorted((start, end) for start, (end, _) in recorded.items() if start >= cursor['offset'])
+                )
+                logger.info(f"Campaign {campaign_id} {summary.stopped} at spool offset {cursor['offset']}")
+            if pipeline.stopped == CampaignStatus.CANCELLED:
+                EmailTrackingService.cancel_undelivered_logs(campaign_id)
+            if pipeline.stopped is None or pipeline.stopped == CampaignStatus.CANCELLED:
+                # Everything was delivered and recorded, or never will be: nothing left to resume
+                spool.discard()
+        finally:
+            attachment_cache.evict_campaign(campaign_id)
+            # Recipients claimed but never sent (stopped or failed send) are free for a later send
+            SendLedger.release(campaign_id, claim_token)
+        summary.suppressed += skipped['suppressed']
         
-        for indicator in hard_bounce_indicators:
-            if indicator in error_lower:
-                return BounceType.HARD, error_message
+        return summary
+    
+    @staticmethod
+    def cancel_undelivered_logs(campaign_id: int) -> int:
+        """
+        Mark the logs of a cancelled campaign's undelivered messages as failed.
+
+        Logs are created as sent when their message is rendered; those whose
+        recipient was never delivered to would otherwise count as sent.
+
+        Returns:
+            Number of logs updated
+        """
+        undelivered = db.session.query(Contact.email).join(
+            CampaignRecipient, CampaignRecipient.contact_id == Contact.id
+        ).filter(
+            CampaignRecipient.campaign_id == campaign_id,
+            CampaignRecipient.email_sent.isnot(True)
+        )
+        count = EmailLog.query.filter(
+            EmailLog.campaign_id == campaign_id,
+            EmailLog.status == EmailStatus.SENT,
+            EmailLog.recipient_email.in_(undelivered)
+        ).update({
+            EmailLog.status: EmailStatus.FAILED,
+            EmailLog.bounce_reason: 'Campaign cancelled before delivery',
+            EmailLog.next_retry_at: None
+        }, synchronize_session=False)
+        db.session.commit()
+        if count:
+            logger.info(f"Campaign {campaign_id}: {count} undelivered email logs marked as failed after cancel")
+        return count
+    
+    @staticmethod
+    def _tracked_html(html_content: Optional[str], email_log_id: int, tracking_id: str) -> Optional[str]:
+        """Campaign HTML with the tracking pixel and rewritten links for one log entry."""
+        if not html_content:
+            return None
+        
+        # Add tracking pixel
+        html_content = add_tracking_pixel(html_content, email_log_id, tracking_id)
         
-        for indicator in soft_bounce_indicators:
-            if indicator in error_lower:
-                return BounceType.SOFT, error_message
+        # Rewrite links for click tracking
+        return rewrite_links_for_tracking(html_content, email_log_id, tracking_id)
+    
+    @staticmethod
+    def _transport(smtp_config: SMTPConfig) -> SMTPTransport:
+        """
+        Build the pooled SMTP transport for a config.
+        
+        Raises:
+            ValueError: If the config requires a password that is not available
+        """
+        password = None
+        if smtp_config.username and hasattr(smtp_config, 'get_decrypted_password'):
+            password = smtp_config.get_decrypted_password()
+            if not password:
+                raise ValueError("No password available for SMTP authentication")
         
-        # Default to soft bounce for unknown errors
-        return BounceType.SOFT, error_message
\ No newline at end of file
+        security = smtp_config.encryption or ('tls' if smtp_config.use_tls else 'ssl')
+        logger.debug(f"Using SMTP server {smtp_config.host}:{smtp_config.port}, encryption={security}")
+        return SMTPTransport(smtp_config.host, smtp_config.port, security, smtp_config.username, password,
+                             timeouts=transport_timeouts(smtp_config))
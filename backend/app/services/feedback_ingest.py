@@ -0,0 +1,414 @@
+"""
+Feedback Ingestion
+
+Applies asynchronous delivery feedback - bounce reports (DSN, RFC 3464) and
+spam complaints (ARF, RFC 5965) - from a local copy of the bounce mailbox, in
+mbox or maildir format.
+
+Messages are streamed one at a time: an mbox file is split on its ``From ``
+lines while it is read, a maildir is walked file by file, so memory use does
+not grow with the mailbox. Every report yields one event per recipient,
+matched to its EmailLog by the original message's Message-ID or, failing
+that, by the tracking_id in its tracking links. Events are applied in
+batches, with one lookup query and one bulk update per batch.
+
+A failed DSN marks the log bounced with the classifier's verdict on its
+Diagnostic-Code / Status; a complaint sets the COMPLAINT bounce type. Hard
+bounces and complaints go to the suppression list as well.
+"""
+
+import base64
+import binascii
+import logging
+import os
+import quopri
+import re
+from datetime import datetime
+from typing import Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+from sqlalchemy import or_
+from app import db
+from app.models.campaign import Campaign, CampaignRecipient
+from app.models.contact import Contact
+from app.models.email_log import BounceType, EmailLog, EmailStatus
+from app.models.suppression import SuppressionReason
+from app.services.bounce_classifier import get_classifier
+from app.services.suppression_list import SuppressionEntry, SuppressionList
+
+logger = logging.getLogger(__name__)
+
+# Events looked up and applied per batch (one query and one commit each)
+FEEDBACK_BATCH_SIZE = 1000
+
+# tracking_id of the tracking pixel / links in a returned original, also when quoted-printable encoded
+TRACKING_ID = re.compile(rb'tracking_id(?:=3D|=)([0-9a-f]{32})', re.IGNORECASE)
+
+# Header syntax: end of a header block, blank lines between DSN field blocks,
+# folded continuation lines, and Content-Type parameters
+HEADER_END = re.compile(rb'\r?\n\r?\n')
+BLANK_LINES = re.compile(rb'\r?\n(?:[ \t]*\r?\n)+')
+FOLDING = re.compile(rb'\r?\n[ \t]+')
+CONTENT_TYPE_PARAM = re.compile(r'([\w.-]+)\s*=\s*(?:"([^"]*)"|([^\s;]+))')
+
+# Multiparts nested deeper than this are not searched for a report
+MAX_MULTIPART_DEPTH = 3
+
+# Address in a DSN recipient field, e.g. "rfc822; user@example.com"
+ADDRESS_FIELD = re.compile(r'^\s*(?:[\w-]+\s*;)?\s*<?([^\s<>;]+@[^\s<>;]+?)>?\s*$')
+
+
+class FeedbackEvent(NamedTuple):
+    """One recipient's bounce or complaint from a feedback report."""
+    kind: str  # 'bounce' or 'complaint'
+    recipient: Optional[str]
+    message_id: Optional[str]
+    tracking_id: Optional[str]
+    # Bounces: DSN Status and Diagnostic-Code; complaints: the feedback type
+    status: Optional[str] = None
+    diagnostic: Optional[str] = None
+
+
+class IngestStats:
+    """Counters of one ingestion run."""
+
+    __slots__ = ('messages', 'reports', 'ignored', 'events', 'matched', 'unmatched',
+                 'bounces', 'complaints', 'suppressed', 'errors')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+    def to_dict(self) -> Dict[str, int]:
+        """Convert counters to dictionary."""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def iter_messages(path: str) -> Iterator[bytes]:
+    """
+    Raw messages of an mbox file, a maildir, or a directory of message files.
+    """
+    if os.path.isdir(path):
+        if any(os.path.isdir(os.path.join(path, sub)) for sub in ('cur', 'new')):
+            for sub in ('new', 'cur'):
+                yield from _iter_files(os.path.join(path, sub))
+        else:
+            for file_path in _list_files(path):
+                yield from iter_messages(file_path)
+        return
+
+    with open(path, 'rb') as f:
+        first = f.readline()
+        if not first.startswith(b'From '):
+            # A single message (.eml)
+            yield first + f.read()
+            return
+        lines: List[bytes] = []
+        previous_blank = True
+        for line in f:
+            if line.startswith(b'From ') and previous_blank:
+                if lines:
+                    yield b''.join(lines)
+                lines = []
+                previous_blank = False
+                continue
+            if line.startswith(b'>') and line.lstrip(b'>').startswith(b'From '):
+                # mboxrd quoting
+                line = line[1:]
+            lines.append(line)
+            previous_blank = not line.strip()
+        if lines:
+            yield b''.join(lines)
+
+
+def _list_files(directory: str) -> List[str]:
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        entry.path for entry in os.scandir(directory)
+        if entry.is_file() and not entry.name.startswith('.')
+    )
+
+
+def _iter_files(directory: str) -> Iterator[bytes]:
+    for file_path in _list_files(directory):
+        with open(file_path, 'rb') as f:
+            yield f.read()
+
+
+def parse_feedback(raw: bytes) -> List[FeedbackEvent]:
+    """
+    Events of one feedback message.
+
+    Only the header blocks a report needs are read: MIME parts are split on
+    their boundaries, and the returned original message (which may carry the
+    whole campaign body) is never read past its headers.
+
+    Returns:
+        Per-recipient events of a DSN or ARF report (empty for anything else,
+        and for DSN recipients whose Action is not ``failed``)
+    """
+    headers, body = _split(raw)
+    if not _content_type(headers)[0].startswith('multipart/'):
+        return []
+
+    report_type = None
+    report = None
+    original: Optional[Dict[str, str]] = None
+    for part_headers, part_body in _parts(headers, body):
+        content_type, params = _content_type(part_headers)
+        if content_type == 'multipart/report':
+            report_type = params.get('report-type', '').lower()
+        elif content_type in ('message/delivery-status', 'message/feedback-report'):
+            report = _decode(part_headers, part_body)
+        elif content_type in ('message/rfc822', 'text/rfc822-headers') and original is None:
+            original = _split(_decode(part_headers, part_body))[0]
+    if report is None:
+        return []
+
+    match = TRACKING_ID.search(raw)
+    tracking_id = match.group(1).decode('ascii').lower() if match else None
+    original = original or {}
+    message_id = _clean(original.get('message-id'))
+    original_recipient = original.get('to')
+    blocks = [_fields(block) for block in BLANK_LINES.split(report.strip()) if block.strip()]
+    if not blocks:
+        return []
+
+    if report_type == 'feedback-report' or 'feedback-type' in blocks[0]:
+        fields = blocks[0]
+        recipient = _address(fields.get('original-rcpt-to')) or _address(original_recipient)
+        feedback_type = _clean(fields.get('feedback-type')) or 'abuse'
+        return [FeedbackEvent('complaint', recipient, message_id, tracking_id, feedback_type,
+                              _clean(fields.get('user-agent')))]
+
+    events = []
+    # The first block holds per-message fields, the rest one recipient each
+    for fields in blocks[1:]:
+        action = (_clean(fields.get('action')) or '').lower()
+        if action != 'failed':
+            continue
+        recipient = _address(fields.get('final-recipient')) or _address(fields.get('original-recipient'))
+        diagnostic = _clean(fields.get('diagnostic-code'))
+        if diagnostic and ';' in diagnostic.split(' ', 1)[0]:
+            # Drop the diagnostic type, e.g. "smtp; 550 ..."
+            diagnostic = diagnostic.split(';', 1)[1].strip()
+        events.append(FeedbackEvent('bounce', recipient or _address(original_recipient), message_id,
+                                    tracking_id, _clean(fields.get('status')), diagnostic))
+    return events
+
+
+def _fields(block: bytes) -> Dict[str, str]:
+    """Fields of a header block by lower-cased name (the first of repeated fields wins)."""
+    fields: Dict[str, str] = {}
+    for line in FOLDING.sub(b' ', block).split(b'\n'):
+        name, colon, value = line.partition(b':')
+        if colon:
+            fields.setdefault(name.strip().lower().decode('latin-1'), value.strip().decode('utf-8', 'replace'))
+    return fields
+
+
+def _content_type(fields: Dict[str, str]) -> Tuple[str, Dict[str, str]]:
+    """Lower-cased content type and parameters of a message or part."""
+    value, _, params = fields.get('content-type', 'text/plain').partition(';')
+    return value.strip().lower(), {
+        name.lower(): quoted or bare for name, quoted, bare in CONTENT_TYPE_PARAM.findall(params)
+    }
+
+
+def _split(data: bytes) -> Tuple[Dict[str, str], bytes]:
+    """Header fields and raw body of a message or MIME part."""
+    if data.startswith((b'\n', b'\r\n')):
+        return {}, data.split(b'\n', 1)[1]
+    match = HEADER_END.search(data)
+    if match is None:
+        return _fields(data), b''
+    return _fields(data[:match.start()]), data[match.end():]
+
+
+def _parts(headers: Dict[str, str], body: bytes, depth: int = 0) -> Iterator[Tuple[Dict[str, str], bytes]]:
+    """A message and its parts, descending into nested multiparts (not into attached messages)."""
+    yield headers, body
+    content_type, params = _content_type(headers)
+    boundary = params.get('boundary') if content_type.startswith('multipart/') else None
+    if not boundary or depth >= MAX_MULTIPART_DEPTH:
+        return
+    delimiter = b'\n--' + boundary.encode('utf-8', 'replace')
+    for chunk in (b'\n' + body).split(delimiter)[1:]:
+        if chunk.startswith(b'--'):
+            break
+        # Rest of the delimiter line (transport padding) ends at the first line break
+        chunk = chunk.split(b'\n', 1)[1] if b'\n' in chunk else b''
+        yield from _parts(*_split(chunk), depth + 1)
+
+
+def _decode(headers: Dict[str, str], body: bytes) -> bytes:
+    """Part body with its Content-Transfer-Encoding undone."""
+    encoding = headers.get('content-transfer-encoding', '').strip().lower()
+    try:
+        if encoding == 'base64':
+            return base64.b64decode(body)
+        if encoding == 'quoted-printable':
+            return quopri.decodestring(body)
+    except (ValueError, binascii.Error):
+        pass
+    return body
+
+
+def _clean(value) -> Optional[str]:
+    """Header value with folding whitespace collapsed."""
+    if value is None:
+        return None
+    return ' '.join(str(value).split()) or None
+
+
+def _address(value) -> Optional[str]:
+    value = _clean(value)
+    if not value:
+        return None
+    match = ADDRESS_FIELD.match(value.split(',')[0])
+    return match.group(1).lower() if match else None
+
+
+class FeedbackIngestor:
+    """Applies feedback events to EmailLogs in batches."""
+
+    def __init__(self, batch_size: int = FEEDBACK_BATCH_SIZE, dry_run: bool = False):
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.stats = IngestStats()
+        self.campaign_ids: Set[int] = set()
+        self._pending: List[FeedbackEvent] = []
+
+    def ingest(self, path: str) -> IngestStats:
+        """Read and apply every feedback message under ``path``."""
+        for raw in iter_messages(path):
+            self.stats.messages += 1
+            try:
+                events = parse_feedback(raw)
+            except Exception as e:
+                logger.error(f"Error parsing feedback message {self.stats.messages} of {path}: {e}")
+                self.stats.errors += 1
+                continue
+            if not events:
+                self.stats.ignored += 1
+                continue
+            self.stats.reports += 1
+            self._pending.extend(events)
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+        self.flush()
+        return self.stats
+
+    def flush(self):
+        """Apply the pending events."""
+        events, self._pending = self._pending, []
+        if not events:
+            return
+        self.stats.events += len(events)
+        try:
+            self._apply(events)
+        except Exception as e:
+            logger.error(f"Error applying {len(events)} feedback events: {e}")
+            db.session.rollback()
+            self.stats.errors += len(events)
+
+    def finish(self):
+        """Recount the bounces of the campaigns feedback was applied to."""
+        if self.dry_run or not self.campaign_ids:
+            return
+        for campaign_id in self.campaign_ids:
+            bounced = EmailLog.query.filter_by(campaign_id=campaign_id, status=EmailStatus.BOUNCED).count()
+            Campaign.query.filter_by(id=campaign_id).update({Campaign.emails_bounced: bounced},
+                                                            synchronize_session=False)
+        db.session.commit()
+
+    def _apply(self, events: List[FeedbackEvent]):
+        message_ids = {event.message_id for event in events if event.message_id}
+        tracking_ids = {event.tracking_id for event in events if event.tracking_id}
+        conditions = []
+        if message_ids:
+            conditions.append(EmailLog.message_id.in_(message_ids))
+        if tracking_ids:
+            conditions.append(EmailLog.tracking_id.in_(tracking_ids))
+        rows = []
+        if conditions:
+            rows = db.session.query(
+                EmailLog.id, EmailLog.message_id, EmailLog.tracking_id, EmailLog.recipient_email,
+                EmailLog.campaign_id, Campaign.user_id
+            ).join(Campaign, EmailLog.campaign_id == Campaign.id).filter(or_(*conditions)).all()
+        by_message_id = {row.message_id: row for row in rows if row.message_id}
+        by_tracking_id = {row.tracking_id: row for row in rows}
+
+        classifier = get_classifier()
+        now = datetime.utcnow()
+        updates: Dict[int, Dict] = {}
+        bounced: Dict[tuple, str] = {}
+        suppress = []
+        for event in events:
+            row = by_message_id.get(event.message_id) or by_tracking_id.get(event.tracking_id)
+            recipient = event.recipient or (row.recipient_email if row else None)
+            if row is not None and event.recipient and event.recipient != row.recipient_email.lower():
+                # A multi-recipient report: only the log's own recipient matches it
+                row = None
+            if row is None:
+                self.stats.unmatched += 1
+            else:
+                self.stats.matched += 1
+
+            if event.kind == 'complaint':
+                self.stats.complaints += 1
+                if row is None:
+                    continue
+                updates.setdefault(row.id, {'id': row.id}).update({
+                    'bounce_type': BounceType.COMPLAINT,
+                    'bounce_reason': f"Complaint ({event.status})",
+                    'bounce_diagnostic': f"arf {event.status}" + (f" ({event.diagnostic})" if event.diagnostic else ""),
+                    'bounced_at': now
+                })
+                suppress.append(SuppressionEntry(row.user_id, recipient, SuppressionReason.COMPLAINT,
+                                                 f"arf {event.status}"))
+                self.campaign_ids.add(row.campaign_id)
+                continue
+
+            self.stats.bounces += 1
+            reason = event.diagnostic or f"Status {event.status}"
+            text = reason if not event.status or event.status in reason else f"{reason} {event.status}"
+            verdict = classifier.classify(text, domain=recipient.rsplit('@', 1)[-1] if recipient else None)
+            if verdict.suppress:
+                # Hard bounces are suppressed for everyone, even without a matching log
+                suppress.append(SuppressionEntry(row.user_id if row else None, recipient,
+                                                 SuppressionReason.HARD_BOUNCE, f"dsn {verdict.diagnostic}"))
+            if row is None:
+                continue
+            updates.setdefault(row.id, {'id': row.id}).update({
+                'status': EmailStatus.BOUNCED,
+                'bounce_type': verdict.bounce_type or BounceType.SOFT,
+                'bounce_reason': reason,
+                'bounce_diagnostic': f"dsn {verdict.diagnostic}",
+                'bounced_at': now,
+                'next_retry_at': None
+            })
+            bounced[(row.campaign_id, row.recipient_email)] = reason[:500]
+            self.campaign_ids.add(row.campaign_id)
+
+        if self.dry_run:
+            db.session.rollback()
+            return
+
+        if updates:
+            db.session.bulk_update_mappings(EmailLog, list(updates.values()))
+        if bounced:
+            # The recipients' campaign ledger entries
+            recipient_rows = db.session.query(
+                CampaignRecipient.id, CampaignRecipient.campaign_id, Contact.email
+            ).join(Contact, CampaignRecipient.contact_id == Contact.id).filter(
+                CampaignRecipient.campaign_id.in_({campaign_id for campaign_id, _ in bounced}),
+                Contact.email.in_({email_address for _, email_address in bounced})
+            )
+            db.session.bulk_update_mappings(CampaignRecipient, [
+                {'id': recipient_id, 'email_bounced': True, 'bounce_reason': bounced[(campaign_id, email_address)]}
+                for recipient_id, campaign_id, email_address in recipient_rows
+                if (campaign_id, email_address) in bounced
+            ])
+        db.session.commit()
+        if suppress:
+            self.stats.suppressed += SuppressionList.add(suppress)
@@ -0,0 +1,359 @@
+"""
+Message Spool
+
+Crash-safe, append-only store of pre-rendered messages for a campaign that is
+being sent. Rendered messages are appended to segment files before they are
+delivered, and a checkpoint records how far delivery results have been
+committed. After a crash or restart the sender resumes from the checkpoint:
+spooled messages are read back (memory-mapped) and delivered as-is, without
+re-rendering them or re-querying contacts.
+
+Layout of ``<SPOOL_DIR>/campaign_<id>/``:
+
+- ``<base offset>.seg``: segments of records, rotated at SPOOL_SEGMENT_SIZE.
+  A record is a header (metadata length, data length, CRC-32), JSON metadata
+  and the message bytes. Shared attachment buffers are stored by file path,
+  not copied into every record.
+- ``checkpoint.json``: delivery cursor (a logical offset across segments),
+  committed counters, whether every recipient has been spooled (sealed),
+  ranges past the cursor that a paused send already delivered (done) and the
+  token the spool's sends claim recipients under in the send ledger (owner).
+- ``spool.lock``: locked (flock) by the send using the spool, so a second
+  send of the campaign cannot resume it while the first is still running.
+"""
+
+import bisect
+import fcntl
+import itertools
+import json
+import logging
+import os
+import shutil
+import struct
+import threading
+import uuid
+import zlib
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+from flask import current_app
+from app.services.attachment_service import MappedFile, map_file
+from app.services.message_template import message_parts, splice
+from app.services.smtp_client import Envelope
+
+logger = logging.getLogger(__name__)
+
+# Segment size after which appends move to a new segment file
+SPOOL_SEGMENT_SIZE = 64 * 1024 * 1024
+
+# Record header: metadata length, message data length, CRC-32 of both
+RECORD_HEADER = struct.Struct('>III')
+
+SEGMENT_SUFFIX = '.seg'
+CHECKPOINT_FILE = 'checkpoint.json'
+LOCK_FILE = 'spool.lock'
+
+# Counters carried over to a resumed send
+CHECKPOINT_COUNTERS = ('total', 'succeeded', 'failed', 'bytes_sent')
+
+
+class SpoolBusyError(RuntimeError):
+    """The spool is in use by another send of the campaign."""
+
+
+class SpoolRecord(NamedTuple):
+    """One spooled message and the logical offsets it occupies."""
+    offset: int
+    end: int
+    meta: Dict
+    envelope: Envelope
+
+
+class MessageSpool:
+    """
+    Append-only message spool of one campaign.
+
+    Appends come from a single writer; the checkpoint may be advanced from
+    another thread. Opening a spool locks it until it is closed, and
+    truncates a record torn by a crash.
+
+    Raises:
+        SpoolBusyError: If another send holds the spool
+    """
+
+    def __init__(self, campaign_id: int, root: Optional[str] = None):
+        self.campaign_id = campaign_id
+        self.path = MessageSpool.campaign_path(campaign_id, root)
+        os.makedirs(self.path, exist_ok=True)
+        self._lock_file = open(os.path.join(self.path, LOCK_FILE), 'a')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_file.close()
+            raise SpoolBusyError(f"Campaign {campaign_id} is already being sent")
+        self._lock = threading.Lock()
+        self._bases: List[int] = []
+        self._writer = None
+        self._end = 0
+        # True when an earlier, interrupted send left this spool behind
+        self.resumed = os.path.exists(os.path.join(self.path, CHECKPOINT_FILE))
+        self.state = self._load_state()
+        self._recover()
+        if not self.resumed:
+            self.state['owner'] = uuid.uuid4().hex
+            self._save_state()
+
+    @staticmethod
+    def campaign_path(campaign_id: int, root: Optional[str] = None) -> str:
+        """Directory holding a campaign's spool."""
+        root = root or current_app.config.get('SPOOL_DIR', 'spool')
+        return os.path.join(root, f'campaign_{campaign_id}')
+
+    @staticmethod
+    def discard_campaign(campaign_id: int, root: Optional[str] = None):
+        """Delete a campaign's spool, if any."""
+        shutil.rmtree(MessageSpool.campaign_path(campaign_id, root), ignore_errors=True)
+
+    @property
+    def end(self) -> int:
+        """Logical offset just past the last spooled record."""
+        return self._end
+
+    @property
+    def offset(self) -> int:
+        """Delivery cursor: everything before it has been delivered and recorded."""
+        return self.state['offset']
+
+    @property
+    def owner(self) -> str:
+        """Send ledger claim token, kept by every send resuming this spool."""
+        return self.state['owner']
+
+    @property
+    def sealed(self) -> bool:
+        """True once every recipient of the campaign has been spooled."""
+        return self.state['sealed']
+
+    def append(self, entries: Sequence[Tuple[Envelope, Dict]]) -> Tuple[int, int]:
+        """
+        Durably append messages (one fsync per call).
+
+        Args:
+            entries: (envelope, metadata) pairs; metadata must be JSON-serializable
+
+        Returns:
+            Tuple of (start, end) logical offsets of the appended records
+        """
+        with self._lock:
+            if self._writer is None or self._writer.tell() >= SPOOL_SEGMENT_SIZE:
+                self._rotate()
+            start = self._end
+            writer = self._writer
+            for envelope, meta in entries:
+                layout, data = [], []
+                for part in message_parts(envelope.message):
+                    if isinstance(part, MappedFile):
+                        layout.append(part.path)
+                    else:
+                        layout.append(len(part))
+                        data.append(part)
+                header_meta = json.dumps({
+                    'from': envelope.sender,
+                    'to': list(envelope.recipients),
+                    'parts': layout,
+                    'meta': meta
+                }, separators=(',', ':')).encode('utf-8')
+
+                crc = zlib.crc32(header_meta)
+                size = 0
+                for part in data:
+                    crc = zlib.crc32(part, crc)
+                    size += len(part)
+                writer.write(RECORD_HEADER.pack(len(header_meta), size, crc))
+                writer.write(header_meta)
+                for part in data:
+                    writer.write(part)
+                self._end += RECORD_HEADER.size + len(header_meta) + size
+            writer.flush()
+            os.fsync(writer.fileno())
+            return start, self._end
+
+    def read(self, start: int, batch_size: int, end: Optional[int] = None) -> Iterator[List[SpoolRecord]]:
+        """
+        Read spooled records back in batches.
+
+        Message data is sliced out of memory-mapped segments; attachment
+        parts are mapped from their files again. Records in done ranges are
+        skipped, and a yielded batch never spans one.
+
+        Args:
+            start: Logical offset to start at (e.g. the checkpoint)
+            batch_size: Records per yielded list
+            end: Stop at this offset (default: the current end)
+        """
+        end = self._end if end is None else end
+        done = sorted(tuple(span) for span in self.state['done'] if span[1] > start)
+        attachments: Dict[str, MappedFile] = {}
+        batch = []
+        for offset, record_end, header, data in self._scan(start, end):
+            while done and done[0][1] <= offset:
+                done.pop(0)
+            if done and done[0][0] <= offset:
+                if batch:
+                    yield batch
+                    batch = []
+                continue
+            parts, position = [], 0
+            for item in header['parts']:
+                if isinstance(item, str):
+                    if item not in attachments:
+                        attachments[item] = map_file(item)
+                    parts.append(attachments[item])
+                else:
+                    parts.append(data[position:position + item])
+                    position += item
+            message = splice(parts)
+            envelope = Envelope(header['from'], header['to'], message)
+            batch.append(SpoolRecord(offset, record_end, header['meta'], envelope))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def metadata(self, end: Optional[int] = None) -> Iterator[Dict]:
+        """Metadata of every spooled record, without materializing messages."""
+        for _, _, header, _ in self._scan(0, self._end if end is None else end, with_data=False):
+            yield header['meta']
+
+    def offset_after(self, start: int, count: int) -> int:
+        """Logical offset just past ``count`` records starting at ``start``."""
+        offset = start
+        for _, record_end, _, _ in itertools.islice(self._scan(start, self._end, with_data=False), count):
+            offset = record_end
+        return offset
+
+    def checkpoint(self, offset: int, counters: Optional[Dict[str, int]] = None,
+                   mail_options: Optional[Sequence[str]] = None,
+                   done: Optional[Sequence[Tuple[int, int]]] = None):
+        """Durably move the delivery cursor, the committed counters and the done ranges."""
+        with self._lock:
+            self.state['offset'] = offset
+            if counters is not None:
+                self.state['counters'] = dict(counters)
+            if mail_options is not None:
+                self.state['mail_options'] = list(mail_options)
+            if done is not None:
+                self.state['done'] = [list(span) for span in done]
+            self._save_state()
+
+    def seal(self):
+        """Record that every recipient has been spooled."""
+        with self._lock:
+            self.state['sealed'] = True
+            self._save_state()
+
+    def close(self):
+        """Close the segment being written and unlock the spool."""
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            if not self._lock_file.closed:
+                # Closing the file drops the flock
+                self._lock_file.close()
+
+    def discard(self):
+        """Delete and close the spool (the send finished)."""
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            # Deleted while still locked, so no other send can open it half-removed
+            shutil.rmtree(self.path, ignore_errors=True)
+        self.close()
+
+    def _scan(self, start: int, end: int, with_data: bool = True) -> Iterator[Tuple[int, int, Dict, bytes]]:
+        """Walk records in [start, end) across segments."""
+        index = max(bisect.bisect_right(self._bases, start) - 1, 0)
+        offset = start
+        for base in self._bases[index:]:
+            if offset >= end:
+                return
+            path = self._segment_path(base)
+            size = os.path.getsize(path)
+            if not size or base + size <= offset:
+                continue
+            mapped = map_file(path) if with_data else None
+            f = open(path, 'rb')
+            try:
+                position = offset - base
+                limit = min(size, end - base)
+                while position < limit:
+                    f.seek(position)
+                    meta_len, data_len, _ = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+                    header = json.loads(f.read(meta_len))
+                    data_start = position + RECORD_HEADER.size + meta_len
+                    record_end = data_start + data_len
+                    data = mapped[data_start:record_end] if with_data else b''
+                    yield base + position, base + record_end, header, data
+                    position = record_end
+                offset = base + position
+            finally:
+                f.close()
+                if mapped is not None:
+                    mapped.close()
+
+    def _recover(self):
+        """Find segments and truncate a torn record at the end of the last one."""
+        for name in os.listdir(self.path):
+            if name.endswith(SEGMENT_SUFFIX):
+                self._bases.append(int(name[:-len(SEGMENT_SUFFIX)]))
+        self._bases.sort()
+        if not self._bases:
+            return
+
+        base = self._bases[-1]
+        path = self._segment_path(base)
+        valid = 0
+        with open(path, 'rb') as f:
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                meta_len, data_len, crc = RECORD_HEADER.unpack(header)
+                body = f.read(meta_len + data_len)
+                if len(body) < meta_len + data_len or zlib.crc32(body) != crc:
+                    break
+                valid = f.tell()
+        if valid < os.path.getsize(path):
+            logger.warning(f"Truncating torn record in spool segment {path} at {valid}")
+            with open(path, 'r+b') as f:
+                f.truncate(valid)
+                os.fsync(f.fileno())
+        self._end = base + valid
+
+    def _rotate(self):
+        if self._writer is not None:
+            self._writer.close()
+        if not self._bases or (self._end - self._bases[-1]) >= SPOOL_SEGMENT_SIZE:
+            self._bases.append(self._end)
+        self._writer = open(self._segment_path(self._bases[-1]), 'ab')
+
+    def _segment_path(self, base: int) -> str:
+        return os.path.join(self.path, f'{base:020d}{SEGMENT_SUFFIX}')
+
+    def _load_state(self) -> Dict:
+        path = os.path.join(self.path, CHECKPOINT_FILE)
+        state = {'offset': 0, 'sealed': False, 'mail_options': None, 'counters': {}, 'done': [], 'owner': None}
+        if os.path.exists(path):
+            with open(path) as f:
+                state.update(json.load(f))
+        return state
+
+    def _save_state(self):
+        path = os.path.join(self.path, CHECKPOINT_FILE)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
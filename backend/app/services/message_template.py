@@ -0,0 +1,376 @@
+"""
+Pre-serialized message templates.
+
+A MessageTemplate is built once per campaign. Headers, MIME boundaries and
+every part that does not vary per recipient are encoded to bytes up front;
+rendering a message only encodes the To header, Message-ID, Date and the
+personalized body parts and splices them into the prepared bytes. The result
+is ready to pass to ``smtplib.SMTP.sendmail`` as-is.
+
+Text parts use the cheapest Content-Transfer-Encoding that can carry them:
+7bit for plain ASCII, 8bit when the relay advertises 8BITMIME/SMTPUTF8,
+quoted-printable for mostly-ASCII text and base64 only when that is smaller.
+
+Attachments can be supplied already MIME-encoded as shared buffers (see
+AttachmentCache); messages that contain them are returned as a
+SplicedMessage that references those buffers instead of copying them.
+"""
+
+import base64
+import quopri
+import re
+import uuid
+from email.header import Header
+from email.utils import encode_rfc2231, formataddr, formatdate
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+from app.services.send_records import TEMPLATE_FIELDS
+
+CRLF = b'\r\n'
+
+# Longest line allowed in a 7bit/8bit body, excluding the CRLF (RFC 5322)
+MAX_LINE_LENGTH = 998
+
+# Bytes quoted-printable can carry without an =XX escape
+QP_SAFE_BYTES = bytes(b for b in range(32, 127) if b != ord('=')) + b'\t\n'
+
+PLACEHOLDER_PATTERN = re.compile(r'\{(' + '|'.join(TEMPLATE_FIELDS) + r')\}')
+
+
+class SplicedMessage:
+    """
+    A rendered message kept as a sequence of buffers.
+
+    Per-message bytes are small ``bytes`` objects; shared parts (such as
+    memory-mapped attachments) are referenced as-is, so they are written to
+    the socket without being copied into every message. ``len()`` is the
+    total size in bytes.
+    """
+
+    __slots__ = ('parts', 'size')
+
+    def __init__(self, parts: Sequence):
+        self.parts = tuple(parts)
+        self.size = sum(len(part) for part in self.parts)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self) -> Iterator:
+        return iter(self.parts)
+
+    def __bytes__(self) -> bytes:
+        """Join the parts (copies; only for consumers that need one buffer)."""
+        return b''.join(self.parts)
+
+
+RenderedMessage = Union[bytes, SplicedMessage]
+
+
+def message_parts(message: RenderedMessage) -> Tuple:
+    """The buffers making up a rendered message."""
+    return message.parts if isinstance(message, SplicedMessage) else (message,)
+
+
+def splice(pieces: Sequence) -> RenderedMessage:
+    """Join adjacent ``bytes`` pieces; keep shared buffers as separate parts."""
+    parts = []
+    run = []
+    for piece in pieces:
+        if isinstance(piece, bytes):
+            run.append(piece)
+            continue
+        if run:
+            parts.append(b''.join(run))
+            run = []
+        parts.append(piece)
+    if run:
+        parts.append(b''.join(run))
+    return parts[0] if len(parts) == 1 and isinstance(parts[0], bytes) else SplicedMessage(parts)
+
+
+def attachment_headers(filename: str, mime_type: Optional[str] = None) -> bytes:
+    """MIME headers of a base64 attachment part."""
+    filename = ''.join(ch for ch in filename if ch.isprintable()).replace('"', '')
+    if filename.isascii():
+        disposition = f'attachment; filename="{filename}"'
+    else:
+        disposition = f"attachment; filename*={encode_rfc2231(filename, 'utf-8')}"
+    return (
+        f'Content-Type: {mime_type or "application/octet-stream"}\r\n'
+        'MIME-Version: 1.0\r\n'
+        'Content-Transfer-Encoding: base64\r\n'
+        f'Content-Disposition: {disposition}\r\n'
+        '\r\n'
+    ).encode('ascii')
+
+
+def compile_placeholders(template: Optional[str]) -> Tuple[str, ...]:
+    """
+    Split a template into alternating literal text and placeholder names.
+
+    Even indexes are literals, odd indexes are field names, so rendering is a
+    single join with no re-scanning of the template.
+    """
+    return tuple(PLACEHOLDER_PATTERN.split(template or ''))
+
+
+def fill_placeholders(segments: Tuple[str, ...], fields: Optional[Dict[str, str]]) -> str:
+    """Render compiled segments with recipient values (missing values become empty)."""
+    if len(segments) == 1:
+        return segments[0]
+    fields = fields or {}
+    return ''.join(
+        segment if i % 2 == 0 else str(fields.get(segment) or '')
+        for i, segment in enumerate(segments)
+    )
+
+
+def encode_header(value: str) -> bytes:
+    """Encode an unstructured header value (RFC 2047 when not plain ASCII)."""
+    charset = 'us-ascii' if value.isascii() else 'utf-8'
+    return Header(value, charset).encode(linesep='\r\n').encode('ascii')
+
+
+def encode_address(name: Optional[str], email: str) -> bytes:
+    """Encode a display-name/address pair for an address header."""
+    return formataddr((name or '', email), charset='utf-8').encode('ascii')
+
+
+def choose_transfer_encoding(data: bytes, allow_8bit: bool = False) -> str:
+    """
+    Pick the Content-Transfer-Encoding that puts the fewest bytes on the wire.
+
+    Args:
+        data: UTF-8 body with LF line endings
+        allow_8bit: Whether the server accepts 8BITMIME bodies
+
+    Returns:
+        '7bit', '8bit', 'quoted-printable' or 'base64'
+    """
+    if all(len(line) <= MAX_LINE_LENGTH for line in data.split(b'\n')):
+        if data.isascii():
+            return '7bit'
+        if allow_8bit:
+            return '8bit'
+
+    # Every escaped byte costs three; base64 costs four per three bytes
+    escaped = len(data.translate(None, QP_SAFE_BYTES))
+    if len(data) + 2 * escaped <= (len(data) + 2) // 3 * 4:
+        return 'quoted-printable'
+    return 'base64'
+
+
+def encode_text_body(text: str, allow_8bit: bool = False) -> Tuple[str, bytes]:
+    """
+    Encode a text body with the cheapest suitable transfer encoding.
+
+    Returns:
+        Tuple of (encoding name, encoded body with CRLF line endings)
+    """
+    data = text.replace('\r\n', '\n').replace('\r', '\n').encode('utf-8')
+    encoding = choose_transfer_encoding(data, allow_8bit)
+    if encoding == 'base64':
+        return encoding, base64.encodebytes(data).replace(b'\n', CRLF)
+    if encoding == 'quoted-printable':
+        return encoding, quopri.encodestring(data).replace(b'\n', CRLF)
+    return encoding, data.replace(b'\n', CRLF)
+
+
+class TemplatePart:
+    """One text/* part of the message with its pre-built MIME headers."""
+
+    def __init__(self, subtype: str, content: Optional[str], allow_8bit: bool = False):
+        self.subtype = subtype
+        self.allow_8bit = allow_8bit
+        self.segments = compile_placeholders(content)
+        # Static parts are encoded exactly once
+        self.static_body = None if self.is_personalized else self._encode(self.segments[0])
+
+    @property
+    def is_personalized(self) -> bool:
+        return len(self.segments) > 1
+
+    def render(self, fields: Optional[Dict[str, str]] = None, override: Optional[str] = None) -> bytes:
+        """Return the encoded part, re-encoding only when content varies."""
+        if override is not None:
+            return self._encode(override)
+        if self.static_body is not None:
+            return self.static_body
+        return self._encode(fill_placeholders(self.segments, fields))
+
+    def _encode(self, text: str) -> bytes:
+        """MIME headers and body, with the encoding chosen for this text."""
+        encoding, body = encode_text_body(text, self.allow_8bit)
+        headers = (
+            f'Content-Type: text/{self.subtype}; charset="utf-8"\r\n'
+            'MIME-Version: 1.0\r\n'
+            f'Content-Transfer-Encoding: {encoding}\r\n'
+            '\r\n'
+        ).encode('ascii')
+        return headers + body
+
+
+class MessageTemplate:
+    """Campaign-level message skeleton rendered per recipient by byte splicing."""
+
+    def __init__(
+        self,
+        from_email: str,
+        subject: str,
+        from_name: Optional[str] = None,
+        html_content: Optional[str] = None,
+        text_content: Optional[str] = None,
+        reply_to: Optional[str] = None,
+        attachments: Optional[List[dict]] = None,
+        allow_8bit: bool = False,
+        encoded_attachments: Optional[Sequence] = None
+    ):
+        """
+        Build the template.
+
+        Args:
+            from_email: Sender address (also used as the envelope sender)
+            subject: Subject line (may contain placeholders like {first_name})
+            from_name: Sender display name
+            html_content: HTML body (may contain placeholders)
+            text_content: Plain text body (may contain placeholders)
+            reply_to: Optional Reply-To address
+            attachments: List of attachment dicts with 'filename' and 'content' keys
+            allow_8bit: Whether the relay accepts 8bit bodies (8BITMIME/SMTPUTF8)
+            encoded_attachments: Complete MIME attachment parts as bytes-like
+                buffers (e.g. memory-mapped), spliced into messages uncopied
+        """
+        if not html_content and not text_content:
+            raise ValueError("Email content (HTML or text) is required")
+
+        self.from_email = from_email
+        self.allow_8bit = allow_8bit
+        self.domain = from_email.split('@')[-1]
+        self.subject_segments = compile_placeholders(subject)
+        self.static_subject = None if len(self.subject_segments) > 1 else encode_header(subject)
+
+        self.text_part = TemplatePart('plain', text_content, allow_8bit) if text_content else None
+        self.html_part = TemplatePart('html', html_content, allow_8bit) if html_content else None
+
+        self.attachment_parts = [self._encode_attachment(a) for a in attachments or []]
+        self.attachment_parts.extend(encoded_attachments or [])
+        self.alternative_boundary = self._new_boundary()
+        self.mixed_boundary = self._new_boundary() if self.attachment_parts else None
+
+        # Headers shared by every message
+        headers = [b'From: ' + encode_address(from_name, from_email)]
+        if reply_to:
+            headers.append(b'Reply-To: ' + encode_address(None, reply_to))
+        headers.append(b'MIME-Version: 1.0')
+        if self.mixed_boundary:
+            headers.append(f'Content-Type: multipart/mixed; boundary="{self.mixed_boundary}"'.encode('ascii'))
+        else:
+            headers.append(f'Content-Type: multipart/alternative; boundary="{self.alternative_boundary}"'.encode('ascii'))
+        self.common_headers = CRLF.join(headers) + CRLF
+
+    @property
+    def is_personalized(self) -> bool:
+        """True when any part of the message varies per recipient."""
+        return (
+            self.static_subject is None or
+            any(part.is_personalized for part in (self.text_part, self.html_part) if part)
+        )
+
+    @property
+    def mail_options(self) -> Tuple[str, ...]:
+        """MAIL FROM parameters needed for messages rendered from this template."""
+        return ('BODY=8BITMIME',) if self.allow_8bit else ()
+
+    def new_message_id(self) -> str:
+        """Generate a Message-ID in the sender's domain."""
+        return f"<{uuid.uuid4()}@{self.domain}>"
+
+    def render(
+        self,
+        to_email: str,
+        to_name: Optional[str] = None,
+        fields: Optional[Dict[str, str]] = None,
+        html_content: Optional[str] = None,
+        text_content: Optional[str] = None,
+        message_id: Optional[str] = None
+    ) -> RenderedMessage:
+        """
+        Produce the complete RFC 5322 message for one recipient.
+
+        Args:
+            to_email: Recipient address for the To header
+            to_name: Recipient display name
+            fields: Placeholder values (see Recipient.template_fields)
+            html_content: Fully rendered HTML replacing the template's (e.g. with tracking)
+            text_content: Fully rendered text replacing the template's
+            message_id: Message-ID to use (generated when omitted)
+
+        Returns:
+            Message bytes with CRLF line endings (a SplicedMessage when it
+            contains shared attachment buffers)
+        """
+        return self._render(encode_address(to_name, to_email), fields, html_content, text_content, message_id)
+
+    def render_shared(self, message_id: Optional[str] = None) -> RenderedMessage:
+        """
+        Render a non-personalized message once for a multi-recipient envelope.
+
+        Recipients are only listed in the SMTP envelope; the To header names no
+        one so addresses are not disclosed to each other.
+        """
+        return self._render(b'undisclosed-recipients:;', None, None, None, message_id)
+
+    def _render(self, to_header: bytes, fields, html_content, text_content, message_id) -> RenderedMessage:
+        """Splice per-message headers and body parts into the prepared bytes."""
+        subject = self.static_subject
+        if subject is None:
+            subject = encode_header(fill_placeholders(self.subject_segments, fields))
+
+        out = [
+            self.common_headers,
+            b'To: ', to_header, CRLF,
+            b'Subject: ', subject, CRLF,
+            b'Date: ', formatdate(usegmt=True).encode('ascii'), CRLF,
+            b'Message-ID: ', (message_id or self.new_message_id()).encode('ascii'), CRLF,
+            CRLF
+        ]
+        out.extend(self._render_body(fields, html_content, text_content))
+        return splice(out)
+
+    def _render_body(self, fields, html_content, text_content) -> List[bytes]:
+        """Render the MIME body (multipart/alternative, optionally inside multipart/mixed)."""
+        alt_boundary = self.alternative_boundary.encode('ascii')
+        body = []
+        for part, override in ((self.text_part, text_content), (self.html_part, html_content)):
+            if part:
+                body.extend((b'--', alt_boundary, CRLF, part.render(fields, override), CRLF))
+        body.extend((b'--', alt_boundary, b'--', CRLF))
+
+        if not self.mixed_boundary:
+            return body
+
+        mixed_boundary = self.mixed_boundary.encode('ascii')
+        out = [
+            b'--', mixed_boundary, CRLF,
+            f'Content-Type: multipart/alternative; boundary="{self.alternative_boundary}"'.encode('ascii'), CRLF,
+            CRLF
+        ]
+        out.extend(body)
+        for attachment in self.attachment_parts:
+            out.extend((b'--', mixed_boundary, CRLF, attachment, CRLF))
+        out.extend((b'--', mixed_boundary, b'--', CRLF))
+        return out
+
+    @staticmethod
+    def _encode_attachment(attachment: dict) -> bytes:
+        """Encode an attachment part once."""
+        content = attachment['content']
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        headers = attachment_headers(attachment['filename'], attachment.get('mime_type'))
+        return headers + base64.encodebytes(content).replace(b'\n', CRLF)
+
+    @staticmethod
+    def _new_boundary() -> str:
+        """Generate a MIME boundary that cannot occur in base64 or quoted-printable content."""
+        return f"==============={uuid.uuid4().hex}=="
@@ -0,0 +1,119 @@
+"""
+Recipient Source
+
+Streams the sendable recipients of a campaign in bounded batches from a single
+joined CampaignRecipient/Contact query, so senders never hold the whole
+audience (or its ORM objects) in memory.
+"""
+
+import logging
+from typing import Iterator
+from sqlalchemy import insert, literal, or_, select
+from app import db
+from app.models.campaign import Campaign, CampaignRecipient
+from app.models.contact import Contact, ContactStatus
+from app.services.send_records import Recipient
+
+logger = logging.getLogger(__name__)
+
+# Rows fetched per round-trip while streaming recipients
+DEFAULT_BATCH_SIZE = 500
+
+
+class RecipientSource:
+    """Lazy, re-iterable source of sendable recipients for one campaign."""
+
+    def __init__(self, campaign: Campaign, batch_size: int = DEFAULT_BATCH_SIZE, pending_only: bool = False):
+        self.campaign_id = campaign.id
+        self.user_id = campaign.user_id
+        self.batch_size = batch_size
+        # Skip recipients a paused send already recorded as sent or failed
+        self.pending_only = pending_only
+
+    def materialize(self) -> int:
+        """
+        Ensure the campaign has CampaignRecipient rows.
+
+        Campaigns created without an explicit audience fall back to all active,
+        subscribed contacts of the owner (legacy behavior). Those rows are
+        created server-side with a single INSERT ... SELECT.
+
+        Returns:
+            Number of recipient rows created (0 if the audience already existed)
+        """
+        has_recipients = db.session.query(
+            CampaignRecipient.query.filter_by(campaign_id=self.campaign_id).exists()
+        ).scalar()
+        if has_recipients:
+            return 0
+
+        logger.info(f"Campaign {self.campaign_id} has no specific recipients, using all active contacts")
+        contacts = select(literal(self.campaign_id), Contact.id).where(
+            Contact.user_id == self.user_id,
+            *self._sendable_filters()
+        )
+        result = db.session.execute(
+            insert(CampaignRecipient).from_select(['campaign_id', 'contact_id'], contacts)
+        )
+        db.session.commit()
+        return result.rowcount or 0
+
+    def count(self) -> int:
+        """Count sendable recipients without loading them."""
+        return self._base_query().with_entities(db.func.count(CampaignRecipient.id)).scalar() or 0
+
+    def __iter__(self) -> Iterator[Recipient]:
+        """
+        Yield recipients one at a time, fetching ``batch_size`` rows per query.
+
+        Pages are walked by recipient ID (keyset pagination) rather than with a
+        server-side cursor, because senders commit between batches and a
+        committed transaction would close a streaming cursor on PostgreSQL.
+        """
+        last_id = 0
+        while True:
+            rows = self._base_query().with_entities(
+                CampaignRecipient.id,
+                Contact.id,
+                Contact.email,
+                Contact.first_name,
+                Contact.last_name
+            ).filter(
+                CampaignRecipient.id > last_id
+            ).order_by(
+                CampaignRecipient.id
+            ).limit(self.batch_size).all()
+
+            if not rows:
+                return
+
+            for recipient_id, contact_id, email, first_name, last_name in rows:
+                yield Recipient(recipient_id, contact_id, email, first_name or '', last_name or '')
+
+            last_id = rows[-1][0]
+            if len(rows) < self.batch_size:
+                return
+
+    def _base_query(self):
+        """Joined query over this campaign's sendable recipients."""
+        query = db.session.query(CampaignRecipient).join(
+            Contact, CampaignRecipient.contact_id == Contact.id
+        ).filter(
+            CampaignRecipient.campaign_id == self.campaign_id,
+            *self._sendable_filters()
+        )
+        if self.pending_only:
+            query = query.filter(
+                or_(CampaignRecipient.email_sent.is_(None), CampaignRecipient.email_sent == False),
+                or_(CampaignRecipient.email_failed.is_(None), CampaignRecipient.email_failed == False)
+            )
+        return query
+
+    @staticmethod
+    def _sendable_filters():
+        """SQL equivalent of Contact.is_sendable()."""
+        return (
+            Contact.status == ContactStatus.ACTIVE,
+            Contact.subscribed == True,
+            Contact.email.contains('@')
+        )
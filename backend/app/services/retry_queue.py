@@ -0,0 +1,257 @@
+"""
+Retry Queue
+
+Temporary delivery failures (4xx replies, soft bounces, lost connections - as
+decided by the bounce classifier) are not final: the recipient's EmailLog is queued for another attempt by setting
+``next_retry_at``, with exponential backoff and jitter between attempts, up to
+the campaign's max_send_attempts (SEND_MAX_ATTEMPTS by default). The scheduler
+drains due entries in batches; every retry re-renders the recipient's tracked
+message with its original Message-ID and writes the outcome back to the
+EmailLog and the send ledger.
+"""
+
+import logging
+import random
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from flask import current_app
+from app import db
+from app.models.campaign import Campaign, CampaignRecipient, CampaignStatus
+from app.models.contact import Contact
+from app.models.email_log import EmailLog, EmailStatus
+from app.services.attachment_service import attachment_cache
+from app.services.bounce_classifier import classify_bounce
+from app.services.content_compiler import ContentCompiler
+from app.services.message_template import MessageTemplate, compile_placeholders, fill_placeholders
+from app.services.send_records import Recipient
+from app.services.smtp_client import Envelope
+from app.services.suppression_list import SuppressionEntry, SuppressionList
+from app.services.transports import SMTPTransport
+from app.utils.helpers import chunked
+
+logger = logging.getLogger(__name__)
+
+# Defaults for SEND_MAX_ATTEMPTS, SEND_RETRY_BASE_DELAY and SEND_RETRY_MAX_DELAY
+DEFAULT_MAX_ATTEMPTS = 4
+DEFAULT_BASE_DELAY = 5 * 60
+DEFAULT_MAX_DELAY = 6 * 60 * 60
+
+# Due retries handled per scheduler pass
+RETRY_BATCH_SIZE = 200
+
+# Seconds a pass holds the entries it took; a crashed pass's entries become due again after it
+RETRY_LEASE = 10 * 60
+
+
+class RetryQueue:
+    """Backoff policy and processing of queued soft-bounce retries."""
+
+    @staticmethod
+    def max_attempts(campaign: Campaign) -> int:
+        """Delivery attempts allowed per recipient of a campaign."""
+        return campaign.max_send_attempts or current_app.config.get('SEND_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)
+
+    @staticmethod
+    def next_attempt_at(attempts: int, now: Optional[datetime] = None) -> datetime:
+        """
+        When to retry after ``attempts`` failed attempts.
+
+        The delay doubles with every attempt up to SEND_RETRY_MAX_DELAY; half of
+        it is random (equal jitter) so retries of a large batch spread out
+        instead of hitting a rate-limiting provider all at once.
+        """
+        base = current_app.config.get('SEND_RETRY_BASE_DELAY', DEFAULT_BASE_DELAY)
+        ceiling = current_app.config.get('SEND_RETRY_MAX_DELAY', DEFAULT_MAX_DELAY)
+        delay = min(ceiling, base * 2 ** max(attempts - 1, 0))
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        return (now or datetime.utcnow()) + timedelta(seconds=delay)
+
+    @staticmethod
+    def next_due() -> Optional[datetime]:
+        """Earliest queued retry, if any."""
+        return db.session.query(db.func.min(EmailLog.next_retry_at)).scalar()
+
+    @staticmethod
+    def process_due(limit: int = RETRY_BATCH_SIZE) -> int:
+        """
+        Retry one batch of due entries.
+
+        Entries are leased with a conditional UPDATE first, so concurrent
+        schedulers never retry the same entry twice.
+
+        Returns:
+            Number of entries retried
+        """
+        now = datetime.utcnow()
+        due_ids = [
+            log_id for (log_id,) in db.session.query(EmailLog.id).filter(
+                EmailLog.next_retry_at <= now
+            ).order_by(EmailLog.next_retry_at).limit(limit)
+        ]
+        if not due_ids:
+            return 0
+
+        lease = now + timedelta(seconds=RETRY_LEASE, microseconds=random.randrange(1, 1000000))
+        EmailLog.query.filter(
+            EmailLog.id.in_(due_ids),
+            EmailLog.next_retry_at <= now
+        ).update({EmailLog.next_retry_at: lease}, synchronize_session=False)
+        db.session.commit()
+        logs = EmailLog.query.filter(EmailLog.id.in_(due_ids), EmailLog.next_retry_at == lease).all()
+
+        by_campaign: Dict[int, List[EmailLog]] = {}
+        for log in logs:
+            by_campaign.setdefault(log.campaign_id, []).append(log)
+        for campaign_id, campaign_logs in by_campaign.items():
+            try:
+                RetryQueue._retry_campaign(campaign_id, campaign_logs)
+            except Exception as e:
+                logger.error(f"Error retrying {len(campaign_logs)} emails of campaign {campaign_id}: {e}")
+                db.session.rollback()
+        return len(logs)
+
+    @staticmethod
+    def _retry_campaign(campaign_id: int, logs: List[EmailLog]):
+        """Re-send the queued emails of one campaign over one connection."""
+        from app.services.email_tracking_service import EmailTrackingService
+
+        now = datetime.utcnow()
+        campaign = db.session.get(Campaign, campaign_id)
+        if campaign is None or campaign.status == CampaignStatus.CANCELLED:
+            for log in logs:
+                log.next_retry_at = None
+            db.session.commit()
+            return
+        if campaign.status == CampaignStatus.PAUSED:
+            # Keep the queue, but hold off until the campaign is resumed
+            for log in logs:
+                log.next_retry_at = RetryQueue.next_attempt_at(1, now)
+            db.session.commit()
+            return
+
+        max_attempts = RetryQueue.max_attempts(campaign)
+        # The recipients behind the logs, for their ledger entries and placeholder values
+        recipients = {
+            email: Recipient(recipient_id, contact_id, email, first_name or '', last_name or '')
+            for recipient_id, contact_id, email, first_name, last_name in db.session.query(
+                CampaignRecipient.id, Contact.id, Contact.email, Contact.first_name, Contact.last_name
+            ).join(
+                Contact, CampaignRecipient.contact_id == Contact.id
+            ).filter(
+                CampaignRecipient.campaign_id == campaign_id,
+                Contact.email.in_([log.recipient_email for log in logs])
+            )
+        }
+
+        # Addresses suppressed since their soft bounce (complaint, unsubscribe, hard bounce) are not retried
+        suppressed = SuppressionList.load(campaign.user_id, [log.recipient_email for log in logs])
+        if suppressed:
+            held = [log for log in logs if log.recipient_email.lower() in suppressed]
+            for log in held:
+                log.next_retry_at = None
+            SuppressionList.skip_suppressed(campaign_id, [
+                recipients[log.recipient_email] for log in held if log.recipient_email in recipients
+            ], suppressed)
+            db.session.commit()
+            logs = [log for log in logs if log.recipient_email.lower() not in suppressed]
+            if not logs:
+                return
+        smtp_config = EmailTrackingService._smtp_config(campaign.user_id)
+        transport = EmailTrackingService._transport(smtp_config) if smtp_config else None
+        connect_error = "No SMTP configuration found" if transport is None else None
+        if transport is not None:
+            connected, connect_message = transport.open()
+            if not connected:
+                connect_error = connect_message
+
+        outcomes = {}
+        try:
+            if connect_error is None:
+                html_content, text_content = ContentCompiler.content_for_sending(campaign)
+                template = MessageTemplate(
+                    from_email=smtp_config.from_email,
+                    from_name=smtp_config.from_name,
+                    subject=campaign.subject,
+                    html_content=html_content,
+                    text_content=text_content,
+                    encoded_attachments=attachment_cache.parts_for_campaign(campaign),
+                    allow_8bit=transport.supports_8bitmime
+                )
+                html_segments = compile_placeholders(html_content)
+                for window in chunked(logs, SMTPTransport.batch_size):
+                    envelopes = []
+                    for log in window:
+                        recipient = recipients.get(log.recipient_email)
+                        fields = recipient.template_fields() if recipient else {'email': log.recipient_email}
+                        html = EmailTrackingService._tracked_html(
+                            fill_placeholders(html_segments, fields), log.id, log.tracking_id
+                        )
+                        envelopes.append(Envelope(
+                            smtp_config.from_email,
+                            [log.recipient_email],
+                            template.render(
+                                log.recipient_email,
+                                to_name=log.recipient_name,
+                                fields=fields,
+                                html_content=html,
+                                message_id=log.message_id
+                            )
+                        ))
+                    verdicts = transport.send_envelopes(envelopes, template.mail_options)
+                    for log, verdict in zip(window, verdicts):
+                        outcomes[log.id] = (verdict.recipient_error(log.recipient_email),
+                                            verdict.recipient_stage(log.recipient_email))
+        finally:
+            if transport is not None:
+                transport.close()
+            attachment_cache.evict_campaign(campaign_id)
+
+        ledger = []
+        suppress = []
+        delivered = 0
+        for log in logs:
+            error, stage = outcomes.get(log.id, (connect_error, 'connect'))
+            log.attempts = (log.attempts or 1) + 1
+            recipient = recipients.get(log.recipient_email)
+            recipient_id = recipient.recipient_id if recipient else None
+            if error is None:
+                delivered += 1
+                log.status = EmailStatus.SENT
+                log.sent_at = now
+                log.bounce_type = None
+                log.bounce_reason = None
+                log.bounce_diagnostic = None
+                log.bounced_at = None
+                log.next_retry_at = None
+                if recipient_id:
+                    ledger.append({'id': recipient_id, 'email_sent': True, 'sent_at': now,
+                                   'email_failed': False, 'error_message': None})
+                continue
+
+            verdict = classify_bounce(error, log.recipient_email, stage)
+            log.status = EmailStatus.BOUNCED if verdict.bounce_type else EmailStatus.FAILED
+            log.bounce_type = verdict.bounce_type
+            log.bounce_reason = error
+            log.bounce_diagnostic = verdict.diagnostic
+            log.bounced_at = now
+            reason = SuppressionList.reason_for(verdict, stage)
+            if reason:
+                suppress.append(SuppressionEntry(campaign.user_id, log.recipient_email, reason, verdict.diagnostic))
+            if log.attempts < max_attempts and verdict.retryable:
+                log.next_retry_at = RetryQueue.next_attempt_at(log.attempts, now)
+            else:
+                # Out of attempts or permanent: this is the final status
+                log.next_retry_at = None
+            if recipient_id:
+                ledger.append({'id': recipient_id, 'error_message': error})
+
+        if ledger:
+            db.session.bulk_update_mappings(CampaignRecipient, ledger)
+        if delivered:
+            Campaign.query.filter_by(id=campaign_id).update({
+                Campaign.emails_sent: db.func.coalesce(Campaign.emails_sent, 0) + delivered
+            }, synchronize_session=False)
+        db.session.commit()
+        if suppress:
+            SuppressionList.add(suppress, campaign_id)
+        logger.info(f"Retried {len(logs)} emails of campaign {campaign_id}: {delivered} delivered")
@@ -3,18 +3,34 @@ Campaign Scheduler Service
 
 This service handles the execution of scheduled campaigns.
 It runs as a background task to check for scheduled campaigns and send them at the appropriate time.
+
+Campaigns are prepared ahead of their send time: SCHEDULER_LEAD_TIME seconds
+before ``scheduled_at`` the audience is snapshotted and the content compiled,
+and SCHEDULER_PREWARM_TIME seconds before it the SMTP connections are opened,
+so delivery starts at full speed at the scheduled instant.
+
+Every pass also retries one batch of due soft bounces from the RetryQueue.
 """
 
 import threading
-import time
 from datetime import datetime, timedelta
+from typing import Dict, List
+from flask import current_app
 from app import db
 from app.models.campaign import Campaign, CampaignStatus
 from app.models.contact import Contact, ContactStatus
+from app.services.retry_queue import RETRY_BATCH_SIZE, RetryQueue
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Defaults for SCHEDULER_LEAD_TIME and SCHEDULER_PREWARM_TIME, in seconds
+DEFAULT_LEAD_TIME = 15 * 60
+DEFAULT_PREWARM_TIME = 30
+
+# Shortest sleep between scheduler passes, in seconds
+MIN_SLEEP = 0.5
+
 class CampaignScheduler:
     """Campaign scheduler for handling scheduled email campaigns."""
     
@@ -23,6 +39,10 @@ class CampaignScheduler:
         self.thread = None
         self.check_interval = 60  # Check every minute
         self.app = app
+        # Campaign ID -> scheduled_at the campaign was prepared / pre-warmed for
+        self._prepared: Dict[int, datetime] = {}
+        self._warmed: Dict[int, datetime] = {}
+        self._wakeup = threading.Event()
     
     def start(self, app=None):
         """Start the scheduler."""
@@ -45,6 +65,7 @@ class CampaignScheduler:
     def stop(self):
         """Stop the scheduler."""
         self.running = False
+        self._wakeup.set()
         if self.thread and self.thread.is_alive():
             self.thread.join(timeout=5)
         logger.info("Campaign scheduler stopped")
@@ -52,19 +73,26 @@ class CampaignScheduler:
     def _run_scheduler(self):
         """Main scheduler loop."""
         while self.running:
+            delay = self.check_interval
             try:
                 # Use the app instance provided to the scheduler
                 with self.app.app_context():
                     self._process_scheduled_campaigns()
+                    self._process_retries()
+                    delay = self._seconds_until_next_event(datetime.utcnow())
             except Exception as e:
                 logger.error(f"Error in scheduler loop: {str(e)}")
             
-            # Sleep for the check interval
-            time.sleep(self.check_interval)
+            # Sleep until the next check, or the next preparation or send time if sooner
+            self._wakeup.wait(delay)
+            self._wakeup.clear()
     
     def _process_scheduled_campaigns(self):
         """Check for and process scheduled campaigns that are due."""
         now = datetime.utcnow()
+        upcoming = self._upcoming_campaigns(now)
+        self._prepare_campaigns(upcoming)
+        self._prewarm_campaigns(upcoming, now)
         
         # Find campaigns that are scheduled and due to be sent
         due_campaigns = Campaign.query.filter(
@@ -76,6 +104,8 @@ class CampaignScheduler:
             logger.info(f"Found {len(due_campaigns)} campaigns due for sending at {now}")
         
         for campaign in due_campaigns:
+            self._prepared.pop(campaign.id, None)
+            self._warmed.pop(campaign.id, None)
             try:
                 logger.info(f"Processing scheduled campaign: {campaign.name} (ID: {campaign.id}), scheduled for: {campaign.scheduled_at}")
                 
@@ -103,6 +133,83 @@ class CampaignScheduler:
                 except Exception as commit_error:
                     logger.error(f"Failed to update campaign status: {commit_error}")
 
+    def _process_retries(self):
+        """Retry one batch of queued temporary failures."""
+        try:
+            retried = RetryQueue.process_due(RETRY_BATCH_SIZE)
+            if retried:
+                logger.info(f"Retried {retried} queued emails")
+        except Exception as e:
+            logger.error(f"Error processing retry queue: {str(e)}")
+            db.session.rollback()
+
+    def _upcoming_campaigns(self, now: datetime) -> List[Campaign]:
+        """Scheduled campaigns whose send time falls within the lead time."""
+        lead_time = timedelta(seconds=current_app.config.get('SCHEDULER_LEAD_TIME', DEFAULT_LEAD_TIME))
+        campaigns = Campaign.query.filter(
+            Campaign.status == CampaignStatus.SCHEDULED,
+            Campaign.scheduled_at > now,
+            Campaign.scheduled_at <= now + lead_time
+        ).all()
+        
+        # Forget campaigns that were sent, unscheduled or moved out of the window
+        current = {campaign.id for campaign in campaigns}
+        for tracked in (self._prepared, self._warmed):
+            for campaign_id in [i for i in tracked if i not in current]:
+                del tracked[campaign_id]
+        return campaigns
+    
+    def _prepare_campaigns(self, campaigns: List[Campaign]):
+        """Snapshot audience and compile content of campaigns entering the lead time."""
+        from app.services.email_service import EmailService
+        
+        for campaign in campaigns:
+            if self._prepared.get(campaign.id) == campaign.scheduled_at:
+                continue
+            # Attempted once per scheduled time; the send redoes anything that failed
+            self._prepared[campaign.id] = campaign.scheduled_at
+            success, message = EmailService.prepare_campaign(campaign.id)
+            if success:
+                logger.info(f"Scheduled campaign {campaign.id} prepared ahead of {campaign.scheduled_at}: {message}")
+            else:
+                logger.warning(f"Could not prepare scheduled campaign {campaign.id}: {message}")
+    
+    def _prewarm_campaigns(self, campaigns: List[Campaign], now: datetime):
+        """Open SMTP connections for campaigns about to be sent."""
+        from app.services.email_service import EmailService
+        
+        prewarm_time = timedelta(seconds=current_app.config.get('SCHEDULER_PREWARM_TIME', DEFAULT_PREWARM_TIME))
+        for campaign in campaigns:
+            if campaign.scheduled_at - now > prewarm_time or self._warmed.get(campaign.id) == campaign.scheduled_at:
+                continue
+            self._warmed[campaign.id] = campaign.scheduled_at
+            try:
+                EmailService.prewarm_connections(campaign.id)
+            except Exception as e:
+                logger.warning(f"Could not pre-warm connections for campaign {campaign.id}: {e}")
+    
+    def _seconds_until_next_event(self, now: datetime) -> float:
+        """Time until the next check, preparation, pre-warm, send or retry, whichever comes first."""
+        lead_time = timedelta(seconds=current_app.config.get('SCHEDULER_LEAD_TIME', DEFAULT_LEAD_TIME))
+        prewarm_time = timedelta(seconds=current_app.config.get('SCHEDULER_PREWARM_TIME', DEFAULT_PREWARM_TIME))
+        horizon = now + timedelta(seconds=self.check_interval)
+        
+        scheduled_times = db.session.query(Campaign.scheduled_at).filter(
+            Campaign.status == CampaignStatus.SCHEDULED,
+            Campaign.scheduled_at > now,
+            Campaign.scheduled_at <= horizon + lead_time
+        ).all()
+        
+        next_event = horizon
+        next_retry = RetryQueue.next_due()
+        if next_retry is not None and next_retry < next_event:
+            next_event = max(next_retry, now)
+        for (scheduled_at,) in scheduled_times:
+            for event in (scheduled_at - lead_time, scheduled_at - prewarm_time, scheduled_at):
+                if now < event < next_event:
+                    next_event = event
+        return max((next_event - now).total_seconds(), MIN_SLEEP)
+
 # Global scheduler instance
 scheduler = CampaignScheduler()
 
@@ -113,8 +220,3 @@ def start_scheduler(app=None):
 def stop_scheduler():
     """Stop the global scheduler."""
     scheduler.stop()
-
-
-def stop_scheduler():
-    """Stop the global scheduler."""
-    scheduler.stop()
\ No newline at end of file
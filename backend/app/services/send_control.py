@@ -0,0 +1,109 @@
+"""
+Send Control
+
+Pause and cancel requests for campaigns that are being sent. The campaign
+routes record a request here (and in the campaign's status); running sends
+poll it between batches through ``SendControl.stop_requested``.
+
+Requests made in this process are seen immediately. Requests made by another
+process are picked up from the campaign's status in the database, read at
+most every STATUS_POLL_INTERVAL seconds per campaign.
+
+A send also pauses itself once it has run for the campaign's send time limit
+(SEND_TIME_LIMIT by default); the deadline is handed down to the transports
+so no connection waits past it either.
+"""
+
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional
+from flask import current_app
+from sqlalchemy import select
+from app import db
+from app.models.campaign import Campaign, CampaignStatus
+
+logger = logging.getLogger(__name__)
+
+# Minimum seconds between database reads of a sending campaign's status
+STATUS_POLL_INTERVAL = 2.0
+
+# Statuses that stop a running send
+STOP_STATUSES = (CampaignStatus.PAUSED, CampaignStatus.CANCELLED)
+
+
+class SendControl:
+    """Process-wide registry of pause / cancel requests."""
+
+    _requests: Dict[int, CampaignStatus] = {}
+    _polled_at: Dict[int, float] = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def request(campaign_id: int, status: CampaignStatus):
+        """Ask a running send of a campaign to stop (PAUSED or CANCELLED)."""
+        if status not in STOP_STATUSES:
+            raise ValueError(f"Cannot request {status.value} for a running send")
+        with SendControl._lock:
+            SendControl._requests[campaign_id] = status
+        logger.info(f"Requested {status.value} for campaign {campaign_id}")
+
+    @staticmethod
+    def clear(campaign_id: int):
+        """Forget any request for a campaign (before it is sent or resumed)."""
+        with SendControl._lock:
+            SendControl._requests.pop(campaign_id, None)
+            SendControl._polled_at.pop(campaign_id, None)
+
+    @staticmethod
+    def deadline_for(campaign: Campaign) -> Optional[float]:
+        """time.monotonic() by which a send of the campaign starting now must be done (None = no limit)."""
+        limit = campaign.send_time_limit or current_app.config.get('SEND_TIME_LIMIT', 0)
+        return time.monotonic() + limit if limit else None
+
+    @staticmethod
+    def controller(campaign_id: int, deadline: Optional[float] = None) -> Callable[[], Optional[CampaignStatus]]:
+        """
+        Stop control for a send pipeline (see SendPipeline).
+
+        Returns pause / cancel requests, and PAUSED once ``deadline`` has passed.
+        """
+        def control() -> Optional[CampaignStatus]:
+            if deadline is not None and time.monotonic() >= deadline:
+                logger.warning(f"Campaign {campaign_id} reached its send time limit, pausing the send")
+                return CampaignStatus.PAUSED
+            return SendControl.stop_requested(campaign_id)
+        return control
+
+    @staticmethod
+    def stop_requested(campaign_id: int) -> Optional[CampaignStatus]:
+        """
+        Status a running send should stop with, if any.
+
+        Cheap enough to call between batches: the database is only read
+        every STATUS_POLL_INTERVAL seconds, on a connection of its own so the
+        caller's session and transaction are left alone.
+        """
+        with SendControl._lock:
+            requested = SendControl._requests.get(campaign_id)
+            if requested is not None:
+                return requested
+            now = time.monotonic()
+            if now - SendControl._polled_at.get(campaign_id, 0.0) < STATUS_POLL_INTERVAL:
+                return None
+            SendControl._polled_at[campaign_id] = now
+
+        try:
+            with db.engine.connect() as connection:
+                status = connection.execute(
+                    select(Campaign.status).where(Campaign.id == campaign_id)
+                ).scalar()
+        except Exception as e:
+            logger.warning(f"Could not read status of campaign {campaign_id}: {e}")
+            return None
+
+        if status in STOP_STATUSES:
+            with SendControl._lock:
+                SendControl._requests[campaign_id] = status
+            return status
+        return None
@@ -0,0 +1,124 @@
+"""
+Send Ledger
+
+Exactly-once bookkeeping of campaign deliveries. Every CampaignRecipient row -
+unique per (campaign, contact) - is a ledger entry: a sender claims a batch of
+entries with one conditional UPDATE before sending to them, and the send's
+result is recorded on the same row (email_sent / email_failed).
+
+An entry can only be claimed while it has no recorded result and no live claim
+of another sender, so retried or concurrent sends of the same campaign skip
+recipients that were already sent, or are being sent, instead of sending to
+them again. A claim older than SEND_CLAIM_TIMEOUT without a result is taken to
+belong to a sender that died and may be claimed again.
+"""
+
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Iterable, Set, Tuple
+from flask import current_app
+from sqlalchemy import and_, func, or_
+from app import db
+from app.models.campaign import CampaignRecipient
+
+logger = logging.getLogger(__name__)
+
+# Seconds after which an unrecorded claim is considered abandoned
+DEFAULT_CLAIM_TIMEOUT = 60 * 60
+
+
+class SendLedger:
+    """Claims on campaign recipients, keyed by a per-send token."""
+
+    @staticmethod
+    def new_token() -> str:
+        """Token identifying one send (or one spool, across resumes)."""
+        return uuid.uuid4().hex
+
+    @staticmethod
+    def claim(campaign_id: int, recipient_ids: Iterable[int], token: str) -> Set[int]:
+        """
+        Atomically reserve recipients for sending and commit the claim.
+
+        Args:
+            campaign_id: Campaign being sent
+            recipient_ids: CampaignRecipient IDs of the batch
+            token: Token of the claiming send; its own earlier claims are kept
+
+        Returns:
+            IDs of the recipients now claimed by ``token``
+        """
+        ids = list(recipient_ids)
+        if not ids:
+            return set()
+        timeout = current_app.config.get('SEND_CLAIM_TIMEOUT', DEFAULT_CLAIM_TIMEOUT)
+        now = datetime.utcnow()
+
+        claimable = or_(CampaignRecipient.claim_token.is_(None), CampaignRecipient.claim_token == token)
+        if timeout:
+            claimable = or_(claimable, CampaignRecipient.claimed_at < now - timedelta(seconds=timeout))
+
+        CampaignRecipient.query.filter(
+            CampaignRecipient.campaign_id == campaign_id,
+            CampaignRecipient.id.in_(ids),
+            SendLedger._unrecorded(),
+            claimable
+        ).update({
+            CampaignRecipient.claim_token: token,
+            CampaignRecipient.claimed_at: now
+        }, synchronize_session=False)
+        db.session.commit()
+
+        claimed = {
+            row.id for row in db.session.query(CampaignRecipient.id).filter(
+                CampaignRecipient.id.in_(ids),
+                CampaignRecipient.claim_token == token,
+                SendLedger._unrecorded()
+            )
+        }
+        if len(claimed) < len(ids):
+            logger.info(f"Campaign {campaign_id}: skipped {len(ids) - len(claimed)} recipients "
+                        f"already sent or claimed by another send")
+        return claimed
+
+    @staticmethod
+    def release(campaign_id: int, token: str) -> int:
+        """
+        Give up a send's claims that never got a result (e.g. after a pause).
+
+        Returns:
+            Number of claims released
+        """
+        released = CampaignRecipient.query.filter(
+            CampaignRecipient.campaign_id == campaign_id,
+            CampaignRecipient.claim_token == token,
+            SendLedger._unrecorded()
+        ).update({
+            CampaignRecipient.claim_token: None,
+            CampaignRecipient.claimed_at: None
+        }, synchronize_session=False)
+        db.session.commit()
+        return released or 0
+
+    @staticmethod
+    def totals(campaign_id: int) -> Tuple[int, int]:
+        """
+        Recorded results of a campaign across all of its sends.
+
+        Returns:
+            Tuple of (sent, failed)
+        """
+        sent, failed = db.session.query(
+            func.count(CampaignRecipient.id).filter(CampaignRecipient.email_sent == True),
+            func.count(CampaignRecipient.id).filter(CampaignRecipient.email_failed == True)
+        ).filter(CampaignRecipient.campaign_id == campaign_id).one()
+        return sent or 0, failed or 0
+
+    @staticmethod
+    def _unrecorded():
+        """Entries without a recorded result."""
+        return and_(
+            or_(CampaignRecipient.email_sent.is_(None), CampaignRecipient.email_sent == False),
+            or_(CampaignRecipient.email_failed.is_(None), CampaignRecipient.email_failed == False)
+        )
@@ -0,0 +1,316 @@
+"""
+Send Pipeline
+
+Campaign delivery runs as a chain of stages - recipient resolution,
+rendering, signing, SMTP delivery and outcome recording - connected by
+bounded queues. Every stage has its own worker threads, so database reads,
+CPU-bound rendering and network I/O overlap instead of taking turns, and a
+slow stage blocks its producers (backpressure) instead of letting rendered
+messages pile up in memory.
+
+Work moves through the pipeline as SendBatch objects. Stage handlers mutate
+the batch in place; a handler that raises marks the batch as failed, which
+skips the remaining stages except those flagged ``always`` (recording).
+
+A pipeline can be stopped (pause / cancel) while it runs: resolution stops,
+batches still queued are dropped without reaching any further stage, so they
+stay unsent and unrecorded, and delivery handlers may check ``stopping`` to
+leave the rest of a batch undelivered (recipients without an outcome).
+"""
+
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from flask import current_app
+from app.services.send_records import Recipient, SendOutcome
+from app.services.smtp_client import Envelope, EnvelopeResult
+
+logger = logging.getLogger(__name__)
+
+# Batches buffered between two stages
+DEFAULT_QUEUE_SIZE = 4
+
+# Worker threads per stage when the config does not say otherwise
+DEFAULT_STAGE_WORKERS = {
+    'render': 2,
+    'sign': 2,
+    'deliver': 2,
+}
+
+# Seconds between polls of the stop control while the pipeline runs
+CONTROL_POLL_INTERVAL = 0.5
+
+# End-of-stream marker passed down the queues
+_DONE = object()
+
+
+class SendBatch:
+    """A group of recipients moving through the pipeline together."""
+
+    __slots__ = ('seq', 'recipients', 'context', 'envelopes', 'groups', 'outcomes', 'bytes_sent', 'error', 'spooled', 'dropped')
+
+    def __init__(self, seq: int, recipients: List[Recipient], context: Any = None):
+        self.seq = seq
+        self.recipients = recipients
+        # Stage-specific data attached by resolution (e.g. EmailLog IDs)
+        self.context = context
+        self.envelopes: List[Envelope] = []
+        # Recipients addressed by each envelope, parallel to ``envelopes``
+        self.groups: List[List[Recipient]] = []
+        self.outcomes: List[Tuple[Recipient, SendOutcome]] = []
+        self.bytes_sent = 0
+        self.error: Optional[str] = None
+        # (start, end) spool offsets once the batch's messages are spooled
+        self.spooled: Optional[Tuple[int, int]] = None
+        # Set when the pipeline was stopped before the batch was delivered
+        self.dropped = False
+
+    def fail_all(self, error: str):
+        """Mark every recipient without an outcome as failed."""
+        done = {id(recipient) for recipient, _ in self.outcomes}
+        for recipient in self.recipients:
+            if id(recipient) not in done:
+                self.outcomes.append((recipient, SendOutcome(recipient.email or 'unknown', False, error)))
+
+
+def envelope_outcomes(group: List[Recipient], verdict: EnvelopeResult) -> List[Tuple[Recipient, SendOutcome]]:
+    """Outcome of every recipient addressed by a delivered envelope."""
+    outcomes = []
+    for recipient in group:
+        error_msg = verdict.recipient_error(recipient.email)
+        outcomes.append((recipient, SendOutcome(
+            recipient.email, error_msg is None, error_msg,
+            stage=verdict.recipient_stage(recipient.email), shared=len(group) > 1
+        )))
+    return outcomes
+
+
+class Stage:
+    """
+    One step of the pipeline.
+
+    ``make_handler`` is called once in every worker thread and returns the
+    callable applied to each batch; per-worker state (such as an SMTP
+    connection) lives in that handler and is released through its
+    ``close()`` method, if it has one.
+    """
+
+    def __init__(self, name: str, make_handler: Callable[[], Callable[[SendBatch], None]],
+                 workers: Optional[int] = None, always: bool = False):
+        self.name = name
+        self.make_handler = make_handler
+        self.workers = max(1, workers or stage_workers(name))
+        # Run even for batches an earlier stage failed
+        self.always = always
+
+
+class StageMetrics:
+    """Throughput and queue-depth counters for one stage."""
+
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = workers
+        self.batches = 0
+        self.items = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.max_queue_depth = 0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.queue: Optional[queue.Queue] = None
+        self._lock = threading.Lock()
+
+    def observe(self, items: int, seconds: float, failed: bool):
+        with self._lock:
+            self.batches += 1
+            self.items += items
+            self.busy_seconds += seconds
+            if failed:
+                self.errors += 1
+
+    def observe_queue(self, depth: int):
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+
+    def to_dict(self) -> Dict:
+        """Convert metrics to dictionary."""
+        end = self.finished_at or time.monotonic()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        return {
+            'workers': self.workers,
+            'batches': self.batches,
+            'items': self.items,
+            'errors': self.errors,
+            'busy_seconds': round(self.busy_seconds, 3),
+            'items_per_second': round(self.items / elapsed, 1) if elapsed else 0.0,
+            # Share of the stage's worker time spent handling batches
+            'utilization': round(self.busy_seconds / (elapsed * self.workers), 3) if elapsed else 0.0,
+            'queue_depth': self.queue.qsize() if self.queue is not None else 0,
+            'max_queue_depth': self.max_queue_depth
+        }
+
+
+def stage_workers(name: str) -> int:
+    """Configured worker count for a stage (SEND_<NAME>_WORKERS)."""
+    return current_app.config.get(f'SEND_{name.upper()}_WORKERS') or DEFAULT_STAGE_WORKERS.get(name, 1)
+
+
+class SendPipeline:
+    """
+    Run batches from a resolver through a chain of stages.
+
+    The resolver is an iterable of SendBatch objects (typically a generator
+    reading recipients from the database); it runs in its own thread as the
+    ``resolve`` stage. Every thread works inside its own application
+    context, and therefore its own database session.
+
+    ``control`` is polled while the pipeline runs; when it returns a truthy
+    value the pipeline stops (see ``stop``) and the value is kept in
+    ``stopped``.
+    """
+
+    def __init__(self, resolver: Iterable[SendBatch], stages: Sequence[Stage], queue_size: Optional[int] = None,
+                 control: Optional[Callable[[], Any]] = None):
+        self.resolver = resolver
+        self.stages = list(stages)
+        self.queue_size = queue_size or current_app.config.get('SEND_PIPELINE_QUEUE_SIZE') or DEFAULT_QUEUE_SIZE
+        self.metrics: Dict[str, StageMetrics] = {'resolve': StageMetrics('resolve', 1)}
+        for stage in self.stages:
+            self.metrics[stage.name] = StageMetrics(stage.name, stage.workers)
+        self._error: Optional[BaseException] = None
+        self._remaining: Dict[str, int] = {stage.name: stage.workers for stage in self.stages}
+        self._lock = threading.Lock()
+        self.control = control
+        self.stopped: Any = None
+        self._stop = threading.Event()
+
+    @property
+    def stopping(self) -> bool:
+        """True once the pipeline has been asked to stop."""
+        return self._stop.is_set()
+
+    def stop(self, reason: Any = True):
+        """Stop resolving and drop batches that have not been handled yet."""
+        if not self._stop.is_set():
+            self.stopped = reason
+            self._stop.set()
+            logger.info(f"Send pipeline stopping ({reason})")
+
+    def run(self) -> Dict[str, Dict]:
+        """
+        Drive every batch through the pipeline and wait for it to drain.
+
+        Returns:
+            Per-stage metrics (see StageMetrics.to_dict)
+        """
+        app = current_app._get_current_object()
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        for stage, stage_queue in zip(self.stages, queues):
+            self.metrics[stage.name].queue = stage_queue
+
+        threads = [threading.Thread(target=self._resolve, args=(app, queues[0]), name='send-resolve', daemon=True)]
+        for index, stage in enumerate(self.stages):
+            downstream = (self.stages[index + 1], queues[index + 1]) if index + 1 < len(self.stages) else None
+            for number in range(stage.workers):
+                threads.append(threading.Thread(
+                    target=self._work,
+                    args=(app, stage, queues[index], downstream),
+                    name=f'send-{stage.name}-{number}',
+                    daemon=True
+                ))
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(CONTROL_POLL_INTERVAL)
+                if self.control is not None and not self._stop.is_set():
+                    reason = self.control()
+                    if reason:
+                        self.stop(reason)
+
+        summary = self.snapshot()
+        logger.info("Send pipeline finished: " + ", ".join(
+            f"{name} {m['items']} items @ {m['items_per_second']}/s "
+            f"(util {m['utilization']:.0%}, max queue {m['max_queue_depth']})"
+            for name, m in summary.items()
+        ))
+        if self._error is not None:
+            raise self._error
+        return summary
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Current per-stage metrics; safe to call while the pipeline runs."""
+        return {name: metrics.to_dict() for name, metrics in self.metrics.items()}
+
+    def _resolve(self, app, output: queue.Queue):
+        metrics = self.metrics['resolve']
+        metrics.started_at = time.monotonic()
+        try:
+            with app.app_context():
+                batches = iter(self.resolver)
+                while not self._stop.is_set():
+                    started = time.monotonic()
+                    batch = next(batches, None)
+                    if batch is None:
+                        break
+                    metrics.observe(len(batch.recipients), time.monotonic() - started, batch.error is not None)
+                    output.put(batch)
+                    self.metrics[self.stages[0].name].observe_queue(output.qsize())
+        except BaseException as e:
+            logger.error(f"Recipient resolution failed: {e}")
+            self._error = e
+        finally:
+            metrics.finished_at = time.monotonic()
+            for _ in range(self.stages[0].workers):
+                output.put(_DONE)
+
+    def _work(self, app, stage: Stage, input_queue: queue.Queue, downstream: Optional[Tuple[Stage, queue.Queue]]):
+        metrics = self.metrics[stage.name]
+        with self._lock:
+            if metrics.started_at is None:
+                metrics.started_at = time.monotonic()
+        drained = False
+        try:
+            with app.app_context():
+                handler = stage.make_handler()
+                try:
+                    while True:
+                        batch = input_queue.get()
+                        if batch is _DONE:
+                            drained = True
+                            break
+                        if self._stop.is_set() and not stage.always:
+                            batch.dropped = True
+                        started = time.monotonic()
+                        if not batch.dropped and (batch.error is None or stage.always):
+                            try:
+                                handler(batch)
+                            except Exception as e:
+                                logger.error(f"Send stage '{stage.name}' failed for batch {batch.seq}: {e}")
+                                batch.error = str(e)
+                        metrics.observe(len(batch.recipients), time.monotonic() - started, batch.error is not None)
+                        if downstream:
+                            downstream[1].put(batch)
+                            self.metrics[downstream[0].name].observe_queue(downstream[1].qsize())
+                finally:
+                    close = getattr(handler, 'close', None)
+                    if close:
+                        close()
+        except BaseException as e:
+            logger.error(f"Send stage '{stage.name}' worker crashed: {e}")
+            self._error = e
+            # Keep consuming so upstream stages never block on a full queue
+            while not drained:
+                drained = input_queue.get() is _DONE
+        finally:
+            with self._lock:
+                self._remaining[stage.name] -= 1
+                last = self._remaining[stage.name] == 0
+                if last:
+                    metrics.finished_at = time.monotonic()
+            if last and downstream:
+                for _ in range(downstream[0].workers):
+                    downstream[1].put(_DONE)
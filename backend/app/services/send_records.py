@@ -0,0 +1,108 @@
+"""
+Compact records used by the send pipeline.
+
+Recipients and per-message outcomes are tuples rather than dicts, and campaign
+results are folded into a SendSummary as they arrive instead of being kept as
+one entry per recipient.
+"""
+
+from typing import Dict, List, NamedTuple, Optional
+
+# Failed outcomes kept verbatim in a summary; the rest are only counted
+MAX_FAILURE_SAMPLES = 50
+
+# Placeholders recipients can fill in campaign content, e.g. {first_name}
+TEMPLATE_FIELDS = ('email', 'first_name', 'last_name', 'full_name', 'name', 'contact_id')
+
+
+class Recipient(NamedTuple):
+    """A sendable campaign recipient."""
+    recipient_id: int
+    contact_id: int
+    email: str
+    first_name: str
+    last_name: str
+
+    @property
+    def full_name(self) -> str:
+        """Full name, falling back to the email address."""
+        return f"{self.first_name} {self.last_name}".strip() or self.email
+
+    @property
+    def name(self) -> str:
+        """Display name used in the To header."""
+        return self.full_name
+
+    def template_fields(self) -> Dict[str, str]:
+        """Values available as {placeholder} substitutions in campaign content."""
+        return {
+            'email': self.email,
+            'first_name': self.first_name,
+            'last_name': self.last_name,
+            'full_name': self.full_name,
+            'name': self.name,
+            'contact_id': str(self.contact_id)
+        }
+
+
+class SendOutcome(NamedTuple):
+    """Result of sending one message."""
+    email: str
+    success: bool
+    error: Optional[str] = None
+    email_log_id: Optional[int] = None
+    # Delivery stage that failed (see smtp_client.STAGE_LABELS)
+    stage: Optional[str] = None
+    # Whether the failed envelope also addressed other recipients
+    shared: bool = False
+
+
+class SendSummary:
+    """Incrementally aggregated campaign send results."""
+
+    __slots__ = ('total', 'succeeded', 'failed', 'suppressed', 'failures', 'max_failures', 'bytes_sent', 'pipeline', 'stopped')
+
+    def __init__(self, max_failures: int = MAX_FAILURE_SAMPLES):
+        self.total = 0
+        self.succeeded = 0
+        self.failed = 0
+        # Recipients skipped because their address is suppressed
+        self.suppressed = 0
+        self.failures: List[SendOutcome] = []
+        self.max_failures = max_failures
+        # SMTP traffic written for the campaign (commands and message data)
+        self.bytes_sent = 0
+        # Per-stage send pipeline metrics, once the send has run
+        self.pipeline: Dict[str, Dict] = {}
+        # Status the send was stopped with (paused / cancelled), if it was
+        self.stopped: Optional[str] = None
+
+    def record(self, outcome: SendOutcome):
+        """Fold one outcome into the counters."""
+        self.total += 1
+        if outcome.success:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+            if len(self.failures) < self.max_failures:
+                self.failures.append(outcome)
+
+    def record_all(self, outcomes):
+        """Fold a batch of outcomes into the counters."""
+        for outcome in outcomes:
+            self.record(outcome)
+
+    def to_dict(self) -> Dict:
+        """Convert summary to dictionary."""
+        return {
+            'total_recipients': self.total,
+            'successful_sends': self.succeeded,
+            'failed_sends': self.failed,
+            'suppressed': self.suppressed,
+            'bytes_sent': self.bytes_sent,
+            'pipeline': self.pipeline,
+            'stopped': self.stopped,
+            'failure_samples': [
+                {'email': f.email, 'error': f.error} for f in self.failures
+            ]
+        }
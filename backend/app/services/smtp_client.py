@@ -0,0 +1,528 @@
+"""
+SMTP Client
+
+``smtplib`` runs MAIL FROM, each RCPT TO, DATA and the message body as
+separate round-trips. The client here negotiates ESMTP PIPELINING (RFC 2920)
+and CHUNKING (RFC 3030) and writes a whole envelope -- and, within a window,
+several consecutive envelopes -- in one go, then reads the replies back in
+order so every refusal is still attributed to the right recipient.
+
+Connections are kept in a small pool keyed by server and login, so
+consecutive sends to the same relay skip the connect/TLS/AUTH handshake.
+
+Every socket operation has a timeout (SMTPTimeouts): one for connecting,
+securing and logging in, one per command reply, and a longer one for
+message uploads and the replies to them. A connection may also carry a
+deadline, which shortens all of them so a send never outlives it.
+"""
+
+import atexit
+import logging
+import re
+import smtplib
+import socket
+import ssl
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+from app.services.message_template import RenderedMessage, message_parts
+from app.utils.helpers import chunked
+
+logger = logging.getLogger(__name__)
+
+# Envelopes written before waiting for their replies
+DEFAULT_PIPELINE_DEPTH = 10
+
+# Idle connections kept per server/login and how long they stay reusable
+POOL_MAX_IDLE = 4
+POOL_IDLE_TIMEOUT = 60
+
+# Connections idle for longer than this are probed with NOOP before reuse
+POOL_PROBE_AFTER = 5
+
+# Seconds to wait for connect / TLS / login, for a command reply and for a message upload and its reply
+DEFAULT_CONNECT_TIMEOUT = 30
+DEFAULT_COMMAND_TIMEOUT = 60
+DEFAULT_DATA_TIMEOUT = 180
+
+# Human readable prefix for each point at which a transaction can fail
+STAGE_LABELS = {
+    'sign': 'DKIM signing failed',
+    'connect': 'Connection failed',
+    'connection': 'Connection lost',
+    'MAIL': 'Sender refused',
+    'RCPT': 'Recipient refused',
+    'DATA': 'SMTP data error',
+    'write': 'Write failed',
+    'api': 'Delivery API error'
+}
+
+SMTPReply = Tuple[int, bytes]
+
+
+def format_reply(reply: SMTPReply) -> str:
+    """Render an SMTP reply as ``"550 5.1.1 User unknown"``."""
+    code, text = reply
+    text = text.decode('utf-8', 'replace') if isinstance(text, bytes) else str(text)
+    return f"{code} {text}" if code > 0 else text
+
+
+class Envelope(NamedTuple):
+    """One SMTP transaction: sender, recipients and the serialized message."""
+    sender: str
+    recipients: Sequence[str]
+    message: RenderedMessage
+
+
+class EnvelopeResult(NamedTuple):
+    """
+    Server verdict for one envelope.
+
+    ``refused`` maps recipients rejected at RCPT TO to their reply. ``error``
+    is set when the transaction as a whole failed, in which case no recipient
+    received the message; ``stage`` says where (see STAGE_LABELS).
+    """
+    refused: Dict[str, SMTPReply]
+    error: Optional[SMTPReply] = None
+    stage: Optional[str] = None
+
+    def recipient_error(self, address: str) -> Optional[str]:
+        """Error message for one recipient, or None if it was accepted."""
+        if self.error:
+            return f"{STAGE_LABELS.get(self.stage, 'SMTP error')}: {format_reply(self.error)}"
+        if address in self.refused:
+            return f"{STAGE_LABELS['RCPT']}: {format_reply(self.refused[address])}"
+        return None
+
+    def recipient_stage(self, address: str) -> Optional[str]:
+        """Stage at which delivery to one recipient failed, or None if it was accepted."""
+        if self.error:
+            return self.stage
+        return 'RCPT' if address in self.refused else None
+
+
+def is_timeout(error: BaseException) -> bool:
+    """Whether an error is a socket timeout, or was raised for one (smtplib reports them as disconnects)."""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        if isinstance(error, socket.timeout):
+            return True
+        seen.add(id(error))
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def failed_result(message: str, stage: str = 'connection') -> EnvelopeResult:
+    """Result for an envelope that never reached a server verdict."""
+    return EnvelopeResult({}, (0, message.encode('utf-8', 'replace')), stage)
+
+
+class SMTPTimeouts(NamedTuple):
+    """Seconds to wait on an SMTP server per phase."""
+    connect: float = DEFAULT_CONNECT_TIMEOUT
+    command: float = DEFAULT_COMMAND_TIMEOUT
+    data: float = DEFAULT_DATA_TIMEOUT
+
+
+class PipeliningMixin:
+    """Batched envelope delivery for ``smtplib.SMTP`` and ``smtplib.SMTP_SSL``."""
+
+    pipeline_depth = DEFAULT_PIPELINE_DEPTH
+
+    timeouts = SMTPTimeouts()
+
+    # time.monotonic() by which the current send must be done (None = no deadline)
+    deadline: Optional[float] = None
+
+    # Socket operations that timed out over the life of the connection
+    timed_out = 0
+
+    # Set when the previous transaction may have left server state behind
+    _needs_reset = False
+
+    # Bytes written to the socket over the life of the connection
+    bytes_sent = 0
+
+    def send(self, s):
+        """Send data to the server, counting the bytes put on the wire."""
+        super().send(s)
+        self.bytes_sent += len(s.encode(self.command_encoding)) if isinstance(s, str) else len(s)
+
+    def send_parts(self, parts: Sequence):
+        """
+        Write several buffers in order.
+
+        Adjacent ``bytes`` pieces are coalesced into one write; shared buffers
+        (memory-mapped attachments) are handed to the socket directly.
+        """
+        run = []
+        for part in parts:
+            if isinstance(part, bytes):
+                run.append(part)
+                continue
+            if run:
+                self.send(b''.join(run))
+                run = []
+            self.send(part)
+        if run:
+            self.send(b''.join(run))
+
+    def set_phase_timeout(self, seconds: float):
+        """
+        Set the socket timeout for the next operations, shortened to the deadline.
+
+        Raises:
+            socket.timeout: If the deadline has already passed
+        """
+        if self.deadline is not None:
+            remaining = self.deadline - time.monotonic()
+            if remaining <= 0:
+                raise socket.timeout('Send deadline exceeded')
+            seconds = min(seconds, remaining)
+        if self.sock is not None:
+            self.sock.settimeout(seconds)
+
+    @property
+    def supports_pipelining(self) -> bool:
+        self.ehlo_or_helo_if_needed()
+        return bool(self.does_esmtp and self.has_extn('pipelining'))
+
+    @property
+    def supports_chunking(self) -> bool:
+        self.ehlo_or_helo_if_needed()
+        return bool(self.does_esmtp and self.has_extn('chunking'))
+
+    @property
+    def supports_8bitmime(self) -> bool:
+        """Whether 8bit bodies may be sent (SMTPUTF8 servers must accept them too)."""
+        self.ehlo_or_helo_if_needed()
+        return bool(self.does_esmtp and (self.has_extn('8bitmime') or self.has_extn('smtputf8')))
+
+    def send_envelopes(
+        self,
+        envelopes: Sequence[Envelope],
+        mail_options: Sequence[str] = ()
+    ) -> List[EnvelopeResult]:
+        """
+        Deliver several envelopes over this connection.
+
+        With PIPELINING, up to ``pipeline_depth`` envelopes are written per
+        round-trip: MAIL/RCPT/BDAT for all of them when CHUNKING is offered,
+        otherwise MAIL/RCPT/DATA with the previous message's body sent ahead
+        of the next envelope's commands. Without PIPELINING each envelope
+        falls back to ``sendmail``.
+
+        Args:
+            envelopes: Transactions to run, in order
+            mail_options: Extra MAIL FROM parameters (e.g. 'BODY=8BITMIME')
+
+        Returns:
+            One result per envelope in input order. If the connection drops,
+            envelopes without a final reply are reported with stage
+            'connection' and the connection is closed.
+        """
+        results: List[EnvelopeResult] = []
+        try:
+            self.set_phase_timeout(self.timeouts.command)
+            if not self.supports_pipelining:
+                for envelope in envelopes:
+                    results.append(self._send_sequential(envelope, mail_options))
+            else:
+                for window in chunked(envelopes, self.pipeline_depth):
+                    if self.supports_chunking:
+                        self._send_window_bdat(window, mail_options, results)
+                    else:
+                        self._send_window_data(window, mail_options, results)
+        except (smtplib.SMTPServerDisconnected, OSError) as e:
+            if is_timeout(e):
+                self.timed_out += 1
+            logger.error(f"SMTP connection lost after {len(results)}/{len(envelopes)} envelopes: {e}")
+            self.close()
+            results.extend(failed_result(str(e) or 'Server disconnected') for _ in envelopes[len(results):])
+        return results
+
+    def _send_sequential(self, envelope: Envelope, mail_options: Sequence[str]) -> EnvelopeResult:
+        """Classic lock-step transaction for servers without PIPELINING."""
+        if not envelope.recipients:
+            return failed_result('No recipients', 'RCPT')
+        try:
+            self.set_phase_timeout(self.timeouts.data)
+            return EnvelopeResult(self.sendmail(
+                envelope.sender, list(envelope.recipients), bytes(envelope.message), list(mail_options)
+            ))
+        except smtplib.SMTPRecipientsRefused as e:
+            return EnvelopeResult(e.recipients)
+        except smtplib.SMTPSenderRefused as e:
+            return EnvelopeResult({}, (e.smtp_code, e.smtp_error), 'MAIL')
+        except smtplib.SMTPDataError as e:
+            return EnvelopeResult({}, (e.smtp_code, e.smtp_error), 'DATA')
+
+    def _send_window_data(self, window, mail_options, results: List[EnvelopeResult]):
+        """
+        Pipeline a window of envelopes using DATA.
+
+        RFC 2920 requires DATA to end a command group, so each write carries
+        the body of the previous message (whose DATA got 354) followed by the
+        next envelope's MAIL/RCPT/DATA: one round-trip per message.
+        """
+        pending = None  # (envelope, mail_reply, refused) waiting for its body to be sent
+
+        for envelope in window:
+            if not envelope.recipients:
+                if pending:
+                    self.set_phase_timeout(self.timeouts.data)
+                    self.send_parts(self._dot_stuff(pending[0].message))
+                    results.append(self._verdict(*pending, self.getreply()))
+                    pending = None
+                results.append(failed_result('No recipients', 'RCPT'))
+                continue
+
+            reset = self._needs_reset
+            commands = [b'RSET\r\n'] if reset else []
+            commands.extend(self._envelope_commands(envelope, mail_options))
+            commands.append(b'DATA\r\n')
+
+            payload = self._dot_stuff(pending[0].message) if pending else []
+            payload.extend(commands)
+            self.set_phase_timeout(self.timeouts.data if pending else self.timeouts.command)
+            self.send_parts(payload)
+
+            if pending:
+                results.append(self._verdict(*pending, self.getreply()))
+                pending = None
+                self.set_phase_timeout(self.timeouts.command)
+
+            if reset:
+                self.getreply()
+            mail_reply, refused = self._read_envelope_replies(envelope)
+            data_reply = self.getreply()
+
+            if data_reply[0] == 354:
+                pending = (envelope, mail_reply, refused)
+            else:
+                results.append(self._verdict(envelope, mail_reply, refused, data_reply))
+
+        if pending:
+            self.set_phase_timeout(self.timeouts.data)
+            self.send_parts(self._dot_stuff(pending[0].message))
+            results.append(self._verdict(*pending, self.getreply()))
+
+    def _send_window_bdat(self, window, mail_options, results: List[EnvelopeResult]):
+        """
+        Pipeline a window of envelopes using BDAT.
+
+        BDAT may appear anywhere in a command group, so the whole window is
+        written at once and all replies are read afterwards. Every envelope
+        after the first starts with RSET because the outcome of the previous
+        transaction is not known when it is written.
+        """
+        resets = [i > 0 or self._needs_reset for i in range(len(window))]
+        payload = []
+        for envelope, reset in zip(window, resets):
+            if reset:
+                payload.append(b'RSET\r\n')
+            payload.extend(self._envelope_commands(envelope, mail_options))
+            payload.append(f'BDAT {len(envelope.message)} LAST\r\n'.encode('ascii'))
+            payload.extend(message_parts(envelope.message))
+        # Replies come after whole messages, so the window runs on the data timeout
+        self.set_phase_timeout(self.timeouts.data)
+        self.send_parts(payload)
+
+        for envelope, reset in zip(window, resets):
+            if reset:
+                self.getreply()
+            mail_reply, refused = self._read_envelope_replies(envelope)
+            results.append(self._verdict(envelope, mail_reply, refused, self.getreply()))
+
+    def _envelope_commands(self, envelope: Envelope, mail_options: Sequence[str]) -> List[bytes]:
+        """MAIL FROM and RCPT TO lines for one envelope."""
+        options = list(mail_options)
+        if self.has_extn('size'):
+            options.append(f"SIZE={len(envelope.message)}")
+        if any(option.lower() == 'smtputf8' for option in options):
+            if not self.has_extn('smtputf8'):
+                raise smtplib.SMTPNotSupportedError('SMTPUTF8 not supported by server')
+            self.command_encoding = 'utf-8'
+
+        option_list = (' ' + ' '.join(options)) if options else ''
+        lines = [f"MAIL FROM:{smtplib.quoteaddr(envelope.sender)}{option_list}\r\n"]
+        lines.extend(f"RCPT TO:{smtplib.quoteaddr(address)}\r\n" for address in envelope.recipients)
+        return [line.encode(self.command_encoding) for line in lines]
+
+    def _read_envelope_replies(self, envelope: Envelope) -> Tuple[SMTPReply, Dict[str, SMTPReply]]:
+        """Read the MAIL FROM reply and one reply per RCPT TO."""
+        mail_reply = self.getreply()
+        refused = {}
+        for address in envelope.recipients:
+            reply = self.getreply()
+            if reply[0] not in (250, 251):
+                refused[address] = reply
+        return mail_reply, refused
+
+    def _verdict(
+        self,
+        envelope: Envelope,
+        mail_reply: SMTPReply,
+        refused: Dict[str, SMTPReply],
+        final_reply: SMTPReply
+    ) -> EnvelopeResult:
+        """Combine the replies of one transaction into its result."""
+        if mail_reply[0] != 250:
+            result = EnvelopeResult({}, mail_reply, 'MAIL')
+        elif len(refused) == len(envelope.recipients):
+            result = EnvelopeResult(refused)
+        elif final_reply[0] != 250:
+            result = EnvelopeResult(refused, final_reply, 'DATA')
+        else:
+            result = EnvelopeResult(refused)
+
+        self._needs_reset = bool(result.error or len(refused) == len(envelope.recipients))
+        if mail_reply[0] == 421 or final_reply[0] == 421:
+            raise smtplib.SMTPServerDisconnected(format_reply(final_reply if final_reply[0] == 421 else mail_reply))
+        return result
+
+    @staticmethod
+    def _dot_stuff(message: RenderedMessage) -> List:
+        """
+        Transparency-encode a message for DATA and append the end-of-data marker.
+
+        Only the ``bytes`` parts are rewritten; shared buffers are base64
+        attachment parts, which never have a line starting with a dot.
+        """
+        parts = [
+            re.sub(br'(?m)^\.', b'..', part) if isinstance(part, bytes) else part
+            for part in message_parts(message)
+        ]
+        if not bytes(parts[-1][-2:]) == b'\r\n':
+            parts.append(b'\r\n')
+        parts.append(b'.\r\n')
+        return parts
+
+
+class PipeliningSMTP(PipeliningMixin, smtplib.SMTP):
+    """Plain / STARTTLS SMTP connection with pipelined envelope delivery."""
+
+
+class PipeliningSMTP_SSL(PipeliningMixin, smtplib.SMTP_SSL):
+    """Implicit TLS SMTP connection with pipelined envelope delivery."""
+
+
+def open_connection(
+    host: str,
+    port: int,
+    security: str = 'tls',
+    username: Optional[str] = None,
+    password: Optional[str] = None,
+    timeouts: SMTPTimeouts = SMTPTimeouts(),
+    deadline: Optional[float] = None
+) -> PipeliningMixin:
+    """
+    Connect, secure and authenticate a new SMTP connection.
+
+    Args:
+        host: SMTP server host
+        port: SMTP server port
+        security: 'ssl' for implicit TLS, 'tls' for STARTTLS, 'none' for plain
+        username: Login name (no AUTH when empty)
+        password: Login password
+        timeouts: Socket timeouts; the connect one covers the whole handshake
+        deadline: time.monotonic() the handshake must finish by, if any
+
+    Returns:
+        Connected client; raises smtplib / socket errors on failure
+    """
+    timeout = timeouts.connect
+    if deadline is not None:
+        timeout = min(timeout, deadline - time.monotonic())
+        if timeout <= 0:
+            raise socket.timeout('Send deadline exceeded')
+    if security == 'ssl':
+        server = PipeliningSMTP_SSL(host, port, context=ssl.create_default_context(), timeout=timeout)
+    else:
+        server = PipeliningSMTP(host, port, timeout=timeout)
+        if security == 'tls':
+            server.starttls(context=ssl.create_default_context())
+
+    try:
+        # Pipelined writes are already coalesced; don't let Nagle hold back the tail
+        server.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if username and password:
+            server.login(username, password)
+        server.ehlo_or_helo_if_needed()
+    except Exception:
+        server.close()
+        raise
+    server.timeouts = timeouts
+    server.set_phase_timeout(timeouts.command)
+    return server
+
+
+class ConnectionPool:
+    """Idle authenticated SMTP connections, reused across sends."""
+
+    def __init__(self, max_idle: int = POOL_MAX_IDLE, idle_timeout: float = POOL_IDLE_TIMEOUT):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self._idle: Dict[tuple, List[Tuple[float, PipeliningMixin]]] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key: tuple, factory: Callable[[], PipeliningMixin]) -> PipeliningMixin:
+        """
+        Get a live connection for ``key``, opening one with ``factory`` if needed.
+
+        Connections idle for longer than POOL_PROBE_AFTER seconds are checked
+        with NOOP first; expired or dead ones are closed.
+        """
+        while True:
+            with self._lock:
+                entries = self._idle.get(key)
+                if not entries:
+                    break
+                released_at, server = entries.pop()
+
+            idle_for = time.monotonic() - released_at
+            if idle_for > self.idle_timeout:
+                self._quit(server)
+                continue
+            if idle_for <= POOL_PROBE_AFTER or self._is_alive(server):
+                return server
+            self._quit(server)
+
+        return factory()
+
+    def release(self, key: tuple, server: PipeliningMixin):
+        """Return a connection to the pool (closed connections are dropped)."""
+        if server.sock is None:
+            return
+        with self._lock:
+            entries = self._idle.setdefault(key, [])
+            if len(entries) < self.max_idle:
+                entries.append((time.monotonic(), server))
+                return
+        self._quit(server)
+
+    def close_all(self):
+        """Quit every idle connection."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for entries in idle.values():
+            for _, server in entries:
+                self._quit(server)
+
+    @staticmethod
+    def _is_alive(server: PipeliningMixin) -> bool:
+        try:
+            return server.noop()[0] == 250
+        except Exception:
+            return False
+
+    @staticmethod
+    def _quit(server: PipeliningMixin):
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+
+connection_pool = ConnectionPool()
+atexit.register(connection_pool.close_all)
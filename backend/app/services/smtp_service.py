@@ -1,15 +1,17 @@
-import smtplib
-import ssl
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email import encoders
 from datetime import datetime
 import logging
-from typing import Optional, List, Tuple, Union
+from typing import Optional, List, Sequence, Tuple
+from app.services.circuit_breaker import breaker_for_account
+from app.services.dkim_signer import DKIMSigner
+from app.services.message_template import MessageTemplate, RenderedMessage
+from app.services.smtp_client import Envelope, EnvelopeResult, failed_result, format_reply
+from app.services.transports import SMTPTransport, create_transport
 
 logger = logging.getLogger(__name__)
 
+# RCPT TO commands per transaction when every recipient gets the same message
+DEFAULT_MAX_RECIPIENTS_PER_MESSAGE = 50
+
 class SMTPService:
     """Service for handling SMTP email sending operations."""
     
@@ -21,67 +23,35 @@ class SMTPService:
             raise ValueError("SMTP Service requires an SMTPAccount instance")
         
         self.config = smtp_account
-        self.server = None
+        # Delivery backend configured on the account (SMTP, file sink or HTTP API)
+        self.transport = create_transport(smtp_account)
+        self.dkim_key = DKIMSigner.key_for_account(smtp_account)
+        # Fails connections fast while the account's server keeps failing them
+        self.breaker = breaker_for_account(smtp_account.id)
+        # Bytes written to the transport by this service instance
+        self.bytes_sent = 0
     
     def connect(self) -> Tuple[bool, str]:
-        """Establish SMTP connection."""
-        try:
-            # Create SMTP connection based on encryption type
-            if self.config.encryption == 'ssl':
-                context = ssl.create_default_context()
-                self.server = smtplib.SMTP_SSL(
-                    self.config.host, 
-                    self.config.port,
-                    context=context
-                )
-            else:
-                self.server = smtplib.SMTP(self.config.host, self.config.port)
-                
-                # Enable security if using TLS
-                if self.config.encryption == 'tls':
-                    context = ssl.create_default_context()
-                    self.server.starttls(context=context)
-            
-            # Authenticate with the server
-            password = self.config.password
-            if not password:
-                return False, "No password configured"
-            
-            self.server.login(self.config.username, password)
-            
-            logger.info(f"SMTP connection established to {self.config.host}:{self.config.port}")
-            return True, "Connected successfully"
-            
-        except smtplib.SMTPAuthenticationError as e:
-            error_msg = f"Authentication failed: {str(e)}"
-            logger.error(error_msg)
-            return False, error_msg
-            
-        except smtplib.SMTPConnectError as e:
-            error_msg = f"Connection failed: {str(e)}"
-            logger.error(error_msg)
-            return False, error_msg
-            
-        except smtplib.SMTPServerDisconnected as e:
-            error_msg = f"Server disconnected: {str(e)}"
-            logger.error(error_msg)
-            return False, error_msg
-            
-        except Exception as e:
-            error_msg = f"Unexpected error: {str(e)}"
-            logger.error(error_msg)
-            return False, error_msg
+        """
+        Open the account's transport (for SMTP, take a pooled connection).
+        
+        Refused without connecting while the account's circuit breaker is open.
+        """
+        if isinstance(self.transport, SMTPTransport) and not self.config.password:
+            return False, "No password configured"
+        if not self.breaker.allow():
+            return False, self.breaker.refusal()
+        
+        connected, message = self.transport.open()
+        if connected:
+            self.breaker.record_connect()
+        else:
+            self.breaker.record_failure(message)
+        return connected, message
     
     def disconnect(self):
-        """Close SMTP connection."""
-        if self.server:
-            try:
-                self.server.quit()
-                logger.info("SMTP connection closed")
-            except Exception as e:
-                logger.warning(f"Error closing SMTP connection: {e}")
-            finally:
-                self.server = None
+        """Close the transport (for SMTP, return the connection to the pool)."""
+        self.transport.close()
     
     def send_email(
         self,
@@ -89,7 +59,8 @@ class SMTPService:
         subject: str,
         html_content: Optional[str] = None,
         text_content: Optional[str] = None,
-        attachments: Optional[List[dict]] = None
+        attachments: Optional[List[dict]] = None,
+        encoded_attachments: Optional[Sequence] = None
     ) -> Tuple[bool, str]:
         """
         Send a single email.
@@ -100,6 +71,7 @@ class SMTPService:
             html_content: HTML email content (optional)
             text_content: Plain text email content (optional)
             attachments: List of attachment dicts with 'filename' and 'content' keys
+            encoded_attachments: Pre-encoded MIME attachment parts (see AttachmentCache)
             
         Returns:
             Tuple of (success: bool, message: str)
@@ -115,69 +87,125 @@ class SMTPService:
             if not html_content and not text_content:
                 return False, "Email content (HTML or text) is required"
             
-            # Create message
-            msg = MIMEMultipart('alternative')
-            msg['From'] = f"{self.config.sender_name} <{self.config.sender_email}>" if self.config.sender_name else self.config.sender_email
-            msg['To'] = to_email
-            msg['Subject'] = subject
-            
-            # Add Reply-To if available (only SMTPConfig has this)
-            if hasattr(self.config, 'reply_to') and self.config.reply_to:
-                msg['Reply-To'] = self.config.reply_to
+            # Build the message from a one-off template
+            template = self.build_template(
+                subject=subject,
+                html_content=html_content,
+                text_content=text_content,
+                attachments=attachments,
+                encoded_attachments=encoded_attachments
+            )
             
-            # Add message ID for tracking
-            import uuid
-            msg['Message-ID'] = f"<{uuid.uuid4()}@{self.config.sender_email.split('@')[1]}>"
+            return self.send_raw(to_email, template.render(to_email), template.mail_options)
             
-            # Add content
-            if text_content:
-                text_part = MIMEText(text_content, 'plain', 'utf-8')
-                msg.attach(text_part)
-            
-            if html_content:
-                html_part = MIMEText(html_content, 'html', 'utf-8')
-                msg.attach(html_part)
-            
-            # Add attachments if provided
-            if attachments:
-                for attachment in attachments:
-                    try:
-                        part = MIMEBase('application', 'octet-stream')
-                        part.set_payload(attachment['content'])
-                        encoders.encode_base64(part)
-                        part.add_header(
-                            'Content-Disposition',
-                            f'attachment; filename= {attachment["filename"]}'
-                        )
-                        msg.attach(part)
-                    except Exception as e:
-                        logger.warning(f"Failed to attach file {attachment.get('filename')}: {e}")
-            
-            # Send email
-            if not self.server:
-                connected, error = self.connect()
-                if not connected:
-                    return False, f"Connection failed: {error}"
-            
-            self.server.send_message(msg)
-            
-            logger.info(f"Email sent successfully to {to_email}")
-            return True, "Email sent successfully"
-            
-        except smtplib.SMTPRecipientsRefused as e:
-            error_msg = f"Recipient refused: {str(e)}"
+        except Exception as e:
+            error_msg = f"Failed to send email: {str(e)}"
             logger.error(error_msg)
             return False, error_msg
+    
+    def build_template(
+        self,
+        subject: str,
+        html_content: Optional[str] = None,
+        text_content: Optional[str] = None,
+        attachments: Optional[List[dict]] = None,
+        encoded_attachments: Optional[Sequence] = None
+    ) -> MessageTemplate:
+        """
+        Build a message template addressed from this SMTP account.
+        
+        Connects first so that 8bit bodies are used when the transport allows them.
+        """
+        if not self.transport.is_open:
+            self.connect()
+        
+        return MessageTemplate(
+            from_email=self.config.from_email,
+            from_name=self.config.from_name,
+            reply_to=self.config.reply_to_email,
+            subject=subject,
+            html_content=html_content,
+            text_content=text_content,
+            attachments=attachments,
+            encoded_attachments=encoded_attachments,
+            allow_8bit=self.transport.supports_8bitmime
+        )
+    
+    def send_raw(self, to_email: str, message: RenderedMessage, mail_options: Sequence[str] = ()) -> Tuple[bool, str]:
+        """
+        Send a pre-serialized message.
+        
+        Args:
+            to_email: Envelope recipient
+            message: Complete message bytes (see MessageTemplate.render)
+            mail_options: MAIL FROM parameters (see MessageTemplate.mail_options)
             
-        except smtplib.SMTPDataError as e:
-            error_msg = f"SMTP data error: {str(e)}"
+        Returns:
+            Tuple of (success: bool, message: str)
+        """
+        result = self.send_envelopes([Envelope(self.config.from_email, [to_email], message)], mail_options)[0]
+        error_msg = result.recipient_error(to_email)
+        if error_msg:
             logger.error(error_msg)
             return False, error_msg
+        
+        logger.info(f"Email sent successfully to {to_email}")
+        return True, "Email sent successfully"
+    
+    def sign_envelopes(self, envelopes: List[Envelope]) -> List[Envelope]:
+        """
+        DKIM-sign the messages of envelopes with the account's key.
+        
+        Returns the envelopes unchanged when the account has no key; raises
+        if signing fails.
+        """
+        if not self.dkim_key:
+            return envelopes
+        signed = DKIMSigner.sign_messages(self.dkim_key, [e.message for e in envelopes])
+        return [envelope._replace(message=message) for envelope, message in zip(envelopes, signed)]
+    
+    def send_envelopes(
+        self,
+        envelopes: List[Envelope],
+        mail_options: Sequence[str] = (),
+        sign: bool = True
+    ) -> List[EnvelopeResult]:
+        """
+        Deliver envelopes through the account's transport.
+        
+        Args:
+            envelopes: Transactions to run, in order
+            mail_options: MAIL FROM parameters (see MessageTemplate.mail_options)
+            sign: DKIM-sign the messages first (False if already signed)
             
-        except Exception as e:
-            error_msg = f"Failed to send email: {str(e)}"
-            logger.error(error_msg)
-            return False, error_msg
+        Returns:
+            One result per envelope in input order
+        """
+        if not self.transport.is_open:
+            connected, error = self.connect()
+            if not connected:
+                return [failed_result(error, 'connect') for _ in envelopes]
+        
+        if sign:
+            try:
+                envelopes = self.sign_envelopes(envelopes)
+            except Exception as e:
+                logger.error(f"DKIM signing failed: {e}")
+                return [failed_result(str(e), 'sign') for _ in envelopes]
+        
+        bytes_before = self.transport.bytes_sent
+        try:
+            verdicts = self.transport.send_envelopes(envelopes, mail_options)
+        finally:
+            self.bytes_sent += self.transport.bytes_sent - bytes_before
+        
+        # A lost connection counts towards the breaker; a delivery closes it
+        lost = next((v for v in verdicts if v.error and v.stage == 'connection'), None)
+        if lost is not None:
+            self.breaker.record_failure(format_reply(lost.error))
+        elif any(not v.error for v in verdicts):
+            self.breaker.record_success()
+        return verdicts
     
     def send_test_email(self, test_email: str) -> Tuple[bool, str]:
         """Send a test email to verify SMTP configuration."""
@@ -204,7 +232,7 @@ class SMTPService:
             host=self.config.host,
             port=self.config.port,
             encryption=self.config.encryption.upper(),
-            sender_email=self.config.sender_email,
+            sender_email=self.config.from_email,
             timestamp=datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S UTC")
         )
         
@@ -217,7 +245,7 @@ Configuration Details:
 - Provider: {self.config.provider}
 - Host: {self.config.host}:{self.config.port}
 - Encryption: {self.config.encryption.upper()}
-- Sender: {self.config.sender_email}
+- Sender: {self.config.from_email}
 
 If you received this email, your SMTP configuration is working correctly!
 
@@ -231,115 +259,6 @@ Sent at: {datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S UTC")}
             text_content=text_content
         )
     
-    def bulk_send_emails(
-        self,
-        recipients: List[dict],
-        subject: str,
-        html_template: Optional[str] = None,
-        text_template: Optional[str] = None,
-        batch_size: int = 10
-    ) -> List[dict]:
-        """
-        Send emails to multiple recipients.
-        
-        Args:
-            recipients: List of dicts with 'email' and optionally other fields for personalization
-            subject: Email subject (can include placeholders like {first_name})
-            html_template: HTML email template (can include placeholders)
-            text_template: Text email template (can include placeholders)
-            batch_size: Number of emails to send before reconnecting
-            
-        Returns:
-            List of results for each recipient
-        """
-        results = []
-        sent_count = 0
-        
-        try:
-            # Connect once for the batch
-            connected, error = self.connect()
-            if not connected:
-                return [{'email': r.get('email', 'unknown'), 'success': False, 'error': error} for r in recipients]
-            
-            for i, recipient in enumerate(recipients):
-                try:
-                    email = recipient.get('email')
-                    if not email:
-                        results.append({
-                            'email': 'unknown',
-                            'success': False,
-                            'error': 'No email address provided'
-                        })
-                        continue
-                    
-                    # Personalize subject and content
-                    personalized_subject = self._personalize_content(subject, recipient)
-                    personalized_html = self._personalize_content(html_template, recipient) if html_template else None
-                    personalized_text = self._personalize_content(text_template, recipient) if text_template else None
-                    
-                    # Send email
-                    success, message = self.send_email(
-                        to_email=email,
-                        subject=personalized_subject,
-                        html_content=personalized_html,
-                        text_content=personalized_text
-                    )
-                    
-                    results.append({
-                        'email': email,
-                        'success': success,
-                        'error': None if success else message
-                    })
-                    
-                    if success:
-                        sent_count += 1
-                    
-                    # Reconnect after batch_size emails to avoid timeout
-                    if (i + 1) % batch_size == 0 and (i + 1) < len(recipients):
-                        self.disconnect()
-                        connected, error = self.connect()
-                        if not connected:
-                            # Mark remaining emails as failed
-                            for j in range(i + 1, len(recipients)):
-                                results.append({
-                                    'email': recipients[j].get('email', 'unknown'),
-                                    'success': False,
-                                    'error': f'Connection lost: {error}'
-                                })
-                            break
-                
-                except Exception as e:
-                    results.append({
-                        'email': recipient.get('email', 'unknown'),
-                        'success': False,
-                        'error': str(e)
-                    })
-            
-        finally:
-            self.disconnect()
-        
-        logger.info(f"Bulk send completed: {sent_count}/{len(recipients)} emails sent successfully")
-        return results
-    
-    def _personalize_content(self, template: str, data: dict) -> str:
-        """Personalize email content with recipient data."""
-        if not template:
-            return template
-        
-        try:
-            # Simple template substitution
-            # In production, consider using Jinja2 for more advanced templating
-            for key, value in data.items():
-                placeholder = f"{{{key}}}"
-                if placeholder in template:
-                    template = template.replace(placeholder, str(value) if value else "")
-            
-            return template
-            
-        except Exception as e:
-            logger.warning(f"Error personalizing content: {e}")
-            return template
-    
     def __enter__(self):
         """Context manager entry."""
         return self
@@ -0,0 +1,206 @@
+"""
+Suppression List
+
+Addresses that must not be mailed again: hard bounces (suppressed for every
+user, since the mailbox does not exist), and spam complaints and unsubscribes
+(suppressed for the user whose recipient complained or unsubscribed).
+
+A send loads its user's suppressions once into an in-memory dict and checks
+every recipient batch against it, so the check costs one hash lookup per
+recipient. Bounce, complaint and unsubscribe events are added in bulk and
+also update the matching contacts' status. Only a server's verdict on the
+address itself suppresses it: a refused recipient, or a rejected message
+that had no other recipient - never a failure to connect, log in, sign or
+write.
+"""
+
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from sqlalchemy import or_
+from app import db
+from app.models.campaign import CampaignRecipient
+from app.models.contact import Contact, ContactStatus
+from app.models.email_log import BounceType
+from app.models.suppression import Suppression, SuppressionReason
+from app.services.bounce_classifier import BounceVerdict
+from app.services.send_records import Recipient
+from app.utils.helpers import chunked
+
+logger = logging.getLogger(__name__)
+
+# Addresses looked up / inserted per query when adding suppressions
+ADD_BATCH_SIZE = 500
+
+# Delivery stages whose failure can be blamed on the recipient's address (DATA only if it was alone)
+ADDRESS_STAGES = ('RCPT', 'DATA')
+
+# Reasons suppressed for every user
+GLOBAL_REASONS = (SuppressionReason.HARD_BOUNCE,)
+
+# Contact status set by each reason
+CONTACT_STATUS = {
+    SuppressionReason.HARD_BOUNCE: ContactStatus.BOUNCED,
+    SuppressionReason.COMPLAINT: ContactStatus.SPAM_COMPLAINT,
+    SuppressionReason.UNSUBSCRIBE: ContactStatus.UNSUBSCRIBED
+}
+
+
+class SuppressionEntry(NamedTuple):
+    """An address to suppress."""
+    user_id: Optional[int]
+    email: str
+    reason: SuppressionReason
+    detail: Optional[str] = None
+
+
+class SuppressionList:
+    """Loading, checking and updating suppressed addresses."""
+
+    @staticmethod
+    def load(user_id: int, emails: Optional[Iterable[str]] = None) -> Dict[str, SuppressionReason]:
+        """
+        Suppressed addresses that apply to a user's sends.
+
+        Args:
+            user_id: User whose sends are checked
+            emails: Only look these addresses up (all of them when omitted)
+
+        Returns:
+            Dict of lower-cased email address to suppression reason
+        """
+        rows = db.session.query(Suppression.email, Suppression.reason).filter(
+            or_(Suppression.user_id.is_(None), Suppression.user_id == user_id)
+        )
+        if emails is not None:
+            rows = rows.filter(Suppression.email.in_({email.lower() for email in emails}))
+        suppressed = {email: reason for email, reason in rows}
+        if suppressed:
+            logger.info(f"Loaded {len(suppressed)} suppressed addresses for user {user_id}")
+        return suppressed
+
+    @staticmethod
+    def reason_for(verdict: BounceVerdict, stage: Optional[str], shared: bool = False) -> Optional[SuppressionReason]:
+        """
+        Suppression a classified delivery failure calls for, if any.
+
+        Args:
+            verdict: Classified failure
+            stage: Delivery stage that failed (see smtp_client.STAGE_LABELS)
+            shared: Whether the failed envelope also addressed other recipients
+        """
+        if stage not in ADDRESS_STAGES or (stage == 'DATA' and shared):
+            # The failure says nothing about this address alone
+            return None
+        if verdict.bounce_type == BounceType.COMPLAINT:
+            return SuppressionReason.COMPLAINT
+        if verdict.suppress:
+            return SuppressionReason.HARD_BOUNCE
+        return None
+
+    @staticmethod
+    def skip_suppressed(campaign_id: int, recipients: List[Recipient],
+                        suppressed: Dict[str, SuppressionReason]) -> Tuple[List[Recipient], int]:
+        """
+        Drop suppressed recipients from a batch.
+
+        Their send ledger entries are recorded as failed, so they are not
+        picked up again by a resume.
+
+        Returns:
+            Tuple of (sendable recipients, number suppressed)
+        """
+        if not suppressed:
+            return recipients, 0
+        sendable = []
+        ledger = []
+        for recipient in recipients:
+            reason = suppressed.get((recipient.email or '').lower())
+            if reason is None:
+                sendable.append(recipient)
+            else:
+                ledger.append({
+                    'id': recipient.recipient_id,
+                    'email_failed': True,
+                    'error_message': f"Suppressed ({reason.value.replace('_', ' ')})"
+                })
+        if ledger:
+            db.session.bulk_update_mappings(CampaignRecipient, ledger)
+            db.session.commit()
+        return sendable, len(ledger)
+
+    @staticmethod
+    def add(entries: Iterable[SuppressionEntry], campaign_id: Optional[int] = None) -> int:
+        """
+        Suppress addresses and update the matching contacts, then commit.
+
+        Addresses already suppressed in the same scope are left as they are.
+
+        Args:
+            entries: Addresses to suppress; the user is ignored for global reasons
+            campaign_id: Campaign the events came from, if any
+
+        Returns:
+            Number of new suppressions
+        """
+        # One entry per (scope, address); global reasons have no user
+        pending: Dict[Tuple[Optional[int], str], SuppressionEntry] = {}
+        for entry in entries:
+            email = (entry.email or '').strip().lower()
+            if '@' not in email:
+                continue
+            user_id = None if entry.reason in GLOBAL_REASONS else entry.user_id
+            pending.setdefault((user_id, email), entry._replace(user_id=user_id, email=email))
+        if not pending:
+            return 0
+
+        added = 0
+        now = datetime.utcnow()
+        for window in chunked(list(pending.values()), ADD_BATCH_SIZE):
+            existing = set(db.session.query(Suppression.user_id, Suppression.email).filter(
+                Suppression.email.in_({entry.email for entry in window})
+            ))
+            new = [entry for entry in window if (entry.user_id, entry.email) not in existing]
+            if new:
+                db.session.bulk_insert_mappings(Suppression, [
+                    {
+                        'user_id': entry.user_id,
+                        'email': entry.email,
+                        'reason': entry.reason,
+                        'campaign_id': campaign_id,
+                        'detail': entry.detail,
+                        'created_at': now
+                    }
+                    for entry in new
+                ])
+                added += len(new)
+            SuppressionList._update_contacts(window, now)
+        db.session.commit()
+
+        if added:
+            logger.info(f"Suppressed {added} new addresses" + (f" from campaign {campaign_id}" if campaign_id else ""))
+        return added
+
+    @staticmethod
+    def _update_contacts(entries: List[SuppressionEntry], now: datetime):
+        """Set the status of the contacts behind suppressed addresses."""
+        by_scope: Dict[Tuple[Optional[int], SuppressionReason], List[str]] = {}
+        for entry in entries:
+            by_scope.setdefault((entry.user_id, entry.reason), []).append(entry.email)
+
+        for (user_id, reason), emails in by_scope.items():
+            query = Contact.query.filter(Contact.email.in_(emails), Contact.status == ContactStatus.ACTIVE)
+            if user_id is not None:
+                query = query.filter(Contact.user_id == user_id)
+            if reason == SuppressionReason.HARD_BOUNCE:
+                values = {
+                    Contact.status: ContactStatus.BOUNCED,
+                    Contact.total_emails_bounced: db.func.coalesce(Contact.total_emails_bounced, 0) + 1
+                }
+            else:
+                values = {
+                    Contact.status: CONTACT_STATUS[reason],
+                    Contact.subscribed: False,
+                    Contact.unsubscribed_at: now
+                }
+            query.update(values, synchronize_session=False)
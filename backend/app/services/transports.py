@@ -0,0 +1,508 @@
+"""
+Delivery Transports
+
+A transport takes envelopes (sender, recipients, rendered message) and
+reports one EnvelopeResult per envelope. SMTPService and the send pipeline
+only talk to this interface; the backend is chosen per SMTP account:
+
+- ``smtp``: pooled, pipelined SMTP connections (the default)
+- ``maildir`` / ``mbox``: local file sinks, for staging and testing
+- ``http``: a batch-send HTTP API that accepts many messages per request
+
+HTTP batch API contract: ``POST <transport_url>`` with a bearer token (the
+account password) and a JSON body ``{"messages": [{"from": ..., "to": [...],
+"raw": <base64 message>}]}``. The response is ``{"results": [...]}`` with
+one entry per message, in order, each ``{"error": null | "reason",
+"rejected": {"address": "reason"}}``.
+"""
+
+import base64
+import fcntl
+import http.client
+import json
+import logging
+import os
+import smtplib
+import socket
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+from flask import current_app, has_app_context
+from app.services.message_template import message_parts
+from app.services.smtp_client import (
+    DEFAULT_COMMAND_TIMEOUT, DEFAULT_CONNECT_TIMEOUT, DEFAULT_DATA_TIMEOUT, DEFAULT_PIPELINE_DEPTH, Envelope,
+    EnvelopeResult, PipeliningMixin, SMTPTimeouts, connection_pool, failed_result, is_timeout, open_connection
+)
+
+logger = logging.getLogger(__name__)
+
+# Messages per request to an HTTP batch API, and the raw bytes cap per request
+HTTP_BATCH_SIZE = 100
+HTTP_BATCH_MAX_BYTES = 20 * 1024 * 1024
+
+# Seconds to wait for an HTTP batch API response
+HTTP_TIMEOUT = 60
+
+# Envelopes written per batch by the file sinks
+FILE_BATCH_SIZE = 500
+
+TRANSPORT_TYPES = ('smtp', 'maildir', 'mbox', 'http')
+
+
+class Transport:
+    """Base class for delivery backends."""
+
+    name = 'base'
+    # Envelopes handed to send_envelopes() at a time
+    batch_size = DEFAULT_PIPELINE_DEPTH
+    # Whether 8bit bodies can be delivered as-is
+    supports_8bitmime = False
+
+    def __init__(self):
+        # Bytes written to the backend by this transport instance
+        self.bytes_sent = 0
+        # Operations of this transport instance that timed out
+        self.timed_out = 0
+        # time.monotonic() by which deliveries must be done (None = no deadline)
+        self.deadline: Optional[float] = None
+
+    @property
+    def is_open(self) -> bool:
+        return True
+
+    def open(self) -> Tuple[bool, str]:
+        """Prepare the backend for delivery."""
+        return True, "Ready"
+
+    def send_envelopes(self, envelopes: List[Envelope], mail_options: Sequence[str] = ()) -> List[EnvelopeResult]:
+        """
+        Deliver envelopes.
+
+        Args:
+            envelopes: Transactions to run, in order
+            mail_options: MAIL FROM parameters (SMTP only)
+
+        Returns:
+            One result per envelope in input order
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Release backend resources."""
+
+
+class SMTPTransport(Transport):
+    """Delivery over pooled, pipelined SMTP connections."""
+
+    name = 'smtp'
+
+    def __init__(self, host: str, port: int, security: str = 'tls',
+                 username: Optional[str] = None, password: Optional[str] = None,
+                 timeouts: Optional[SMTPTimeouts] = None):
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.security = security
+        self.username = username
+        self.password = password
+        self.timeouts = timeouts or SMTPTimeouts()
+        self.server: Optional[PipeliningMixin] = None
+        self._pool_key = (host, port, security, username, password)
+
+    @property
+    def is_open(self) -> bool:
+        return self.server is not None
+
+    @property
+    def supports_8bitmime(self) -> bool:
+        return bool(self.server and self.server.supports_8bitmime)
+
+    def open(self) -> Tuple[bool, str]:
+        """Take an authenticated connection from the pool (or open one)."""
+        if self.server:
+            return True, "Connected successfully"
+        try:
+            self.server = connection_pool.acquire(
+                self._pool_key,
+                lambda: open_connection(self.host, self.port, self.security, self.username, self.password,
+                                        self.timeouts, self.deadline)
+            )
+            # Pooled connections may come from a transport with other timeouts
+            self.server.timeouts = self.timeouts
+
+            logger.info(f"SMTP connection established to {self.host}:{self.port}")
+            return True, "Connected successfully"
+
+        except socket.timeout as e:
+            return self._timed_out(e)
+
+        except smtplib.SMTPAuthenticationError as e:
+            error_msg = f"Authentication failed: {str(e)}"
+            logger.error(error_msg)
+            return False, error_msg
+
+        except smtplib.SMTPConnectError as e:
+            error_msg = f"Connection failed: {str(e)}"
+            logger.error(error_msg)
+            return False, error_msg
+
+        except smtplib.SMTPServerDisconnected as e:
+            if is_timeout(e):
+                return self._timed_out(e)
+            error_msg = f"Server disconnected: {str(e)}"
+            logger.error(error_msg)
+            return False, error_msg
+
+        except Exception as e:
+            error_msg = f"Unexpected error: {str(e)}"
+            logger.error(error_msg)
+            return False, error_msg
+
+    def send_envelopes(self, envelopes: List[Envelope], mail_options: Sequence[str] = ()) -> List[EnvelopeResult]:
+        if not self.server:
+            connected, error = self.open()
+            if not connected:
+                return [failed_result(error, 'connect') for _ in envelopes]
+
+        bytes_before = self.server.bytes_sent
+        timed_out_before = self.server.timed_out
+        self.server.deadline = self.deadline
+        try:
+            return self.server.send_envelopes(envelopes, mail_options)
+        except Exception as e:
+            logger.error(f"Failed to send email: {e}")
+            self.server.close()
+            return [failed_result(str(e), 'connection') for _ in envelopes]
+        finally:
+            self.bytes_sent += self.server.bytes_sent - bytes_before
+            self.timed_out += self.server.timed_out - timed_out_before
+            self.server.deadline = None
+            # A dropped connection is not returned to the pool
+            if self.server.sock is None:
+                self.server = None
+
+    def _timed_out(self, error: Exception) -> Tuple[bool, str]:
+        self.timed_out += 1
+        error_msg = f"Connection timed out: {str(error) or 'no response'}"
+        logger.error(error_msg)
+        return False, error_msg
+
+    def close(self):
+        """Return the SMTP connection to the pool."""
+        if self.server:
+            try:
+                connection_pool.release(self._pool_key, self.server)
+            except Exception as e:
+                logger.warning(f"Error releasing SMTP connection: {e}")
+            finally:
+                self.server = None
+
+
+class FileTransport(Transport):
+    """Base for local sinks that store each envelope's message in a file."""
+
+    batch_size = FILE_BATCH_SIZE
+    supports_8bitmime = True
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self._ready = False
+
+    @property
+    def is_open(self) -> bool:
+        return self._ready
+
+    def open(self) -> Tuple[bool, str]:
+        try:
+            self._prepare()
+            self._ready = True
+            return True, f"Writing to {self.path}"
+        except OSError as e:
+            return False, f"Cannot prepare {self.path}: {str(e)}"
+
+    def close(self):
+        self._ready = False
+
+    def send_envelopes(self, envelopes: List[Envelope], mail_options: Sequence[str] = ()) -> List[EnvelopeResult]:
+        results = []
+        for envelope in envelopes:
+            try:
+                self.bytes_sent += self._store(envelope)
+                results.append(EnvelopeResult({}))
+            except OSError as e:
+                logger.error(f"Failed to write message to {self.path}: {e}")
+                results.append(failed_result(str(e), 'write'))
+        return results
+
+    @staticmethod
+    def _trace_headers(envelope: Envelope) -> bytes:
+        """Envelope data an MTA would record on delivery."""
+        return (
+            f"Return-Path: <{envelope.sender}>\r\n"
+            f"X-Envelope-To: {', '.join(envelope.recipients)}\r\n"
+        ).encode('utf-8')
+
+    def _prepare(self):
+        """Create the sink's directories."""
+        raise NotImplementedError
+
+    def _store(self, envelope: Envelope) -> int:
+        raise NotImplementedError
+
+
+class MaildirTransport(FileTransport):
+    """Sink that delivers into a Maildir (tmp/ then rename into new/)."""
+
+    name = 'maildir'
+
+    _counter = 0
+    _counter_lock = threading.Lock()
+
+    def _prepare(self):
+        for subdir in ('tmp', 'new', 'cur'):
+            os.makedirs(os.path.join(self.path, subdir), exist_ok=True)
+
+    def _store(self, envelope: Envelope) -> int:
+        with MaildirTransport._counter_lock:
+            MaildirTransport._counter += 1
+            sequence = MaildirTransport._counter
+        name = f"{time.time():.6f}.P{os.getpid()}Q{sequence}.{socket.gethostname()}"
+        tmp_path = os.path.join(self.path, 'tmp', name)
+
+        size = 0
+        with open(tmp_path, 'wb') as f:
+            for part in (self._trace_headers(envelope),) + tuple(message_parts(envelope.message)):
+                size += f.write(part)
+        os.replace(tmp_path, os.path.join(self.path, 'new', name))
+        return size
+
+
+class MboxTransport(FileTransport):
+    """Sink that appends to an mbox file (mboxrd quoting, LF line endings)."""
+
+    name = 'mbox'
+
+    _lock = threading.Lock()
+
+    def _prepare(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+    def _store(self, envelope: Envelope) -> int:
+        message = (self._trace_headers(envelope) + bytes(b''.join(message_parts(envelope.message))))
+        lines = message.replace(b'\r\n', b'\n').split(b'\n')
+        if lines and lines[-1] == b'':
+            lines.pop()
+        body = b'\n'.join(b'>' + line if line.lstrip(b'>').startswith(b'From ') else line for line in lines)
+        entry = f"From {envelope.sender or 'MAILER-DAEMON'} {time.asctime(time.gmtime())}\n".encode() + body + b'\n\n'
+
+        with MboxTransport._lock, open(self.path, 'ab') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.write(entry)
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return len(entry)
+
+
+class HTTPBatchTransport(Transport):
+    """Delivery through a batch-send HTTP API over one keep-alive connection."""
+
+    name = 'http'
+    batch_size = HTTP_BATCH_SIZE
+    # Messages travel base64-encoded, so any body encoding is fine
+    supports_8bitmime = True
+
+    def __init__(self, url: str, api_key: Optional[str] = None,
+                 batch_size: int = HTTP_BATCH_SIZE, timeout: float = HTTP_TIMEOUT):
+        super().__init__()
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise ValueError(f"Invalid HTTP transport URL: {url}")
+        self.url = url
+        self.api_key = api_key
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self._scheme = parts.scheme
+        self._host = parts.hostname
+        self._port = parts.port
+        self._path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+        self._connection: Optional[http.client.HTTPConnection] = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._connection is not None
+
+    def open(self) -> Tuple[bool, str]:
+        try:
+            self._connect()
+            return True, f"Connected to {self._host}"
+        except (OSError, http.client.HTTPException) as e:
+            self._drop()
+            return False, f"Connection failed: {str(e)}"
+
+    def send_envelopes(self, envelopes: List[Envelope], mail_options: Sequence[str] = ()) -> List[EnvelopeResult]:
+        results = []
+        for chunk in self._chunks(envelopes):
+            results.extend(self._post(chunk))
+        return results
+
+    def close(self):
+        self._drop()
+
+    def _chunks(self, envelopes: List[Envelope]) -> Iterator[List[Envelope]]:
+        """Split envelopes by message count and raw size per request."""
+        chunk, size = [], 0
+        for envelope in envelopes:
+            length = len(envelope.message)
+            if chunk and (len(chunk) >= self.batch_size or size + length > HTTP_BATCH_MAX_BYTES):
+                yield chunk
+                chunk, size = [], 0
+            chunk.append(envelope)
+            size += length
+        if chunk:
+            yield chunk
+
+    def _post(self, envelopes: List[Envelope]) -> List[EnvelopeResult]:
+        body = json.dumps({
+            'messages': [
+                {
+                    'from': envelope.sender,
+                    'to': list(envelope.recipients),
+                    'raw': base64.b64encode(b''.join(message_parts(envelope.message))).decode('ascii')
+                }
+                for envelope in envelopes
+            ]
+        }).encode('utf-8')
+        headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
+        if self.api_key:
+            headers['Authorization'] = f'Bearer {self.api_key}'
+
+        try:
+            status, data = self._request(body, headers)
+        except (OSError, http.client.HTTPException) as e:
+            if is_timeout(e):
+                self.timed_out += 1
+            logger.error(f"HTTP batch send to {self._host} failed: {e}")
+            self._drop()
+            return [failed_result(str(e), 'connection') for _ in envelopes]
+        self.bytes_sent += len(body)
+
+        if status >= 400:
+            error = (status, data[:500])
+            return [EnvelopeResult({}, error, 'api') for _ in envelopes]
+
+        try:
+            results = json.loads(data)['results']
+            if len(results) != len(envelopes):
+                raise ValueError(f"expected {len(envelopes)} results, got {len(results)}")
+        except (ValueError, KeyError, TypeError) as e:
+            return [failed_result(f"Invalid API response: {str(e)}", 'api') for _ in envelopes]
+
+        return [self._result(result) for result in results]
+
+    def _request(self, body: bytes, headers: Dict[str, str]) -> Tuple[int, bytes]:
+        """POST once; retry on a fresh connection if an idle keep-alive one was closed."""
+        reused = self._connection is not None
+        try:
+            connection = self._connect()
+            connection.request('POST', self._path, body, headers)
+            response = connection.getresponse()
+        except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+            self._drop()
+            if not reused:
+                raise
+            connection = self._connect()
+            connection.request('POST', self._path, body, headers)
+            response = connection.getresponse()
+
+        data = response.read()
+        if response.will_close:
+            self._drop()
+        return response.status, data
+
+    @staticmethod
+    def _result(result: Dict) -> EnvelopeResult:
+        refused = {
+            address: (550, str(reason).encode('utf-8'))
+            for address, reason in (result.get('rejected') or {}).items()
+        }
+        if result.get('error'):
+            return EnvelopeResult(refused, (0, str(result['error']).encode('utf-8')), 'api')
+        return EnvelopeResult(refused)
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self._connection is None:
+            connection_class = http.client.HTTPSConnection if self._scheme == 'https' else http.client.HTTPConnection
+            self._connection = connection_class(self._host, self._port, timeout=self.timeout)
+            self._connection.connect()
+        return self._connection
+
+    def _drop(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+def validate_transport(kind: str, transport_url: Optional[str]) -> Tuple[bool, str]:
+    """
+    Check a transport selection before it is saved on an account.
+
+    Returns:
+        Tuple of (valid: bool, message: str)
+    """
+    if kind not in TRANSPORT_TYPES:
+        return False, f"Unknown transport '{kind}'; expected one of: {', '.join(TRANSPORT_TYPES)}"
+    if kind == 'smtp':
+        return True, "Transport is valid"
+    if not transport_url:
+        return False, f"The {kind} transport requires transport_url"
+    if kind == 'http':
+        parts = urlsplit(transport_url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            return False, "transport_url must be an http(s) URL for the http transport"
+    return True, "Transport is valid"
+
+
+def transport_timeouts(smtp_account=None) -> SMTPTimeouts:
+    """
+    Timeouts for an SMTP account (or config), falling back to the
+    SMTP_CONNECT_TIMEOUT, SMTP_COMMAND_TIMEOUT and SMTP_DATA_TIMEOUT settings
+    (the settings alone when there is no account).
+    """
+    config = current_app.config if has_app_context() else {}
+    return SMTPTimeouts(
+        connect=getattr(smtp_account, 'connect_timeout', None) or config.get('SMTP_CONNECT_TIMEOUT', DEFAULT_CONNECT_TIMEOUT),
+        command=getattr(smtp_account, 'command_timeout', None) or config.get('SMTP_COMMAND_TIMEOUT', DEFAULT_COMMAND_TIMEOUT),
+        data=getattr(smtp_account, 'data_timeout', None) or config.get('SMTP_DATA_TIMEOUT', DEFAULT_DATA_TIMEOUT)
+    )
+
+
+def create_transport(smtp_account) -> Transport:
+    """
+    Build the delivery transport configured on an SMTP account.
+
+    Raises:
+        ValueError: If the transport type or its settings are invalid
+    """
+    kind = getattr(smtp_account, 'transport', None) or 'smtp'
+    if kind == 'smtp':
+        return SMTPTransport(
+            smtp_account.host,
+            smtp_account.port,
+            smtp_account.encryption,
+            smtp_account.username,
+            smtp_account.password,
+            timeouts=transport_timeouts(smtp_account)
+        )
+    if kind in ('maildir', 'mbox', 'http') and not smtp_account.transport_url:
+        raise ValueError(f"The {kind} transport requires a transport URL or path")
+    if kind == 'maildir':
+        return MaildirTransport(smtp_account.transport_url)
+    if kind == 'mbox':
+        return MboxTransport(smtp_account.transport_url)
+    if kind == 'http':
+        return HTTPBatchTransport(smtp_account.transport_url, api_key=smtp_account.password or None,
+                                  timeout=transport_timeouts(smtp_account).data)
+    raise ValueError(f"Unknown transport: {kind}")
@@ -2,7 +2,7 @@ import jwt
 import hashlib
 import secrets
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterable, Iterator, List
 from flask import current_app
 
 def generate_unsubscribe_token(contact_id: int, email: str) -> str:
@@ -242,4 +242,24 @@ def get_pagination_params(page: int = 1, per_page: int = 20, max_per_page: int =
         'per_page': per_page,
         'offset': offset,
         'limit': per_page
-    }
\ No newline at end of file
+    }
+
+def chunked(iterable: Iterable, size: int) -> Iterator[List]:
+    """
+    Split an iterable into lists of at most ``size`` items.
+    
+    Args:
+        iterable: Any iterable (list, set, generator)
+        size: Maximum number of items per chunk
+        
+    Returns:
+        Iterator over lists of items, preserving the input order
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -0,0 +1,117 @@
+"""
+Bounce classifier benchmark.
+
+Classifies the failure corpus (bounce_corpus.txt) with the bounce classifier
+and, for comparison, with the substring scan it replaced and with its text
+rules alone (case-insensitive, without reply code lookups). Reports throughput and how many
+messages got the expected category / bounce type / retry decision.
+
+Usage (from backend/):
+    python -m benchmarks.bounce_classifier_benchmark [--rounds N] [--rules rules.json]
+"""
+
+import argparse
+import os
+import re
+import time
+from typing import Callable, List, Optional, Tuple
+from app.models.email_log import BounceType
+from app.services.bounce_classifier import BounceClassifier, DEFAULT_RULES
+
+CORPUS = os.path.join(os.path.dirname(__file__), 'bounce_corpus.txt')
+
+# Failure texts with a 4xx reply, which is always temporary
+REPLY_CLASS_4 = re.compile(r'^(?:Recipient refused: )?4\d\d\b')
+
+# Corpus entry: (expected category, recipient domain, failure text)
+Sample = Tuple[str, Optional[str], str]
+
+
+def load_corpus(path: str = CORPUS) -> List[Sample]:
+    """Read the tab-separated corpus, skipping comments."""
+    samples = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip() or line.startswith('#'):
+                continue
+            category, domain, message = line.rstrip('\n').split('\t', 2)
+            samples.append((category, None if domain == '-' else domain, message))
+    return samples
+
+
+def legacy_classify(error_message: str) -> Tuple[Optional[BounceType], bool]:
+    """The substring scan used before the classifier (bounce type; retry unless hard)."""
+    error_lower = error_message.lower()
+    for indicator in ('user unknown', 'no such user', 'invalid recipient', 'recipient address rejected',
+                      'user not found', 'does not exist', 'invalid mailbox', 'unknown user'):
+        if indicator in error_lower:
+            return BounceType.HARD, False
+    return BounceType.SOFT, True
+
+
+def sequential_classifier(classifier: BounceClassifier) -> Callable[[str, Optional[str]], str]:
+    """The built-in text rules alone, matched case-insensitively, for comparison."""
+    patterns = [
+        (re.compile(rule['pattern'], re.IGNORECASE), rule['category'])
+        for spec in DEFAULT_RULES['providers'].values() for rule in spec['rules']
+    ] + [(re.compile(rule['pattern'], re.IGNORECASE), rule['category']) for rule in DEFAULT_RULES['rules']]
+
+    def classify(message: str, domain: Optional[str]) -> str:
+        for pattern, category in patterns:
+            if pattern.search(message):
+                return category
+        return 'unknown'
+    return classify
+
+
+def timed(label: str, samples: List[Sample], rounds: int, classify: Callable[[str, Optional[str]], object]):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for _, domain, message in samples:
+            classify(message, domain)
+    elapsed = time.perf_counter() - started
+    count = rounds * len(samples)
+    print(f"{label:<28} {count / elapsed:>12,.0f} msg/s  {elapsed / count * 1e6:>8.2f} us/msg")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=2000, help='passes over the corpus')
+    parser.add_argument('--rules', help='JSON rules file to add to the built-in rules')
+    parser.add_argument('--corpus', default=CORPUS)
+    parser.add_argument('--verbose', action='store_true', help='list misclassified messages')
+    args = parser.parse_args()
+
+    samples = load_corpus(args.corpus)
+    classifier = BounceClassifier.from_file(args.rules)
+    print(f"{len(samples)} messages x {args.rounds} rounds\n")
+
+    timed('legacy substring scan', samples, args.rounds, lambda message, domain: legacy_classify(message))
+    timed('text rules only', samples, args.rounds, sequential_classifier(classifier))
+    timed('bounce classifier', samples, args.rounds, lambda message, domain: classifier.classify(message, domain=domain))
+
+    category_hits = type_hits = retry_hits = legacy_type_hits = legacy_retry_hits = 0
+    for category, domain, message in samples:
+        verdict = classifier.classify(message, domain=domain)
+        expected_type, expected_retry = classifier.categories[category]
+        if REPLY_CLASS_4.match(message):
+            expected_retry = True
+            expected_type = BounceType.SOFT if expected_type == BounceType.HARD else expected_type
+        legacy_type, legacy_retry = legacy_classify(message)
+
+        category_hits += verdict.category == category
+        type_hits += verdict.bounce_type == expected_type
+        retry_hits += verdict.retryable == expected_retry
+        legacy_type_hits += legacy_type == expected_type
+        legacy_retry_hits += legacy_retry == expected_retry
+        if args.verbose and verdict.category != category:
+            print(f"  expected {category}, got {verdict.diagnostic}: {message[:100]}")
+
+    total = len(samples)
+    print(f"\n{'':<28} {'category':>9} {'type':>9} {'retry':>9}")
+    print(f"{'legacy substring scan':<28} {'-':>9} {legacy_type_hits / total:>9.1%} {legacy_retry_hits / total:>9.1%}")
+    print(f"{'bounce classifier':<28} {category_hits / total:>9.1%} {type_hits / total:>9.1%} {retry_hits / total:>9.1%}")
+
+
+if __name__ == '__main__':
+    main()
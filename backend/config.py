@@ -21,6 +21,63 @@ class Config:
     
     # Base URL for tracking links
     BASE_URL = os.environ.get('BASE_URL', 'http://localhost:5001')
+    
+    # Campaign attachments
+    UPLOAD_DIR = os.environ.get('UPLOAD_DIR', 'uploads')
+    MAX_ATTACHMENT_SIZE = int(os.environ.get('MAX_ATTACHMENT_SIZE') or 10 * 1024 * 1024)
+    
+    # Scheduled campaigns: seconds before send time to prepare them and to open
+    # SMTP connections (keep the latter below the connection pool's idle timeout)
+    SCHEDULER_LEAD_TIME = int(os.environ.get('SCHEDULER_LEAD_TIME', 15 * 60))
+    SCHEDULER_PREWARM_TIME = int(os.environ.get('SCHEDULER_PREWARM_TIME', 30))
+    
+    # Crash-safe spool of rendered messages for campaigns being sent
+    SPOOL_DIR = os.environ.get('SPOOL_DIR', 'spool')
+    
+    # DKIM signing processes (unset = one per CPU, 0 = sign on the sending thread)
+    DKIM_SIGNING_WORKERS = int(os.environ['DKIM_SIGNING_WORKERS']) if os.environ.get('DKIM_SIGNING_WORKERS') else None
+    
+    # Send pipeline: worker threads per stage and batches buffered between stages
+    SEND_RENDER_WORKERS = int(os.environ.get('SEND_RENDER_WORKERS', 2))
+    SEND_SIGN_WORKERS = int(os.environ.get('SEND_SIGN_WORKERS', 2))
+    SEND_DELIVER_WORKERS = int(os.environ.get('SEND_DELIVER_WORKERS', 2))
+    SEND_PIPELINE_QUEUE_SIZE = int(os.environ.get('SEND_PIPELINE_QUEUE_SIZE', 4))
+    
+    # Per receiving domain delivery limits: JSON object of {"<group>": {"concurrency": n, "rate": per second}}
+    # merged over the built-in gmail / outlook / yahoo / default limits (see app/services/domain_throttle.py)
+    SEND_DOMAIN_LIMITS = os.environ.get('SEND_DOMAIN_LIMITS')
+    
+    # Adaptive (AIMD) delivery per SMTP account: concurrent deliveries for accounts that have not
+    # learned their own yet, and the most it may grow to (also the account's delivery worker threads)
+    SEND_ACCOUNT_INITIAL_CONCURRENCY = int(os.environ.get('SEND_ACCOUNT_INITIAL_CONCURRENCY', 2))
+    SEND_ACCOUNT_MAX_CONCURRENCY = int(os.environ.get('SEND_ACCOUNT_MAX_CONCURRENCY', 8))
+    
+    # SMTP account circuit breaker: consecutive connection / login failures that open it, and seconds
+    # it stays open before one probe is let through (doubling after each failed probe, up to the maximum)
+    SMTP_BREAKER_THRESHOLD = int(os.environ.get('SMTP_BREAKER_THRESHOLD', 5))
+    SMTP_BREAKER_COOLDOWN = int(os.environ.get('SMTP_BREAKER_COOLDOWN', 60))
+    SMTP_BREAKER_MAX_COOLDOWN = int(os.environ.get('SMTP_BREAKER_MAX_COOLDOWN', 15 * 60))
+    
+    # Seconds to wait on SMTP servers (accounts may override them): TCP connect, TLS and login;
+    # the reply to each command; a message upload and the reply to it
+    SMTP_CONNECT_TIMEOUT = int(os.environ.get('SMTP_CONNECT_TIMEOUT', 30))
+    SMTP_COMMAND_TIMEOUT = int(os.environ.get('SMTP_COMMAND_TIMEOUT', 60))
+    SMTP_DATA_TIMEOUT = int(os.environ.get('SMTP_DATA_TIMEOUT', 180))
+    
+    # Seconds a campaign send may run before it is paused (campaigns may override it; 0 = no limit)
+    SEND_TIME_LIMIT = int(os.environ.get('SEND_TIME_LIMIT', 0))
+    
+    # Seconds after which a send ledger claim without a result counts as abandoned (0 = never)
+    SEND_CLAIM_TIMEOUT = int(os.environ.get('SEND_CLAIM_TIMEOUT', 60 * 60))
+    
+    # Retry queue for temporary failures: attempts per recipient (campaigns may
+    # override it) and exponential backoff bounds, in seconds
+    SEND_MAX_ATTEMPTS = int(os.environ.get('SEND_MAX_ATTEMPTS', 4))
+    SEND_RETRY_BASE_DELAY = int(os.environ.get('SEND_RETRY_BASE_DELAY', 5 * 60))
+    SEND_RETRY_MAX_DELAY = int(os.environ.get('SEND_RETRY_MAX_DELAY', 6 * 60 * 60))
+
+    # JSON file of bounce classification rules added to the built-in ones (see app/services/bounce_classifier.py)
+    BOUNCE_RULES_FILE = os.environ.get('BOUNCE_RULES_FILE')
 
 class DevelopmentConfig(Config):
     """Development configuration."""
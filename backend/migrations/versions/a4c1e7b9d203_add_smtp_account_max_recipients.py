@@ -0,0 +1,26 @@
+"""Add max recipients per message to SMTP accounts
+
+Revision ID: a4c1e7b9d203
+Revises: 9280cb5c7e10
+Create Date: 2026-10-19 10:12:31.402118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4c1e7b9d203'
+down_revision = '9280cb5c7e10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('smtp_accounts', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('max_recipients_per_message', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('smtp_accounts', schema=None) as batch_op:
+        batch_op.drop_column('max_recipients_per_message')
@@ -0,0 +1,36 @@
+"""Add SMTP timeouts to SMTP accounts and a send time limit to campaigns
+
+Revision ID: a6e1d4c9f207
+Revises: f3d9b6e1c824
+Create Date: 2026-10-19 23:48:12.603517
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6e1d4c9f207'
+down_revision = 'f3d9b6e1c824'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('smtp_accounts', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('connect_timeout', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('command_timeout', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('data_timeout', sa.Integer(), nullable=True))
+
+    with op.batch_alter_table('campaigns', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('send_time_limit', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('campaigns', schema=None) as batch_op:
+        batch_op.drop_column('send_time_limit')
+
+    with op.batch_alter_table('smtp_accounts', schema=None) as batch_op:
+        batch_op.drop_column('data_timeout')
+        batch_op.drop_column('command_timeout')
+        batch_op.drop_column('connect_timeout')
@@ -0,0 +1,37 @@
+"""Add send ledger claims and a unique (campaign, contact) key to campaign recipients
+
+Revision ID: a9d4e6f28c53
+Revises: f7a2c9e0b315
+Create Date: 2026-10-19 18:12:44.905318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a9d4e6f28c53'
+down_revision = 'f7a2c9e0b315'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Keep the first row of any duplicated (campaign, contact) pair
+    op.execute(
+        "DELETE FROM campaign_recipients WHERE id NOT IN ("
+        "SELECT MIN(id) FROM campaign_recipients GROUP BY campaign_id, contact_id)"
+    )
+    with op.batch_alter_table('campaign_recipients', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('claim_token', sa.String(length=32), nullable=True))
+        batch_op.add_column(sa.Column('claimed_at', sa.DateTime(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_campaign_recipients_claim_token'), ['claim_token'], unique=False)
+        batch_op.create_unique_constraint('uq_campaign_recipients_campaign_contact', ['campaign_id', 'contact_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('campaign_recipients', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_campaign_recipients_campaign_contact', type_='unique')
+        batch_op.drop_index(batch_op.f('ix_campaign_recipients_claim_token'))
+        batch_op.drop_column('claimed_at')
+        batch_op.drop_column('claim_token')
@@ -0,0 +1,36 @@
+"""Add soft-bounce retry queue fields to email logs and campaigns
+
+Revision ID: b3f8c1d5e972
+Revises: a9d4e6f28c53
+Create Date: 2026-10-19 19:03:27.614052
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3f8c1d5e972'
+down_revision = 'a9d4e6f28c53'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('email_logs', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('attempts', sa.Integer(), nullable=True, server_default='1'))
+        batch_op.add_column(sa.Column('next_retry_at', sa.DateTime(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_email_logs_next_retry_at'), ['next_retry_at'], unique=False)
+
+    with op.batch_alter_table('campaigns', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('max_send_attempts', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('campaigns', schema=None) as batch_op:
+        batch_op.drop_column('max_send_attempts')
+
+    with op.batch_alter_table('email_logs', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_email_logs_next_retry_at'))
+        batch_op.drop_column('next_retry_at')
+        batch_op.drop_column('attempts')
@@ -0,0 +1,26 @@
+"""Add bytes sent to campaigns
+
+Revision ID: b7e2d94c1f58
+Revises: a4c1e7b9d203
+Create Date: 2026-10-19 11:02:47.519304
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e2d94c1f58'
+down_revision = 'a4c1e7b9d203'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('campaigns', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('bytes_sent', sa.BigInteger(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('campaigns', schema=None) as batch_op:
+        batch_op.drop_column('bytes_sent')
@@ -0,0 +1,43 @@
+"""Add suppressions table
+
+Revision ID: c6e1a4f93d28
+Revises: b3f8c1d5e972
+Create Date: 2026-10-19 20:41:08.315527
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c6e1a4f93d28'
+down_revision = 'b3f8c1d5e972'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('suppressions',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('email', sa.String(length=120), nullable=False),
+    sa.Column('reason', sa.Enum('HARD_BOUNCE', 'COMPLAINT', 'UNSUBSCRIBE', name='suppressionreason'), nullable=False),
+    sa.Column('campaign_id', sa.Integer(), nullable=True),
+    sa.Column('detail', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['campaign_id'], ['campaigns.id'], ondelete='SET NULL'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id', 'email', name='uq_suppressions_user_email')
+    )
+    with op.batch_alter_table('suppressions', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_suppressions_email'), ['email'], unique=False)
+        batch_op.create_index(batch_op.f('ix_suppressions_user_id'), ['user_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('suppressions', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_suppressions_user_id'))
+        batch_op.drop_index(batch_op.f('ix_suppressions_email'))
+
+    op.drop_table('suppressions')
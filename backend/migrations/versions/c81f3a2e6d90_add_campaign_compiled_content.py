@@ -0,0 +1,32 @@
+"""Add compiled content to campaigns
+
+Revision ID: c81f3a2e6d90
+Revises: b7e2d94c1f58
+Create Date: 2026-10-19 11:48:05.287611
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c81f3a2e6d90'
+down_revision = 'b7e2d94c1f58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('campaigns', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('compiled_html', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('compiled_text', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('content_hash', sa.String(length=64), nullable=True))
+        batch_op.add_column(sa.Column('compiled_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('campaigns', schema=None) as batch_op:
+        batch_op.drop_column('compiled_at')
+        batch_op.drop_column('content_hash')
+        batch_op.drop_column('compiled_text')
+        batch_op.drop_column('compiled_html')
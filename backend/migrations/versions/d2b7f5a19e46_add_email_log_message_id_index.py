@@ -0,0 +1,26 @@
+"""Index email logs by Message-ID for feedback ingestion
+
+Revision ID: d2b7f5a19e46
+Revises: c6e1a4f93d28
+Create Date: 2026-10-19 21:26:44.902183
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2b7f5a19e46'
+down_revision = 'c6e1a4f93d28'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('email_logs', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_email_logs_message_id'), ['message_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('email_logs', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_email_logs_message_id'))
@@ -0,0 +1,41 @@
+"""Add campaign attachments
+
+Revision ID: d3a9f1c27b44
+Revises: c81f3a2e6d90
+Create Date: 2026-10-19 13:12:40.518207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3a9f1c27b44'
+down_revision = 'c81f3a2e6d90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('campaign_attachments',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('campaign_id', sa.Integer(), nullable=False),
+    sa.Column('original_filename', sa.String(length=255), nullable=False),
+    sa.Column('file_path', sa.String(length=500), nullable=False),
+    sa.Column('file_size', sa.Integer(), nullable=True),
+    sa.Column('mime_type', sa.String(length=100), nullable=True),
+    sa.Column('encoded_path', sa.String(length=500), nullable=True),
+    sa.Column('encoded_size', sa.Integer(), nullable=True),
+    sa.Column('uploaded_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['campaign_id'], ['campaigns.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('campaign_attachments', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_campaign_attachments_campaign_id'), ['campaign_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('campaign_attachments', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_campaign_attachments_campaign_id'))
+
+    op.drop_table('campaign_attachments')
@@ -0,0 +1,30 @@
+"""Add DKIM signing keys to SMTP accounts
+
+Revision ID: e5b8c3d41a07
+Revises: d3a9f1c27b44
+Create Date: 2026-10-19 14:03:22.906154
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b8c3d41a07'
+down_revision = 'd3a9f1c27b44'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('smtp_accounts', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('dkim_domain', sa.String(length=255), nullable=True))
+        batch_op.add_column(sa.Column('dkim_selector', sa.String(length=63), nullable=True))
+        batch_op.add_column(sa.Column('dkim_private_key', sa.Text(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('smtp_accounts', schema=None) as batch_op:
+        batch_op.drop_column('dkim_private_key')
+        batch_op.drop_column('dkim_selector')
+        batch_op.drop_column('dkim_domain')
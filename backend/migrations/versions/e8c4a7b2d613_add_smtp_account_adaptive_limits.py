@@ -0,0 +1,30 @@
+"""Add learned adaptive send limits to SMTP accounts
+
+Revision ID: e8c4a7b2d613
+Revises: d2b7f5a19e46
+Create Date: 2026-10-19 22:14:08.517342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8c4a7b2d613'
+down_revision = 'd2b7f5a19e46'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('smtp_accounts', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('adaptive_concurrency', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('adaptive_rate', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('adaptive_updated_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('smtp_accounts', schema=None) as batch_op:
+        batch_op.drop_column('adaptive_updated_at')
+        batch_op.drop_column('adaptive_rate')
+        batch_op.drop_column('adaptive_concurrency')
@@ -0,0 +1,26 @@
+"""Add SMTP account pool option to campaigns
+
+Revision ID: f3d9b6e1c824
+Revises: e8c4a7b2d613
+Create Date: 2026-10-19 23:02:37.184265
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3d9b6e1c824'
+down_revision = 'e8c4a7b2d613'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('campaigns', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('use_smtp_pool', sa.Boolean(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('campaigns', schema=None) as batch_op:
+        batch_op.drop_column('use_smtp_pool')
@@ -0,0 +1,28 @@
+"""Add delivery transport selection to SMTP accounts
+
+Revision ID: f7a2c9e0b315
+Revises: e5b8c3d41a07
+Create Date: 2026-10-19 16:41:08.337520
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f7a2c9e0b315'
+down_revision = 'e5b8c3d41a07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('smtp_accounts', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('transport', sa.String(length=20), nullable=True, server_default='smtp'))
+        batch_op.add_column(sa.Column('transport_url', sa.String(length=500), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('smtp_accounts', schema=None) as batch_op:
+        batch_op.drop_column('transport_url')
+        batch_op.drop_column('transport')
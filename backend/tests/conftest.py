@@ -0,0 +1,95 @@
+"""
+Shared fixtures: the app on an in-memory database (recreated per test), a
+user, campaign and SMTP account factories and a local fake SMTP server.
+"""
+
+import json
+import pytest
+from app import create_app, db
+from app.models.campaign import Campaign
+from app.models.smtp_account import SMTPAccount
+from app.models.smtp_settings import SMTPSettings
+from app.models.user import User, UserRole
+from app.services import circuit_breaker
+from app.services.audience_service import AudienceService
+from app.services.send_control import SendControl
+from tests.fake_smtp import FakeSMTPServer
+
+
+@pytest.fixture(scope='session')
+def app():
+    app = create_app('testing')
+    # No per-domain pacing: the tests send to a single fake domain
+    app.config['SEND_DOMAIN_LIMITS'] = json.dumps({'default': {'rate': 0, 'concurrency': 0}})
+    return app
+
+
+@pytest.fixture(autouse=True)
+def database(app, tmp_path):
+    app.config['SPOOL_DIR'] = str(tmp_path / 'spool')
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        yield db
+        db.session.remove()
+    # Process-wide send state is keyed by IDs the next test reuses
+    circuit_breaker._breakers.clear()
+    SendControl._requests.clear()
+    SendControl._polled_at.clear()
+
+
+@pytest.fixture
+def user():
+    user = User(email='sender@example.com', password='password123', first_name='Test',
+                last_name='Sender', role=UserRole.ADMIN, is_active=True)
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+@pytest.fixture
+def smtp_server():
+    server = FakeSMTPServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def make_account(user):
+    """Create an SMTP account on a local port."""
+    def make(port: int, name: str = 'relay') -> SMTPAccount:
+        account = SMTPAccount(name=name, provider='custom', host='127.0.0.1', port=port, username='user',
+                              password='password', encryption='none', from_name='Sender',
+                              from_email='sender@example.com', created_by_admin_id=user.id,
+                              is_active=True, is_verified=True)
+        db.session.add(account)
+        db.session.commit()
+        return account
+    return make
+
+
+@pytest.fixture
+def smtp_settings(user, smtp_server):
+    """Global SMTP settings (used by tracked sends) pointing at the fake server."""
+    settings = SMTPSettings(host='127.0.0.1', port=smtp_server.port, username='user', password='password',
+                            encryption='none', sender_email='sender@example.com', sender_name='Sender',
+                            is_configured=True, user_id=user.id)
+    db.session.add(settings)
+    db.session.commit()
+    return settings
+
+
+@pytest.fixture
+def make_campaign(user):
+    """Create a campaign with ``count`` recipients (r0@example.com, ...)."""
+    def make(count: int, **kwargs) -> Campaign:
+        campaign = Campaign(user_id=user.id, name='Test campaign', subject='Hello {first_name}',
+                            html_content='<p>Hello {first_name}</p>', sender_email='sender@example.com', **kwargs)
+        db.session.add(campaign)
+        db.session.flush()
+        AudienceService.sync_campaign_audience(
+            campaign.id, user.id, ','.join(f'r{i}@example.com' for i in range(count))
+        )
+        db.session.commit()
+        return campaign
+    return make
@@ -0,0 +1,108 @@
+"""
+Fake SMTP Server
+
+Minimal local ESMTP server for the send tests. It answers EHLO (with
+PIPELINING), AUTH, MAIL, RCPT, DATA, RSET, NOOP and QUIT, keeps every
+accepted message, and can drop the connection at DATA to stand in for a
+relay that keeps failing mid-transaction.
+"""
+
+import socket
+import threading
+from typing import Callable, List, Optional, Tuple
+
+
+class FakeSMTPServer:
+    """SMTP server on a free local port, one thread per connection."""
+
+    def __init__(self):
+        # (recipients, message data) of every accepted message
+        self.messages: List[Tuple[List[str], bytes]] = []
+        # Close the connection instead of accepting message data
+        self.drop_data = False
+        # Called with the number of messages accepted so far, after each one
+        self.on_message: Optional[Callable[[int], None]] = None
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._sock = socket.create_server(('127.0.0.1', 0))
+        self.port = self._sock.getsockname()[1]
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    @property
+    def recipients(self) -> List[str]:
+        """Recipients of every accepted message, in delivery order."""
+        with self._lock:
+            return [recipient for recipients, _ in self.messages for recipient in recipients]
+
+    def close(self):
+        self._sock.close()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            with self._lock:
+                self.connections += 1
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn: socket.socket):
+        stream = conn.makefile('rb')
+
+        def reply(line: str):
+            conn.sendall(line.encode() + b'\r\n')
+
+        try:
+            reply('220 fake ESMTP')
+            recipients = []
+            while True:
+                line = stream.readline()
+                if not line:
+                    return
+                command = line.decode().strip()
+                verb = command.upper()
+                if verb.startswith('EHLO'):
+                    conn.sendall(b'250-fake\r\n250-PIPELINING\r\n250-SIZE 10000000\r\n250 AUTH PLAIN LOGIN\r\n')
+                elif verb.startswith('AUTH'):
+                    reply('235 2.7.0 Authenticated')
+                elif verb.startswith('MAIL'):
+                    recipients = []
+                    reply('250 2.1.0 OK')
+                elif verb.startswith('RCPT'):
+                    recipients.append(command.split('<', 1)[1].split('>', 1)[0])
+                    reply('250 2.1.5 OK')
+                elif verb == 'DATA':
+                    if not recipients:
+                        reply('554 5.5.1 No valid recipients')
+                        continue
+                    if self.drop_data:
+                        return
+                    reply('354 Go ahead')
+                    data = []
+                    for data_line in iter(stream.readline, b''):
+                        if data_line == b'.\r\n':
+                            break
+                        data.append(data_line[1:] if data_line.startswith(b'..') else data_line)
+                    with self._lock:
+                        self.messages.append((recipients, b''.join(data)))
+                        accepted = len(self.messages)
+                    recipients = []
+                    reply('250 2.0.0 Queued')
+                    if self.on_message is not None:
+                        self.on_message(accepted)
+                elif verb == 'RSET':
+                    recipients = []
+                    reply('250 2.0.0 OK')
+                elif verb == 'NOOP':
+                    reply('250 2.0.0 OK')
+                elif verb == 'QUIT':
+                    reply('221 2.0.0 Bye')
+                    return
+                else:
+                    reply('502 5.5.2 Command not recognized')
+        except OSError:
+            pass
+        finally:
+            stream.close()
+            conn.close()
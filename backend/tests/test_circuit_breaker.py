@@ -0,0 +1,36 @@
+from app.services.circuit_breaker import CLOSED, OPEN, CircuitBreaker
+
+
+def test_opens_after_threshold_failures():
+    breaker = CircuitBreaker(threshold=2, cooldown=60)
+    breaker.record_failure('connection lost')
+    assert breaker.state == CLOSED
+    breaker.record_failure('connection lost')
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+
+
+def test_connect_does_not_reset_failures_of_a_closed_breaker():
+    breaker = CircuitBreaker(threshold=2, cooldown=60)
+    breaker.record_failure('connection lost')
+    # Reconnecting to a relay that drops every transaction is not a recovery
+    breaker.record_connect()
+    breaker.record_failure('connection lost')
+    assert breaker.state == OPEN
+
+
+def test_delivery_resets_failures():
+    breaker = CircuitBreaker(threshold=2, cooldown=60)
+    breaker.record_failure('connection lost')
+    breaker.record_success()
+    breaker.record_failure('connection lost')
+    assert breaker.state == CLOSED
+
+
+def test_connected_probe_closes_a_half_open_breaker():
+    breaker = CircuitBreaker(threshold=1, cooldown=0)
+    breaker.record_failure('connection refused')
+    assert breaker.allow()
+    breaker.record_connect()
+    assert breaker.state == CLOSED
+    assert breaker.failures == 0
@@ -0,0 +1,75 @@
+import threading
+from app import db
+from app.models.campaign import Campaign, CampaignRecipient, CampaignStatus
+from app.models.smtp_account import UserSMTPAssignment
+from app.services.email_service import EmailService
+from tests.fake_smtp import FakeSMTPServer
+
+# Seconds a send may take before the test counts it as stuck
+SEND_TIMEOUT = 60
+
+
+def send_in_thread(app, campaign_id, user_id):
+    """Run EmailService.send_campaign, giving up (and failing) if it does not finish."""
+    result = []
+
+    def run():
+        with app.app_context():
+            result.append(EmailService.send_campaign(campaign_id, user_id))
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(SEND_TIMEOUT)
+    assert not thread.is_alive(), "send did not finish"
+    db.session.expire_all()
+    return result[0]
+
+
+def test_relay_dropping_every_connection_pauses_the_send(app, user, smtp_server, make_account, make_campaign):
+    smtp_server.drop_data = True
+    account = make_account(smtp_server.port)
+    campaign = make_campaign(30, smtp_account_id=account.id)
+
+    success, _, results = send_in_thread(app, campaign.id, user.id)
+
+    assert success
+    assert results['stopped'] == CampaignStatus.PAUSED.value
+    assert db.session.get(Campaign, campaign.id).status == CampaignStatus.PAUSED
+    assert smtp_server.messages == []
+    # Nothing was recorded as failed, and nothing stays claimed: a resume sends to everyone
+    recipients = CampaignRecipient.query.filter_by(campaign_id=campaign.id).all()
+    assert not any(r.email_sent or r.email_failed for r in recipients)
+    assert all(r.claim_token is None for r in recipients)
+
+
+def test_resume_after_the_relay_recovers_sends_to_everyone(app, user, smtp_server, make_account, make_campaign):
+    smtp_server.drop_data = True
+    account = make_account(smtp_server.port)
+    campaign = make_campaign(30, smtp_account_id=account.id)
+    send_in_thread(app, campaign.id, user.id)
+
+    smtp_server.drop_data = False
+    success, _, results = send_in_thread(app, campaign.id, user.id)
+
+    assert success
+    assert results['stopped'] is None
+    assert sorted(smtp_server.recipients) == sorted(f'r{i}@example.com' for i in range(30))
+
+
+def test_failed_relay_fails_over_to_another_account(app, user, smtp_server, make_account, make_campaign):
+    smtp_server.drop_data = True
+    fallback_server = FakeSMTPServer()
+    try:
+        account = make_account(smtp_server.port, name='failing')
+        fallback = make_account(fallback_server.port, name='fallback')
+        db.session.add(UserSMTPAssignment(user_id=user.id, smtp_account_id=fallback.id, assigned_by_admin_id=user.id))
+        db.session.commit()
+        campaign = make_campaign(30, smtp_account_id=account.id, use_smtp_pool=True)
+
+        success, _, results = send_in_thread(app, campaign.id, user.id)
+
+        assert success
+        assert results['stopped'] is None
+        assert sorted(fallback_server.recipients) == sorted(f'r{i}@example.com' for i in range(30))
+    finally:
+        fallback_server.close()
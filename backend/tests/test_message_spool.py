@@ -0,0 +1,106 @@
+import collections
+import threading
+import pytest
+from app import db
+from app.models.campaign import CampaignRecipient, CampaignStatus
+from app.services.email_tracking_service import EmailTrackingService
+from app.services.message_spool import MessageSpool, SpoolBusyError
+from app.services.send_control import SendControl
+from app.services.send_ledger import SendLedger
+from app.services.smtp_client import Envelope
+
+# Seconds to wait for a send running in another thread
+SEND_TIMEOUT = 60
+
+
+def all_recipients(count):
+    return sorted(f'r{i}@example.com' for i in range(count))
+
+
+def test_spool_is_locked_while_open():
+    spool = MessageSpool(1)
+    spool.append([(Envelope('sender@example.com', ['r0@example.com'], b'Subject: hi\r\n\r\nhi'), {'n': 0})])
+    with pytest.raises(SpoolBusyError):
+        MessageSpool(1)
+    spool.close()
+
+    resumed = MessageSpool(1)
+    assert resumed.resumed
+    assert [meta['n'] for meta in resumed.metadata()] == [0]
+    resumed.discard()
+
+
+def test_second_tracked_send_is_refused_while_the_first_runs(app, user, smtp_server, smtp_settings, make_campaign):
+    campaign = make_campaign(50)
+    campaign_id = campaign.id
+    started, proceed = threading.Event(), threading.Event()
+
+    def hold_first_message(accepted):
+        if accepted == 1:
+            started.set()
+            proceed.wait(SEND_TIMEOUT)
+
+    smtp_server.on_message = hold_first_message
+    results = []
+
+    def first_send():
+        with app.app_context():
+            results.append(EmailTrackingService.send_campaign_with_tracking(campaign_id, user.id))
+
+    thread = threading.Thread(target=first_send, daemon=True)
+    thread.start()
+    try:
+        assert started.wait(SEND_TIMEOUT)
+        success, message, _ = EmailTrackingService.send_campaign_with_tracking(campaign_id, user.id)
+    finally:
+        proceed.set()
+        thread.join(SEND_TIMEOUT)
+
+    assert not success
+    assert message == f"Campaign {campaign_id} is already being sent"
+    assert not thread.is_alive()
+    assert results[0][0]
+    assert sorted(smtp_server.recipients) == all_recipients(50)
+
+
+def test_resumed_spool_skips_recipients_claimed_by_another_send(user, smtp_server, smtp_settings, make_campaign):
+    campaign = make_campaign(300)
+    campaign_id = campaign.id
+
+    def pause_after(accepted):
+        if accepted == 20:
+            SendControl.request(campaign_id, CampaignStatus.PAUSED)
+
+    smtp_server.on_message = pause_after
+    _, _, results = EmailTrackingService.send_campaign_with_tracking(campaign_id, user.id)
+    assert results['stopped'] == CampaignStatus.PAUSED.value
+    first_run = set(smtp_server.recipients)
+    assert 0 < len(first_run) < 300
+
+    # Another send of the campaign holds some of the spooled, undelivered recipients
+    spool = MessageSpool(campaign_id)
+    try:
+        spooled = [record.meta['recipient'][0] for records in spool.read(spool.offset, 100) for record in records]
+    finally:
+        spool.close()
+    assert len(spooled) >= 10
+    taken = spooled[:10]
+    assert SendLedger.claim(campaign_id, taken, 'other-send') == set(taken)
+    taken_emails = {r.contact.email for r in CampaignRecipient.query.filter(CampaignRecipient.id.in_(taken))}
+
+    smtp_server.on_message = None
+    SendControl.clear(campaign_id)
+    success, _, results = EmailTrackingService.send_campaign_with_tracking(campaign_id, user.id)
+
+    assert success
+    assert results['stopped'] is None
+    delivered = collections.Counter(smtp_server.recipients)
+    assert max(delivered.values()) == 1
+    assert sorted(delivered) == sorted(set(all_recipients(300)) - taken_emails)
+    db.session.expire_all()
+    # The other send's claims are untouched, and this send left none of its own behind
+    still_claimed = CampaignRecipient.query.filter(CampaignRecipient.campaign_id == campaign_id,
+                                                   CampaignRecipient.claim_token.isnot(None),
+                                                   CampaignRecipient.email_sent.isnot(True))
+    assert sorted(r.id for r in still_claimed) == sorted(taken)
+    assert all(r.claim_token == 'other-send' for r in still_claimed)
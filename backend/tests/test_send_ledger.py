@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+from app import db
+from app.models.campaign import CampaignRecipient
+from app.services.send_ledger import SendLedger
+
+
+def recipient_ids(campaign):
+    return [r.id for r in CampaignRecipient.query.filter_by(campaign_id=campaign.id).order_by(CampaignRecipient.id)]
+
+
+def test_claim_reserves_recipients_for_one_send(make_campaign):
+    campaign = make_campaign(4)
+    ids = recipient_ids(campaign)
+
+    assert SendLedger.claim(campaign.id, ids[:3], 'first') == set(ids[:3])
+    # Another send only gets what is left; the claiming send keeps its own claims
+    assert SendLedger.claim(campaign.id, ids, 'second') == {ids[3]}
+    assert SendLedger.claim(campaign.id, ids, 'first') == set(ids[:3])
+
+
+def test_recorded_recipients_cannot_be_claimed(make_campaign):
+    campaign = make_campaign(3)
+    ids = recipient_ids(campaign)
+    CampaignRecipient.query.filter(CampaignRecipient.id == ids[0]).update({CampaignRecipient.email_sent: True})
+    CampaignRecipient.query.filter(CampaignRecipient.id == ids[1]).update({CampaignRecipient.email_failed: True})
+    db.session.commit()
+
+    assert SendLedger.claim(campaign.id, ids, 'send') == {ids[2]}
+
+
+def test_release_frees_unrecorded_claims_only(make_campaign):
+    campaign = make_campaign(3)
+    ids = recipient_ids(campaign)
+    SendLedger.claim(campaign.id, ids, 'first')
+    CampaignRecipient.query.filter(CampaignRecipient.id == ids[0]).update({CampaignRecipient.email_sent: True})
+    db.session.commit()
+
+    assert SendLedger.release(campaign.id, 'first') == 2
+    assert SendLedger.claim(campaign.id, ids, 'second') == set(ids[1:])
+    # The recorded recipient keeps the claim of the send that reached it
+    assert db.session.get(CampaignRecipient, ids[0]).claim_token == 'first'
+
+
+def test_release_leaves_claims_of_other_sends(make_campaign):
+    campaign = make_campaign(2)
+    ids = recipient_ids(campaign)
+    SendLedger.claim(campaign.id, ids[:1], 'first')
+    SendLedger.claim(campaign.id, ids[1:], 'second')
+
+    assert SendLedger.release(campaign.id, 'first') == 1
+    assert SendLedger.claim(campaign.id, ids, 'third') == {ids[0]}
+
+
+def test_abandoned_claim_can_be_taken_over(app, make_campaign):
+    campaign = make_campaign(2)
+    ids = recipient_ids(campaign)
+    SendLedger.claim(campaign.id, ids, 'dead')
+    timeout = app.config['SEND_CLAIM_TIMEOUT']
+    CampaignRecipient.query.filter(CampaignRecipient.id == ids[0]).update(
+        {CampaignRecipient.claimed_at: datetime.utcnow() - timedelta(seconds=timeout + 60)}
+    )
+    db.session.commit()
+
+    assert SendLedger.claim(campaign.id, ids, 'live') == {ids[0]}